@@ -1,5 +1,8 @@
 # app.py — Router condicional (requiere Streamlit >= 1.41 para st.Page/st.navigation)
 import streamlit as st
+from modules.core import elegir_salon
+from modules.sesiones import restaurar_sesion, escribir_cookie_pendiente
+from modules import perfil
 
 st.set_page_config(page_title="Citas — Salón de Belleza", page_icon="💅", layout="wide")
 
@@ -98,27 +101,37 @@ div[data-baseweb="notification"] {
 h1, h2, h3, h4 { color: #111827; }
 """
 
-st.markdown(f"<style>{CUSTOM_CSS}</style>", unsafe_allow_html=True)
+# Perfil opcional de cada ejecución (CITAS_PERFIL=1 o interruptor de la dueña): ver modules/perfil.py
+with perfil.ejecucion():
+    st.markdown(f"<style>{CUSTOM_CSS}</style>", unsafe_allow_html=True)
 
-# Estado base
-st.session_state.setdefault("role", None)
-st.session_state.setdefault("paciente", None)
+    # Estado base
+    st.session_state.setdefault("role", None)
+    st.session_state.setdefault("paciente", None)
 
-# Define páginas
-home      = st.Page("pages/0_Login.py",              title="Inicio",              icon="💅")
-pac_dash  = st.Page("pages/1_Paciente_Dashboard.py", title="Cliente — Agenda",     icon="📅")
-adm_panel = st.Page("pages/2_Carmen_Admin.py",       title="Dueña — Panel",       icon="🗂️")
+    # Salón (subdominio o ?salon=): esquema de BD, configuración y sesión
+    elegir_salon()
 
-role = st.session_state["role"]
+    # Sesión persistente (cookie firmada) → evita repetir login/bcrypt al recargar
+    restaurar_sesion()
+    escribir_cookie_pendiente()
 
-if role == "paciente":
-    nav = st.navigation([pac_dash])
-elif role == "admin":
-    nav = st.navigation([adm_panel])
-else:
-    nav = st.navigation([home])
+    # Define páginas
+    home      = st.Page("pages/0_Login.py",              title="Inicio",              icon="💅")
+    pac_dash  = st.Page("pages/1_Paciente_Dashboard.py", title="Cliente — Agenda",     icon="📅")
+    adm_panel = st.Page("pages/2_Carmen_Admin.py",       title="Dueña — Panel",       icon="🗂️")
 
-nav.run()
+    role = st.session_state["role"]
+
+    if role == "paciente":
+        nav = st.navigation([pac_dash])
+    elif role == "admin":
+        nav = st.navigation([adm_panel])
+    else:
+        nav = st.navigation([home])
+
+    perfil.pagina(nav.title)
+    nav.run()
 
 
 
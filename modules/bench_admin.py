@@ -0,0 +1,172 @@
+# modules/bench_admin.py — Consultas a la BD por interacción en el panel de la dueña
+#
+# Abre pages/2_Carmen_Admin.py con streamlit.testing (AppTest) contra un
+# Postgres y cuenta las sentencias que la recarga manda a la BD (y cuánto
+# tarda el script) en cada interacción: cargar la página, escribir en el
+# formulario de alta, escribir en el editor, elegir otra cita, marcar el
+# checkbox de recordatorios. Como en el navegador, un widget dentro de un
+# st.fragment solo vuelve a correr ese fragmento y uno dentro de un st.form no
+# recarga nada hasta enviarlo. Cada interacción se mide dos veces: con la caché
+# caliente y justo después de que "otra réplica" agende una cita ese día (el
+# NOTIFY invalida la fecha y las lecturas de esa fecha vuelven a la BD).
+#
+#   python -m modules.bench_admin --url postgresql://localhost/citas_bench
+#
+# Usa el salón principal de esa BD: siembra unas citas (pacientes 5500000xxx)
+# y las borra al terminar. Apúntalo a una BD de pruebas, no a la de producción.
+import argparse, os, sys, threading, time as _time
+from collections import Counter
+from datetime import date, timedelta
+import psycopg
+from streamlit.runtime.scriptrunner import RerunData
+from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequests
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.element_tree import parse_tree_from_messages
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner, require_widgets_deltas
+from modules.consultas import SQL
+
+PAGINA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pages", "2_Carmen_Admin.py")
+PREFIJO_TEL = "5500000"
+CITAS_SEMBRADAS = 6
+_NOMBRES = {q: k for k, q in SQL.items()}
+
+# ---------- Conteo de sentencias ----------
+# Solo las del hilo del script (no las del hilo de LISTEN ni las de la siembra)
+_consultas: list[str] = []
+_execute = psycopg.Cursor.execute
+
+def _execute_contado(self, query, params=None, **kwargs):
+    if threading.current_thread().name == "ScriptRunner.scriptThread":
+        _consultas.append(_NOMBRES.get(query) or " ".join(str(query).split())[:40])
+    return _execute(self, query, params, **kwargs)
+
+# ---------- Recargas de un fragmento ----------
+# AppTest siempre vuelve a correr el script completo; el navegador manda el
+# fragment_id del widget y el servidor corre solo ese fragmento.
+_estado: dict = {"fragmento": None, "mensajes": []}
+
+def _run(self, widget_state=None, query_params=None, timeout=3, page_hash=""):
+    # el runner nace con una recarga completa pendiente; con ella la del fragmento se volvería completa
+    self._requests = ScriptRequests()
+    self.request_rerun(RerunData(widget_states=widget_state, page_script_hash=page_hash,
+                                 fragment_id=_estado["fragmento"]))
+    try:
+        if not self._script_thread:
+            self.start()
+        require_widgets_deltas(self, timeout)
+    finally:
+        self.join()
+    _estado["mensajes"] = self.forward_msgs()
+    return parse_tree_from_messages(_estado["mensajes"])
+
+def _fragmento_de(widget_id: str) -> str:
+    """fragment_id del widget según la última recarga completa ("" si está fuera de fragmentos)."""
+    for m in _estado["mensajes"]:
+        if m.WhichOneof("type") != "delta" or m.delta.WhichOneof("type") != "new_element":
+            continue
+        el = m.delta.new_element
+        tipo = el.WhichOneof("type")
+        if tipo and getattr(getattr(el, tipo), "id", None) == widget_id:
+            return m.delta.fragment_id
+    raise KeyError(widget_id)
+
+
+# ---------- Escenario ----------
+def _dia_laborable() -> date:
+    d = date.today() + timedelta(days=3)
+    while d.weekday() == 6:
+        d += timedelta(days=1)
+    return d
+
+def _limpiar(c: psycopg.Connection):
+    c.execute("DELETE FROM citas WHERE paciente_id IN (SELECT id FROM pacientes WHERE telefono LIKE %s)",
+              (PREFIJO_TEL + "%",))
+    c.execute("DELETE FROM pacientes WHERE telefono LIKE %s", (PREFIJO_TEL + "%",))
+
+def _sembrar(c: psycopg.Connection, dia: date, slots: list) -> None:
+    for i, h in enumerate(slots[:CITAS_SEMBRADAS]):
+        tel = f"{PREFIJO_TEL}{i:03d}"
+        pid = c.execute("INSERT INTO pacientes (nombre, telefono, telefono_e164) VALUES (%s, %s, %s) RETURNING id",
+                        (f"Cliente {i}", tel, f"+52{tel}")).fetchone()[0]
+        c.execute("INSERT INTO citas (fecha, hora, paciente_id, servicio) VALUES (%s, %s, %s, 'Corte')",
+                  (dia, h, pid))
+
+def _escribe_otra_replica(c: psycopg.Connection, dia: date, hora, n: int):
+    """Una cita nueva en el día elegido, fuera de este proceso (llega como NOTIFY)."""
+    tel = f"{PREFIJO_TEL}{900 + n:03d}"
+    pid = c.execute("INSERT INTO pacientes (nombre, telefono, telefono_e164) VALUES (%s, %s, %s) RETURNING id",
+                    (f"Otra {n}", tel, f"+52{tel}")).fetchone()[0]
+    c.execute("INSERT INTO citas (fecha, hora, paciente_id, servicio) VALUES (%s, %s, %s, 'Corte')", (dia, hora, pid))
+    c.execute("DELETE FROM citas WHERE paciente_id = %s", (pid,))   # deja la grilla igual para la siguiente
+    _time.sleep(0.3)   # que el hilo de LISTEN reciba los avisos
+
+INTERACCIONES = [
+    # (nombre, tipo de widget, key o etiqueta, acción)
+    ("escribir en el alta (nombre)", "text_input", "Nombre paciente", lambda w: w.input("Ana")),
+    ("escribir en el editor (nombre)", "text_input", "nombre_edit", lambda w: w.input("Otra")),
+    ("elegir otra cita (ID)", "selectbox", "ID cita", lambda w: w.select_index(len(w.options) - 1)),
+    ("checkbox de recordatorios", "checkbox", "Modo simulación (no envía)", lambda w: w.uncheck()),
+]
+
+def _widget(at: AppTest, tipo: str, clave: str):
+    return next(w for w in getattr(at, tipo) if clave in (w.key, w.label))
+
+def medir(url: str) -> list[tuple[str, str, int, float, Counter]]:
+    """(interacción, caché, sentencias, ms del script, sentencias por nombre)."""
+    os.environ.update(NEON_DATABASE_URL=url, CITAS_BACKEND="postgres")
+    os.environ.pop("SESSION_SECRET", None)   # sin feeds .ics que escribir
+    from modules import core
+    psycopg.Cursor.execute = _execute_contado
+    LocalScriptRunner.run = _run
+    dia = _dia_laborable()
+    slots = core.generar_slots(dia)
+    res = []
+    with psycopg.connect(url, autocommit=True) as c:
+        _limpiar(c)
+        _sembrar(c, dia, slots)
+        try:
+            at = AppTest.from_file(PAGINA, default_timeout=60)
+            at.session_state["role"] = "admin"
+            at.session_state["fecha_admin"] = dia
+            del _consultas[:]
+            t0 = _time.perf_counter()
+            at.run()
+            res.append(("cargar la página (día elegido)", "fría", len(_consultas),
+                        (_time.perf_counter() - t0) * 1000, Counter(_consultas)))
+            for n, (nombre, tipo, clave, accion) in enumerate(INTERACCIONES):
+                for cache in ("caliente", "tras escritura"):
+                    _estado["fragmento"] = None
+                    at.run()
+                    if cache == "tras escritura":
+                        _escribe_otra_replica(c, dia, slots[CITAS_SEMBRADAS + 1], n)
+                    w = _widget(at, tipo, clave)
+                    if w.form_id:
+                        res.append((nombre, cache, 0, 0.0, Counter({"st.form: no recarga": 1})))
+                        continue
+                    _estado["fragmento"] = _fragmento_de(w.id) or None
+                    accion(w)
+                    del _consultas[:]
+                    t0 = _time.perf_counter()
+                    at.run()
+                    res.append((nombre, cache, len(_consultas), (_time.perf_counter() - t0) * 1000,
+                                Counter(_consultas)))
+        finally:
+            psycopg.Cursor.execute = _execute
+            _limpiar(c)
+    return res
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Consultas a la BD por interacción en el panel de la dueña")
+    ap.add_argument("--url", required=True, help="BD de pruebas (se siembran y borran citas)")
+    args = ap.parse_args(argv)
+    filas = medir(args.url)
+    print(f"{'interacción':34} {'caché':15} {'consultas':>9} {'ms':>8}  detalle")
+    for nombre, cache, n, ms, det in filas:
+        detalle = ", ".join(f"{k}×{v}" if v > 1 else k for k, v in det.items())
+        print(f"{nombre:34} {cache:15} {n:9d} {ms:8.1f}  {detalle}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
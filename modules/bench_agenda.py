@@ -0,0 +1,64 @@
+# modules/bench_agenda.py — Benchmark de CPU de la lógica de agenda (sin BD)
+#
+#   python -m modules.bench_agenda --pacientes 2000 --intentos 20000
+#
+# Usa el backend en memoria, así que mide solo reglas de negocio + estructuras.
+import os
+os.environ.setdefault("CITAS_BACKEND", "memoria")
+
+import argparse, random, time as _time
+from datetime import date, timedelta
+from modules import core
+from modules.storage import MemoriaRepo
+
+
+def correr(pacientes: int, intentos: int, dias: int, semilla: int = 7) -> dict:
+    rnd = random.Random(semilla)
+    core.usar_repo(MemoriaRepo())
+    inicio = date.today() + timedelta(days=core.BLOQUEO_DIAS_MIN)
+    fechas = [inicio + timedelta(days=i) for i in range(dias)]
+    slots = {f: core.generar_slots(f) for f in fechas}
+    fechas = [f for f in fechas if slots[f]]
+
+    pids = [core.crear_o_encontrar_paciente(f"Paciente {i}", f"55{i:08d}") for i in range(pacientes)]
+
+    res = {"agendadas": 0, "rechazadas": 0}
+    t0 = _time.perf_counter()
+    for _ in range(intentos):
+        f = rnd.choice(fechas)
+        libres = [t for t in core.generar_slots(f) if t not in core.slots_ocupados(f)]
+        if not libres:
+            res["rechazadas"] += 1
+            continue
+        try:
+            core.agendar_cita_autenticado(f, rnd.choice(libres), rnd.choice(pids), "Corte")
+            res["agendadas"] += 1
+        except ValueError:
+            res["rechazadas"] += 1
+    dt = _time.perf_counter() - t0
+
+    t1 = _time.perf_counter()
+    for pid in pids:
+        core.proxima_cita_paciente(pid)
+    dt_prox = _time.perf_counter() - t1
+
+    res.update(
+        segundos=round(dt, 3),
+        ops_por_seg=round(intentos / dt) if dt else 0,
+        proxima_cita_ops_por_seg=round(len(pids) / dt_prox) if dt_prox else 0,
+    )
+    return res
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark de reglas de agenda en memoria")
+    ap.add_argument("--pacientes", type=int, default=2000)
+    ap.add_argument("--intentos", type=int, default=20000)
+    ap.add_argument("--dias", type=int, default=180)
+    args = ap.parse_args(argv)
+    for k, v in correr(args.pacientes, args.intentos, args.dias).items():
+        print(f"{k:26} {v}")
+
+
+if __name__ == "__main__":
+    main()
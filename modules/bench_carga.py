@@ -0,0 +1,350 @@
+# modules/bench_carga.py — Prueba de carga: muchos clientes agendando a la vez
+#
+# Simula la hora pico (cuando se abren los sábados): clientes virtuales, cada
+# uno en su hilo, hacen el recorrido real contra un Postgres local: iniciar
+# sesión (a veces con la contraseña mal), mirar días, agendar, recibir un
+# rechazo (horario tomado, regla de 7 días) y reintentar; algunos cambian o
+# cancelan su cita. Unos pocos manejan las páginas de verdad con
+# streamlit.testing (AppTest); el resto llama a modules.core directamente.
+#
+#   python -m modules.bench_carga --url postgresql://localhost/citas_bench \
+#       --procesos 2 --clientes 20 --paginas 2 --segundos 30
+#
+# Cada proceso es como una réplica (su pool, su caché, su cupo) y todos
+# arrancan a la vez. Todo pasa en el salón "carga" (esquema salon_carga), que
+# se vacía al empezar y se borra al terminar (salvo --conservar). Informa
+# rendimiento, latencias p50/p95/p99 por operación, espera por conexiones
+# (pool y cupo del salón), horarios con dos citas, citas confirmadas que no
+# están en la BD (o al revés) y la revisión de reglas (modules/consistencia.py).
+import argparse, multiprocessing as mp, os, random, sys, threading, time as _time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import bcrypt
+import psycopg
+from modules import consistencia, salones
+
+SLUG = "carga"
+PASSWORD = "carga-bench"
+HOME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Home.py")
+SABADO = 5
+PROB_SABADO = 0.6       # la mayoría quiere sábado
+PROB_PW_MAL = 0.05
+PROB_CAMBIAR = 0.10
+PROB_CANCELAR = 0.05
+REINTENTOS = 3
+
+
+class Medidas:
+    """Latencias por operación y contadores de un proceso (se suman en el principal)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias: dict[str, list[float]] = defaultdict(list)
+        self.rechazos: Counter = Counter()
+        self.errores: Counter = Counter()
+        self.ejemplos: dict[str, str] = {}
+        self.esperadas: Counter = Counter()   # (fecha, hora, paciente_id) -> +1 agendada / -1 quitada
+
+    @contextmanager
+    def medir(self, op: str):
+        t0 = _time.perf_counter()
+        try:
+            yield
+        except ValueError:
+            raise   # rechazo de negocio: lo clasifica quien llama
+        except Exception as e:
+            self.error(op, e)
+            raise
+        finally:
+            with self._lock:
+                self.latencias[op].append(_time.perf_counter() - t0)
+
+    def error(self, op: str, e: Exception):
+        with self._lock:
+            self.errores[op] += 1
+            self.ejemplos.setdefault(op, f"{type(e).__name__}: {e}"[:200])
+
+    def rechazo(self, e: Exception):
+        msg = str(e)
+        motivo = ("dia_lleno" if "lleno" in msg else "horario_tomado" if "tomado" in msg
+                  else "regla_7_dias" if "7 días" in msg else "mismo_dia" if "por día" in msg else "otro")
+        with self._lock:
+            self.rechazos[motivo] += 1
+
+    def cita(self, fecha: date, hora, pid: int, n: int):
+        with self._lock:
+            self.esperadas[(fecha, hora, pid)] += n
+
+    def exportar(self) -> dict:
+        return {"latencias": dict(self.latencias), "rechazos": self.rechazos, "errores": self.errores,
+                "ejemplos": self.ejemplos, "esperadas": self.esperadas}
+
+
+# ---------- Clientes virtuales ----------
+def _elegir_dia(rnd: random.Random, dias: list[date]) -> date:
+    sabados = [d for d in dias if d.weekday() == SABADO]
+    return rnd.choice(sabados if sabados and rnd.random() < PROB_SABADO else dias)
+
+def _cliente(core, salon, dias: list[date], tels: list[str], m: Medidas, rnd: random.Random,
+             listo: threading.Barrier, fin: list[float]):
+    with salones.usando(salon):
+        listo.wait()
+        while _time.monotonic() < fin[0]:
+            try:
+                _visita(core, dias, tels, m, rnd)
+            except ValueError as e:
+                m.rechazo(e)
+            except Exception:
+                pass   # ya contado en Medidas.medir
+
+def _visita(core, dias: list[date], tels: list[str], m: Medidas, rnd: random.Random):
+    tel = rnd.choice(tels)
+    if rnd.random() < PROB_PW_MAL:
+        with m.medir("login"):
+            core.login_paciente(tel, "equivocada")
+    with m.medir("login"):
+        p = core.login_paciente(tel, PASSWORD)
+    if p is None:
+        m.error("login", RuntimeError(f"contraseña correcta rechazada para {tel}"))
+        return
+    pid = p["id"]
+    with m.medir("proxima_cita"):
+        prox = core.proxima_cita_paciente(pid)
+    if not prox.empty and rnd.random() < PROB_CAMBIAR + PROB_CANCELAR:
+        r = prox.iloc[0]
+        if rnd.random() < PROB_CANCELAR / (PROB_CAMBIAR + PROB_CANCELAR):
+            with m.medir("cancelar"):
+                if core.cancelar_cita_paciente(int(r["id_cita"]), pid):
+                    m.cita(r["fecha"], r["hora"], pid, -1)
+            return
+        d = _elegir_dia(rnd, dias)
+        with m.medir("ver_dia"):
+            libres = [t for t in core.generar_slots(d) if t not in core.slots_ocupados(d)]
+        if libres:
+            h = rnd.choice(libres)
+            try:
+                with m.medir("reprogramar"):
+                    core.reprogramar_cita(int(r["id_cita"]), pid, d, h)
+                m.cita(r["fecha"], r["hora"], pid, -1)
+                m.cita(d, h, pid, +1)
+            except ValueError as e:
+                m.rechazo(e)
+        return
+    for _ in range(REINTENTOS):
+        d = _elegir_dia(rnd, dias)
+        with m.medir("ver_dia"):
+            libres = [t for t in core.generar_slots(d) if t not in core.slots_ocupados(d)]
+        if not libres:
+            m.rechazo(ValueError("horario tomado: día lleno"))
+            continue
+        h = rnd.choice(libres)
+        try:
+            with m.medir("agendar"):
+                core.agendar_cita_autenticado(d, h, pid, "Corte")
+            m.cita(d, h, pid, +1)
+            return
+        except ValueError as e:
+            m.rechazo(e)
+            if "7 días" in str(e) or "por día" in str(e):
+                return
+
+def _pagina(core, salon, dias: list[date], tels: list[str], m: Medidas, rnd: random.Random,
+            listo: threading.Barrier, fin: list[float]):
+    """Cliente que maneja Home.py y el panel del cliente con AppTest."""
+    from streamlit.testing.v1 import AppTest
+    listo.wait()
+    while _time.monotonic() < fin[0]:
+        try:
+            at = AppTest.from_file(HOME, default_timeout=120)
+            at.query_params["salon"] = salon.slug
+            with m.medir("pagina_entrar"):
+                at.run()
+            tel_in = [t for t in at.text_input if t.label == "Teléfono"][0]
+            pw_in = [t for t in at.text_input if t.label == "Contraseña"][1]
+            tel_in.input(rnd.choice(tels))
+            pw_in.input(PASSWORD)
+            with m.medir("pagina_login"):
+                [b for b in at.button if b.label == "Entrar"][0].click().run()
+                at.run()   # st.switch_page al panel
+            pid = int(at.session_state["paciente"]["id"])
+            d = _elegir_dia(rnd, dias)
+            with m.medir("pagina_ver_dia"):
+                [x for x in at.date_input if x.label.startswith("Día")][0].set_value(d).run()
+            horario = [s for s in at.selectbox if s.label == "Horario"]
+            if not horario:
+                m.rechazo(ValueError("horario tomado: día lleno"))
+                continue
+            h = rnd.choice(horario[0].options)
+            horario[0].set_value(h)
+            with m.medir("pagina_agendar"):
+                [b for b in at.button if b.label == "Confirmar cita"][0].click().run()
+            if at.error:
+                m.rechazo(ValueError(at.error[0].value))
+            elif not at.exception:
+                m.cita(d, datetime.strptime(h, "%H:%M").time(), pid, +1)
+        except Exception as e:
+            m.error("pagina", e)
+
+
+def _proceso(cfg: dict, n: int, listo, salida):
+    """Una réplica: importa core con su propio pool y corre sus clientes."""
+    os.environ.update(NEON_DATABASE_URL=cfg["url"], DB_POOL_MAX=str(cfg["pool"]), CITAS_BACKEND="postgres")
+    os.environ.pop("SESSION_SECRET", None)   # sin feeds .ics que escribir
+    from modules import core
+    salon = salones.buscar(SLUG)
+    with salones.usando(salon):
+        dias = [d for d in cfg["dias"] if core.generar_slots(d)]
+    rnd = random.Random(cfg["semilla"] * 1000 + n)
+    m = Medidas()
+    hilos_n = cfg["clientes"] + cfg["paginas"]
+    barrera = threading.Barrier(hilos_n + 1)
+    fin = [0.0]   # se fija cuando arrancan todos los procesos
+    hilos = [threading.Thread(target=_cliente if i < cfg["clientes"] else _pagina, daemon=True,
+                              args=(core, salon, dias, cfg["telefonos"], m, random.Random(rnd.random()),
+                                    barrera, fin))
+             for i in range(hilos_n)]
+    for h in hilos:
+        h.start()
+    listo.wait()   # todos los procesos listos: la "hora de apertura"
+    fin[0] = _time.monotonic() + cfg["segundos"]
+    barrera.wait()
+    for h in hilos:
+        h.join()
+    salida.put({"medidas": m.exportar(), "pool": core._pool().get_stats(),
+                "cupo": salon.cupo.estadisticas()})
+
+
+# ---------- Preparación y verificación ----------
+def preparar(url: str, pacientes: int, dias: int) -> tuple[list[str], list[date]]:
+    """Crea (o vacía) el salón de carga y siembra pacientes con la misma contraseña."""
+    pepper = os.getenv("PASSWORD_PEPPER", "").encode()
+    pw_hash = bcrypt.hashpw(PASSWORD.encode() + pepper, bcrypt.gensalt()).decode()
+    with psycopg.connect(url, autocommit=True) as c:
+        s = salones.crear(c, SLUG, "Salón de carga", "carga", pw_hash)
+        salones.fijar(c, s)
+        c.execute("TRUNCATE citas, pacientes, sesiones, series, lista_espera, ofertas, dias_cerrados, "
+                  "cambios, revisiones RESTART IDENTITY CASCADE")
+        c.execute(
+            """
+            INSERT INTO pacientes (nombre, telefono, telefono_e164, password_hash)
+            SELECT 'Carga ' || i, '56' || lpad(i::text, 8, '0'), '+5256' || lpad(i::text, 8, '0'), %s
+            FROM generate_series(1, %s) AS i
+            """,
+            (pw_hash, pacientes),
+        )
+        tels = [r[0] for r in c.execute("SELECT telefono FROM pacientes ORDER BY id")]
+    inicio = date.today() + timedelta(days=2)   # core.BLOQUEO_DIAS_MIN, sin importar core aquí
+    return tels, [inicio + timedelta(days=i) for i in range(dias)]
+
+def verificar(url: str, esperadas: Counter) -> dict:
+    with psycopg.connect(url, autocommit=True) as c:
+        salones.fijar(c, salones.Salon(SLUG, ""))
+        dobles = c.execute("SELECT count(*) FROM (SELECT 1 FROM citas GROUP BY fecha, hora HAVING count(*) > 1) x"
+                           ).fetchone()[0]
+        en_bd = Counter(tuple(r) for r in c.execute("SELECT fecha, hora, paciente_id FROM citas"))
+        revision = consistencia.revisar(c)
+    esperadas = Counter({k: n for k, n in esperadas.items() if n > 0})
+    return {
+        "citas_en_bd": sum(en_bd.values()),
+        "horarios_con_dos_citas": dobles,
+        "confirmadas_que_no_estan": sum((esperadas - en_bd).values()),
+        "en_bd_sin_confirmar": sum((en_bd - esperadas).values()),
+        "reglas": revision["por_regla"] if revision else {},
+    }
+
+def borrar(url: str):
+    with psycopg.connect(url, autocommit=True) as c:
+        c.execute(f"DROP SCHEMA IF EXISTS {salones.Salon(SLUG, '').esquema} CASCADE")
+        c.execute("DELETE FROM public.salones WHERE slug = %s", (SLUG,))
+
+
+# ---------- Informe ----------
+def _percentil(xs: list[float], p: float) -> float:
+    return xs[min(len(xs) - 1, int(p * len(xs)))] if xs else 0.0
+
+def _sumar(dicts: list[dict]) -> dict:
+    total: dict = {}
+    for d in dicts:
+        for k, v in d.items():
+            if isinstance(v, (int, float)):
+                total[k] = total.get(k, 0) + v
+    return total
+
+def imprimir(resultados: list[dict], segundos: float, verificacion: dict):
+    lat: dict[str, list[float]] = defaultdict(list)
+    rechazos, errores, ejemplos = Counter(), Counter(), {}
+    for r in resultados:
+        for op, xs in r["medidas"]["latencias"].items():
+            lat[op].extend(xs)
+        rechazos.update(r["medidas"]["rechazos"])
+        errores.update(r["medidas"]["errores"])
+        ejemplos.update(r["medidas"]["ejemplos"])
+    print(f"{'operación':16} {'n':>7} {'ops/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'errores':>8}")
+    for op in sorted(lat):
+        xs = sorted(lat[op])
+        print(f"{op:16} {len(xs):7d} {len(xs) / segundos:8.1f} {_percentil(xs, .5) * 1000:9.1f} "
+              f"{_percentil(xs, .95) * 1000:9.1f} {_percentil(xs, .99) * 1000:9.1f} {xs[-1] * 1000:9.1f} "
+              f"{errores[op]:8d}")
+    print(f"\nrechazos: {dict(rechazos)}")
+    for op, ej in ejemplos.items():
+        print(f"error en {op} ({errores[op]}): {ej}")
+    pool = _sumar([r["pool"] for r in resultados])
+    cupo = _sumar([r["cupo"] for r in resultados])
+    print(f"\npool (suma de procesos): pedidas={pool.get('requests_num', 0)} "
+          f"en_cola={pool.get('requests_queued', 0)} espera_total_ms={pool.get('requests_wait_ms', 0)} "
+          f"errores={pool.get('requests_errors', 0)} conexiones_abiertas={pool.get('connections_num', 0)}")
+    print(f"cupo del salón (suma): usos={cupo.get('usos', 0)} esperas={cupo.get('esperas', 0)} "
+          f"espera_s={cupo.get('espera_s', 0):.2f} saturado={cupo.get('saturado', 0)}")
+    print("\nverificación:")
+    for k, v in verificacion.items():
+        print(f"  {k:26} {v}")
+
+def fallas(verificacion: dict) -> bool:
+    return bool(verificacion["horarios_con_dos_citas"] or verificacion["confirmadas_que_no_estan"]
+                or verificacion["en_bd_sin_confirmar"] or any(verificacion["reglas"].values()))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Prueba de carga de agendado contra un Postgres local")
+    ap.add_argument("--url", required=True, help="BD local desechable (NO la de producción)")
+    ap.add_argument("--procesos", type=int, default=2, help="réplicas simuladas")
+    ap.add_argument("--clientes", type=int, default=20, help="hilos por proceso que llaman a core")
+    ap.add_argument("--paginas", type=int, default=1, help="hilos por proceso que manejan las páginas (AppTest)")
+    ap.add_argument("--segundos", type=float, default=30)
+    ap.add_argument("--pacientes", type=int, default=0, help="por defecto 10 por cliente virtual")
+    ap.add_argument("--dias", type=int, default=21, help="días abiertos a reservar desde el primero permitido")
+    ap.add_argument("--pool", type=int, default=int(os.getenv("DB_POOL_MAX") or 5), help="DB_POOL_MAX de cada proceso")
+    ap.add_argument("--semilla", type=int, default=7)
+    ap.add_argument("--conservar", action="store_true", help="no borrar el salón de carga al terminar")
+    args = ap.parse_args(argv)
+
+    total = args.procesos * (args.clientes + args.paginas)
+    tels, dias = preparar(args.url, args.pacientes or 10 * total, args.dias)
+    cfg = {"url": args.url, "pool": args.pool, "clientes": args.clientes, "paginas": args.paginas,
+           "segundos": args.segundos, "telefonos": tels, "dias": dias, "semilla": args.semilla}
+    ctx = mp.get_context("spawn")   # core abre pool e hilos al importarse: nada de fork
+    listo, salida = ctx.Barrier(args.procesos), ctx.Queue()
+    procs = [ctx.Process(target=_proceso, args=(cfg, n, listo, salida)) for n in range(args.procesos)]
+    try:
+        for p in procs:
+            p.start()
+        resultados = [salida.get() for _ in procs]
+        for p in procs:
+            p.join()
+        esperadas = Counter()
+        for r in resultados:
+            esperadas.update(r["medidas"]["esperadas"])
+        verificacion = verificar(args.url, esperadas)
+        imprimir(resultados, args.segundos, verificacion)
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        if not args.conservar:
+            borrar(args.url)
+    return 1 if fallas(verificacion) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# modules/cache_sync.py — Coherencia de caché entre réplicas (LISTEN/NOTIFY)
+#
+# Los triggers de citas/pacientes/sesiones hacen pg_notify('citas_cambio', clave)
+# con claves como "fecha:2025-03-01", "paciente:42", "pacientes", "citas" o
+# "sesion:<sid>". Cada proceso escucha el canal en un hilo y sube un número de
+# versión local por clave; las funciones cacheadas incluyen esas versiones en
+# sus argumentos, así que una escritura en cualquier réplica invalida solo las
+# entradas afectadas en todas. Sin escucha activa, la versión cambia cada
+# FALLBACK_S segundos (el mismo efecto que el TTL corto de antes).
+#
+# Con varios salones (modules/salones.py) cada aviso llega como
+# "<esquema>/<clave>" y las claves locales se guardan igual: la versión de
+# "fecha:2025-03-01" de un salón no toca la del otro, y la tupla de versión
+# incluye el esquema para que dos salones nunca compartan una entrada de caché.
+#
+# Otros hilos del proceso pueden esperar avisos de un esquema con avisos(esquema)
+# (p. ej. modules/calendario.py) en vez de sondear la BD con su propia conexión.
+import itertools, logging, threading, time as _time
+import psycopg
+from modules import salones
+
+CANAL = "citas_cambio"
+FALLBACK_S: int = 5
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_contador = itertools.count(1)
+_versiones: dict[str, int] = {}
+_epoca = 0
+_escuchando = threading.Event()
+_avisos: dict[str, threading.Event] = {}
+_hilo: threading.Thread | None = None
+
+
+def version(*claves: str) -> tuple:
+    """Argumento extra para funciones cacheadas: cambia cuando cambian sus claves."""
+    e = salones.actual().esquema
+    with _lock:
+        v = (e, _epoca, *(_versiones.get(f"{e}/{k}", 0) for k in claves))
+    if not _escuchando.is_set():
+        v += (int(_time.time() // FALLBACK_S),)
+    return v
+
+def _subir(*claves: str):
+    with _lock:
+        for k in claves:
+            _versiones[k] = next(_contador)
+
+def invalidar(*claves: str):
+    e = salones.actual().esquema
+    _subir(*(f"{e}/{k}" for k in claves))
+
+def invalidar_todo():
+    global _epoca
+    with _lock:
+        _epoca = next(_contador)
+        _versiones.clear()
+
+def escuchando() -> bool:
+    return _escuchando.is_set()
+
+def avisos(esquema: str) -> threading.Event:
+    """Se activa con cada aviso de ese esquema y al (re)conectar la escucha; quien
+    espera lo limpia antes de leer."""
+    with _lock:
+        return _avisos.setdefault(esquema, threading.Event())
+
+def _despertar(*esquemas: str):
+    with _lock:
+        eventos = list(_avisos.values()) if not esquemas else [_avisos[e] for e in esquemas if e in _avisos]
+    for ev in eventos:
+        ev.set()
+
+def _escuchar(url: str):
+    espera = 1.0
+    while True:
+        try:
+            with psycopg.connect(url, autocommit=True) as c:
+                c.execute(f"LISTEN {CANAL}")
+                # Pudimos perder avisos mientras no escuchábamos
+                invalidar_todo()
+                _escuchando.set()
+                _despertar()
+                espera = 1.0
+                for n in c.notifies():
+                    _subir(n.payload)
+                    _despertar(n.payload.partition("/")[0])
+        except Exception as e:
+            log.warning("cache_sync: escucha caída (%s); reintento en %.0fs", e, espera)
+        _escuchando.clear()
+        _despertar()   # quien esperaba un aviso pasa a sondear mientras tanto
+        _time.sleep(espera)
+        espera = min(espera * 2, 60.0)
+
+def iniciar(url: str):
+    """Arranca (una vez por proceso) el hilo que escucha el canal."""
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        _hilo = threading.Thread(target=_escuchar, args=(url,), daemon=True, name="cache-sync")
+        _hilo.start()
@@ -0,0 +1,290 @@
+# modules/calendario.py — Feeds iCalendar (.ics) de la agenda y de cada paciente
+#
+# Son archivos estáticos en static/ics/ que Streamlit sirve en /app/static/ics/…
+# (server.enableStaticServing en .streamlit/config.toml) con ETag y
+# Last-Modified: un calendario que sondea cada pocos minutos lee un archivo sin
+# tocar la BD, y un CDN/proxy delante puede revalidar con esas cabeceras. El
+# nombre del archivo lleva un HMAC de SESSION_SECRET, así que el feed de un
+# paciente no se puede adivinar a partir de su id.
+#
+# Un hilo sigue el registro de cambios (modules/cambios.py) y regenera solo lo
+# que tocó cada escritura: los días afectados de la agenda y los feeds de los
+# pacientes afectados. Un archivo se reescribe solo si su contenido cambió, para
+# que el ETag no cambie en vano.
+#
+# El hilo no deja una conexión abierta: lo despierta el mismo NOTIFY que ya
+# escucha modules/cache_sync.py, lee lo nuevo con una conexión corta y vuelve a
+# dormir. Solo sondea cada SONDEO_S por si se perdió un aviso (cada ESPERA_S si
+# la escucha está caída o hay cambios retenidos por una transacción abierta),
+# así que no impide que Neon suspenda la BD sin tráfico.
+#
+# Con varios salones (modules/salones.py) cada uno tiene su carpeta
+# (static/ics/<slug>/; el principal usa static/ics/) y su propio hilo.
+import hashlib, hmac, logging, os, threading, time as _time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+import psycopg
+from modules.consultas import SQL
+from modules import cambios, salones, cache_sync
+
+CARPETA = Path(__file__).resolve().parent.parent / "static" / "ics"
+URL_BASE = "app/static/ics"
+DIAS_ATRAS: int = 30   # la agenda incluye el último mes además de lo que viene
+SONDEO_S: float = 1800.0   # con avisos: solo por si se perdió alguno
+ESPERA_S: float = 60.0     # sin avisos o con cambios retenidos
+LOTE: int = 500
+PRODID = "-//Salon de belleza//Citas//ES"
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_secreto = b""
+_duracion = timedelta(minutes=30)
+_dias: dict[str, dict[date, list[str]]] = {}   # por esquema: eventos de la agenda por fecha
+_hilos: dict[str, threading.Thread] = {}
+
+
+# ---------- Nombres ----------
+def _carpeta() -> Path:
+    s = salones.actual()
+    return CARPETA if s.principal else CARPETA / s.slug
+
+def _url_base() -> str:
+    s = salones.actual()
+    return URL_BASE if s.principal else f"{URL_BASE}/{s.slug}"
+
+def _agenda() -> dict[date, list[str]]:
+    return _dias.setdefault(salones.actual().esquema, {})
+
+def _firma(clave: str) -> str:
+    return hmac.new(_secreto, f"ics:{clave}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def _archivo_agenda() -> str:
+    return f"agenda-{_firma('agenda')}.ics"
+
+def _archivo_paciente(pid: int) -> str:
+    return f"p-{_firma(f'paciente:{int(pid)}')}.ics"
+
+def activo() -> bool:
+    return bool(_secreto)
+
+def url_agenda() -> Optional[str]:
+    return f"{_url_base()}/{_archivo_agenda()}" if activo() else None
+
+def url_paciente(pid: int) -> Optional[str]:
+    return f"{_url_base()}/{_archivo_paciente(pid)}" if activo() else None
+
+
+# ---------- Formato (RFC 5545) ----------
+def _escapar(t) -> str:
+    return (str(t or "").replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\r", "").replace("\n", "\\n"))
+
+def _plegar(linea: str) -> str:
+    # líneas de 75 octetos como máximo; las siguientes empiezan con un espacio
+    b = linea.encode()
+    if len(b) <= 75:
+        return linea
+    partes, i = [], 0
+    while i < len(b):
+        n = 75 if i == 0 else 74
+        j = min(i + n, len(b))
+        while j < len(b) and (b[j] & 0xC0) == 0x80:   # no partir un carácter UTF-8
+            j -= 1
+        partes.append(b[i:j].decode())
+        i = j
+    return "\r\n ".join(partes)
+
+def _fmt(dt: datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%S")
+
+def _evento(cid: int, fecha: date, hora, creado_en, resumen: str, descripcion: str = "") -> str:
+    inicio = datetime.combine(fecha, hora)
+    lineas = [
+        "BEGIN:VEVENT",
+        f"UID:cita-{cid}@citas",
+        # DTSTAMP fijo (alta de la cita) para que el archivo no cambie si la cita no cambió;
+        # creado_en es TIMESTAMP sin zona con now() del servidor (UTC en Neon)
+        f"DTSTAMP:{_fmt(creado_en or inicio)}Z",
+        f"DTSTART:{_fmt(inicio)}",
+        f"DTEND:{_fmt(inicio + _duracion)}",
+        f"SUMMARY:{_escapar(resumen)}",
+    ]
+    if descripcion:
+        lineas.append(f"DESCRIPTION:{_escapar(descripcion)}")
+    lineas.append("END:VEVENT")
+    return "\r\n".join(_plegar(x) for x in lineas)
+
+def _calendario(nombre: str, eventos: list[str]) -> str:
+    cabecera = [
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escapar(nombre)}",
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M", "X-PUBLISHED-TTL:PT15M",
+    ]
+    return "\r\n".join(cabecera + eventos + ["END:VCALENDAR"]) + "\r\n"
+
+def _evento_agenda(f: tuple) -> str:
+    cid, fecha, hora, servicio, nota, creado_en, nombre, telefono = f
+    desc = " • ".join(x for x in (telefono, nota) if x)
+    return _evento(cid, fecha, hora, creado_en, f"{nombre or 'Sin paciente'} — {servicio or 'Cita'}", desc)
+
+def _evento_paciente(f: tuple) -> str:
+    cid, _, fecha, hora, servicio, nota, creado_en = f
+    return _evento(cid, fecha, hora, creado_en, f"Cita en el salón — {servicio or 'Cita'}", nota or "")
+
+
+# ---------- Escritura ----------
+def _escribir(nombre: str, contenido: str) -> bool:
+    ruta = _carpeta() / nombre
+    try:
+        with open(ruta, encoding="utf-8", newline="") as f:
+            if f.read() == contenido:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(contenido)
+    os.replace(tmp, ruta)   # quien lee ve el archivo viejo o el nuevo, nunca uno a medias
+    return True
+
+def _escribir_agenda():
+    dias = _agenda()
+    eventos = [e for d in sorted(dias) for e in dias[d]]
+    _escribir(_archivo_agenda(), _calendario(f"Agenda — {salones.actual().nombre}", eventos))
+
+def _escribir_pacientes(filas: list[tuple], pids) -> int:
+    por_paciente: dict[int, list[str]] = {int(p): [] for p in pids}
+    for f in filas:
+        por_paciente.setdefault(int(f[1]), []).append(_evento_paciente(f))
+    return sum(_escribir(_archivo_paciente(p), _calendario("Mis citas", ev)) for p, ev in por_paciente.items())
+
+
+# ---------- Regeneración ----------
+def reconstruir(c: psycopg.Connection):
+    """Todo desde cero: la agenda completa y el feed de cada paciente con citas próximas.
+    Los feeds que ya existían de pacientes sin citas próximas quedan vacíos."""
+    hoy = date.today()
+    _carpeta().mkdir(parents=True, exist_ok=True)
+    agenda = c.execute(SQL["ics_agenda_desde"], (hoy - timedelta(days=DIAS_ATRAS),)).fetchall()
+    proximas = c.execute(SQL["ics_pacientes_desde"], (hoy,)).fetchall()
+    with _lock:
+        dias = _agenda()
+        dias.clear()
+        for f in agenda:
+            dias.setdefault(f[1], []).append(_evento_agenda(f))
+        _escribir_agenda()
+        pids = {int(f[1]) for f in proximas}
+        _escribir_pacientes(proximas, pids)
+        vigentes = {_archivo_paciente(p) for p in pids}
+        for ruta in _carpeta().glob("p-*.ics"):
+            if ruta.name not in vigentes:
+                _escribir(ruta.name, _calendario("Mis citas", []))
+
+def _tocados(filas: list[dict]) -> tuple[set[date], set[int], set[int]]:
+    """(fechas, pacientes de citas, pacientes editados) a partir de un lote de cambios."""
+    fechas, pacientes, editados = set(), set(), set()
+    for k in filas:
+        for fila in (k["antes"], k["despues"]):
+            if not fila:
+                continue
+            if k["tabla"] == "citas":
+                fechas.add(date.fromisoformat(fila["fecha"]))
+                if fila.get("paciente_id") is not None:
+                    pacientes.add(int(fila["paciente_id"]))
+            elif k["tabla"] == "pacientes":
+                editados.add(int(fila["id"]))
+    return fechas, pacientes, editados
+
+def aplicar(c: psycopg.Connection, filas: list[dict]):
+    """Regenera solo los días y pacientes que tocan estos cambios."""
+    fechas, pacientes, editados = _tocados(filas)
+    hoy = date.today()
+    desde = hoy - timedelta(days=DIAS_ATRAS)
+    pids = pacientes | editados
+    if pids:
+        proximas = c.execute(SQL["ics_pacientes"], (list(pids), hoy)).fetchall()
+        with _lock:
+            _escribir_pacientes(proximas, pids)
+        # el nombre/teléfono de un paciente editado también sale en la agenda
+        if editados:
+            fechas |= {f[2] for f in proximas if f[1] in editados}
+    fechas = {f for f in fechas if f >= desde}
+    if not fechas:
+        return
+    agenda = c.execute(SQL["ics_agenda_dias"], (sorted(fechas),)).fetchall()
+    with _lock:
+        dias = _agenda()
+        for d in fechas:
+            dias.pop(d, None)
+        for f in agenda:
+            dias.setdefault(f[1], []).append(_evento_agenda(f))
+        _escribir_agenda()
+
+def existe_paciente(pid: int) -> bool:
+    return activo() and (_carpeta() / _archivo_paciente(pid)).exists()
+
+def asegurar_paciente(c: psycopg.Connection, pid: int) -> Optional[str]:
+    """URL del feed del paciente; lo genera si todavía no existe (p. ej. sin citas próximas)."""
+    if not activo():
+        return None
+    if not existe_paciente(pid):
+        _carpeta().mkdir(parents=True, exist_ok=True)
+        filas = c.execute(SQL["ics_pacientes"], ([int(pid)], date.today())).fetchall()
+        with _lock:
+            _escribir_pacientes(filas, [pid])
+    return url_paciente(pid)
+
+
+# ---------- Hilo ----------
+def _posicion_actual(c: psycopg.Connection) -> str:
+    fila = c.execute(SQL["cambios_ultima_posicion"]).fetchone()
+    return f"{fila[0]}:{fila[1]}" if fila else cambios.INICIO
+
+def _seguir(url: str, salon: salones.Salon):
+    with salones.usando(salon):
+        _seguir_salon(url, salon)
+
+def _seguir_salon(url: str, salon: salones.Salon):
+    avisos = cache_sync.avisos(salon.esquema)
+    pos, dia, espera = None, None, 1.0
+    while True:
+        avisos.clear()   # antes de leer: un aviso que llegue durante la lectura no se pierde
+        try:
+            with psycopg.connect(url, autocommit=True) as c:
+                salones.fijar(c, salon)
+                if pos is None or date.today() != dia:   # al arrancar y al cambiar de día
+                    # la posición se toma ANTES de reconstruir: lo que entre mientras
+                    # tanto se vuelve a aplicar (regenerar es idempotente)
+                    nueva = _posicion_actual(c)
+                    reconstruir(c)
+                    pos, dia = nueva, date.today()
+                while True:
+                    filas, pos = cambios.leer(c, pos, LOTE)
+                    if filas:
+                        aplicar(c, filas)
+                    if len(filas) < LOTE:
+                        break
+                pendientes = cambios.retenidos(c, pos)
+            espera = 1.0
+        except Exception as e:
+            log.warning("calendario: feeds de %s detenidos (%s); reintento en %.0fs", salon.esquema, e, espera)
+            _time.sleep(espera)
+            espera = min(espera * 2, 60.0)
+            continue
+        avisos.wait(ESPERA_S if pendientes or not cache_sync.escuchando() else SONDEO_S)
+
+def iniciar(url: str, secreto: bytes, paso_min: int, lista: list[salones.Salon]):
+    """Arranca (una vez por proceso y salón) el hilo que mantiene los feeds de
+    cada salón de `lista`. Sin secreto no hay feeds."""
+    global _secreto, _duracion
+    with _lock:
+        if not secreto:
+            return
+        _secreto, _duracion = secreto, timedelta(minutes=paso_min)
+        for s in lista:
+            if s.esquema not in _hilos:
+                _hilos[s.esquema] = threading.Thread(target=_seguir, args=(url, s), daemon=True,
+                                                     name=f"calendario-{s.slug or 'principal'}")
+                _hilos[s.esquema].start()
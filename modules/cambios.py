@@ -0,0 +1,105 @@
+# modules/cambios.py — Feed de cambios de citas y pacientes (para contabilidad, marketing…)
+#
+# Triggers en citas y pacientes agregan una fila a `cambios` por cada INSERT,
+# UPDATE o DELETE, con la fila antes/después en JSON (sin password_hash). Un
+# consumidor guarda la última posición que procesó y pide solo lo nuevo:
+#
+#   python -m modules.cambios --url $NEON_DATABASE_URL --desde 0:0 [--lote 500] [--seguir]
+#   python -m modules.cambios --url ... --podar-dias 90
+#
+# Salida: una línea JSON por cambio, con "pos" = "<xid>:<seq>". La posición
+# ordena por transacción y luego por secuencia; un cambio aparece cuando su
+# transacción y todas las anteriores terminaron, así que una transacción larga
+# abierta retrasa el feed (no pierde cambios). Archivar meses viejos de citas
+# (modules/particiones.py) no genera borrados en el feed, y mover una cita a
+# otro mes (otra partición) sale como una U, no como D + I.
+import argparse, json, sys, time as _time
+from typing import Iterator
+import psycopg
+from psycopg.rows import dict_row
+from modules.consultas import SQL
+
+INICIO = "0:0"
+
+
+def _posicion(pos: str) -> tuple[str, int]:
+    xid, _, seq = pos.partition(":")
+    if not (xid.isdigit() and seq.isdigit()):
+        raise ValueError(f"Posición no válida: {pos!r} (formato <xid>:<seq>)")
+    return xid, int(seq)
+
+
+def leer(c: psycopg.Connection, desde: str = INICIO, lote: int = 500) -> tuple[list[dict], str]:
+    """Hasta `lote` cambios posteriores a `desde`. Devuelve (cambios, nueva posición)."""
+    xid, seq = _posicion(desde)
+    with c.cursor(row_factory=dict_row) as cur:
+        filas = cur.execute(SQL["cambios_desde"], (xid, seq, lote)).fetchall()
+    for f in filas:
+        f["pos"] = f"{f['xid']}:{f['seq']}"
+    return filas, (filas[-1]["pos"] if filas else desde)
+
+
+def retenidos(c: psycopg.Connection, desde: str) -> bool:
+    """True si hay cambios después de `desde` que leer() todavía no entrega."""
+    return c.execute(SQL["cambios_retenidos"], _posicion(desde)).fetchone() is not None
+
+
+def seguir(c: psycopg.Connection, desde: str = INICIO, lote: int = 500,
+           espera_s: float = 2.0) -> Iterator[list[dict]]:
+    """Lotes sin fin: lo pendiente de inmediato y después lo nuevo, sondeando cada `espera_s`."""
+    pos = desde
+    while True:
+        filas, pos = leer(c, pos, lote)
+        if filas:
+            yield filas
+        if len(filas) < lote:
+            _time.sleep(espera_s)
+
+
+def podar(c: psycopg.Connection, dias: int, lote: int = 1000) -> int:
+    """Borra los cambios de hace más de `dias` días, en lotes. Devuelve cuántos."""
+    total = 0
+    while True:
+        n = c.execute(SQL["podar_cambios"], (dias, lote)).rowcount
+        total += n
+        if n < lote:
+            return total
+
+
+def _imprimir(filas: list[dict]):
+    for f in filas:
+        print(json.dumps(f, default=str, ensure_ascii=False))
+    sys.stdout.flush()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Cambios de citas y pacientes desde una posición (JSON por línea)")
+    ap.add_argument("--url", required=True)
+    ap.add_argument("--desde", default=INICIO, help="última posición procesada (<xid>:<seq>)")
+    ap.add_argument("--lote", type=int, default=500)
+    ap.add_argument("--seguir", action="store_true", help="no terminar: esperar cambios nuevos")
+    ap.add_argument("--podar-dias", type=int, help="en vez de leer, borrar los cambios más viejos que N días")
+    args = ap.parse_args(argv)
+    with psycopg.connect(args.url, autocommit=True) as c:
+        if args.podar_dias is not None:
+            print(f"cambios borrados: {podar(c, args.podar_dias)}")
+            return 0
+        if args.seguir:
+            try:
+                for filas in seguir(c, args.desde, args.lote):
+                    _imprimir(filas)
+            except KeyboardInterrupt:
+                pass
+            return 0
+        pos = args.desde
+        while True:
+            filas, pos = leer(c, pos, args.lote)
+            _imprimir(filas)
+            if len(filas) < args.lote:
+                break
+    print(pos, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# modules/consistencia.py — Revisión en lote de las reglas de agenda
+#
+# "Una cita por día" y "una cita cada 7 días" solo se validan cuando el
+# cliente agenda (core.agendar_cita_autenticado). Las citas que crea la dueña,
+# las que mueve el cierre de un día o las de pacientes borrados no pasan por
+# ahí. Esta revisión recorre citas y pacientes una sola vez cada uno (funciones
+# de ventana por paciente) y guarda lo que encuentra en `hallazgos`, colgado
+# de una fila de `revisiones`:
+#
+#   mismo_dia           el paciente ya tenía otra cita ese día
+#   ventana_7_dias      su cita anterior fue hace menos de 7 días
+#   sin_paciente        cita sin paciente (se borró el paciente)
+#   paciente_duplicado  mismo teléfono (últimos 10 dígitos) que un paciente anterior
+#
+#   python -m modules.consistencia --url $NEON_DATABASE_URL [--todos] [--conservar 10]
+#
+# Solo informa: no mueve ni borra nada. Con varios salones (modules/salones.py)
+# cada uno se revisa en su esquema; --todos los recorre uno tras otro.
+import argparse, json, sys, time as _time
+from typing import Optional
+import psycopg
+from psycopg.rows import dict_row
+from modules.consultas import SQL
+from modules import salones
+
+REGLAS = ("mismo_dia", "ventana_7_dias", "sin_paciente", "paciente_duplicado")
+CONSERVAR: int = 10   # revisiones que se guardan (con sus hallazgos)
+# El planificador prefiere recorrer el índice (paciente_id, fecha, hora) de cada
+# partición, ya ordenado, pero eso es una lectura al azar del heap por cita: con
+# 2 M de citas, leer todo y ordenar fue el doble de rápido.
+SIN_INDICES = "SET LOCAL enable_indexscan = off"
+
+
+def revisar(c: psycopg.Connection, conservar: int = CONSERVAR) -> Optional[dict]:
+    """Una revisión completa en una transacción. None si ya hay otra en curso en este esquema."""
+    t0 = _time.perf_counter()
+    with c.transaction():
+        if not c.execute(SQL["revision_candado"]).fetchone()[0]:
+            return None
+        c.execute(SIN_INDICES)
+        rid = c.execute(SQL["revision_crear"]).fetchone()[0]
+        n = c.execute(SQL["revision_hallazgos"], {"revision": rid}).rowcount
+        ms = round((_time.perf_counter() - t0) * 1000)
+        c.execute(SQL["revision_cerrar"], (n, ms, rid))
+        c.execute(SQL["revision_podar"], (conservar,))
+    return {"id": rid, "hallazgos": n, "ms": ms, "por_regla": resumen(c, rid)}
+
+
+def ultima(c: psycopg.Connection) -> Optional[dict]:
+    with c.cursor(row_factory=dict_row) as cur:
+        r = cur.execute(SQL["revision_ultima"]).fetchone()
+    if r:
+        r["por_regla"] = resumen(c, r["id"])
+    return r
+
+
+def resumen(c: psycopg.Connection, rid: int) -> dict[str, int]:
+    cuentas = dict(c.execute(SQL["revision_resumen"], (rid,)).fetchall())
+    return {regla: cuentas.get(regla, 0) for regla in REGLAS}
+
+
+def hallazgos(c: psycopg.Connection, rid: int, reglas=REGLAS, limite: int = 500) -> list[dict]:
+    with c.cursor(row_factory=dict_row) as cur:
+        return cur.execute(SQL["revision_detalle"], (rid, list(reglas), limite)).fetchall()
+
+
+def _informar(c: psycopg.Connection, nombre: str, conservar: int, detalle: int) -> Optional[int]:
+    r = revisar(c, conservar)
+    if r is None:
+        print(f"{nombre}: ya hay una revisión en curso", file=sys.stderr)
+        return None
+    print(f"{nombre}: revisión {r['id']}, {r['hallazgos']} hallazgos en {r['ms']} ms")
+    for regla, n in r["por_regla"].items():
+        print(f"  {regla:20} {n}")
+    for h in hallazgos(c, r["id"], limite=detalle) if detalle else ():
+        print(json.dumps(h, default=str, ensure_ascii=False))
+    return r["hallazgos"]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Revisa las reglas de agenda sobre todas las citas")
+    ap.add_argument("--url", required=True)
+    ap.add_argument("--todos", action="store_true", help="revisar cada salón de public.salones además del principal")
+    ap.add_argument("--conservar", type=int, default=CONSERVAR, help="revisiones anteriores que se guardan")
+    ap.add_argument("--detalle", type=int, default=0, help="imprimir hasta N hallazgos (JSON por línea)")
+    args = ap.parse_args(argv)
+    encontrados = []
+    with psycopg.connect(args.url, autocommit=True) as c:
+        if not args.todos:
+            encontrados.append(_informar(c, "revisión", args.conservar, args.detalle))
+        else:
+            for s in salones.cargar(c, pool_max=1):
+                salones.fijar(c, s)
+                encontrados.append(_informar(c, s.esquema, args.conservar, args.detalle))
+    # 1 si alguna no corrió, 2 si hay algo que revisar (para usarlo desde un cron)
+    if None in encontrados:
+        return 1
+    return 2 if any(encontrados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
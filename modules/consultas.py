@@ -0,0 +1,736 @@
+# modules/consultas.py — Catálogo de SQL con nombre (sin dependencias de Streamlit)
+#
+# Todo el SQL que ejecuta modules/core.py vive aquí para poder revisarlo y
+# probar sus planes (ver modules/planes.py) sin levantar la app.
+
+# citas se particiona por mes (modules/particiones.py crea los meses y archiva
+# los viejos). La PK y la restricción única incluyen la clave de partición;
+# UNIQUE (fecha, hora) sigue siendo "un horario, una cita".
+CITAS_SQL = """
+CREATE TABLE IF NOT EXISTS citas (
+  id SERIAL,
+  fecha DATE NOT NULL,
+  hora TIME NOT NULL,
+  paciente_id INTEGER REFERENCES pacientes(id) ON DELETE SET NULL,
+  servicio TEXT,
+  nota TEXT,
+  creado_en TIMESTAMP DEFAULT now(),
+  serie_id INTEGER REFERENCES series(id) ON DELETE SET NULL,
+  PRIMARY KEY (id, fecha),
+  UNIQUE (fecha, hora)
+) PARTITION BY RANGE (fecha);
+"""
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS pacientes (
+  id SERIAL PRIMARY KEY,
+  nombre TEXT NOT NULL,
+  telefono TEXT NOT NULL UNIQUE,
+  password_hash TEXT,
+  creado_en TIMESTAMP DEFAULT now()
+);
+
+-- Citas recurrentes: misma hora cada N semanas. Las citas de la serie son
+-- filas normales de citas con serie_id.
+CREATE TABLE IF NOT EXISTS series (
+  id SERIAL PRIMARY KEY,
+  paciente_id INTEGER REFERENCES pacientes(id) ON DELETE SET NULL,
+  hora TIME NOT NULL,
+  cada_semanas INTEGER NOT NULL CHECK (cada_semanas BETWEEN 1 AND 52),
+  desde DATE NOT NULL,
+  hasta DATE NOT NULL,
+  servicio TEXT,
+  nota TEXT,
+  creado_en TIMESTAMP DEFAULT now()
+);
+
+""" + CITAS_SQL + """
+ALTER TABLE citas ADD COLUMN IF NOT EXISTS servicio TEXT;
+-- Forma canónica (modules/telefonos.py); su índice único lo crea la migración
+ALTER TABLE pacientes ADD COLUMN IF NOT EXISTS telefono_e164 TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas(fecha);
+-- próxima cita / regla de 1 por día / ventana de 7 días
+CREATE INDEX IF NOT EXISTS idx_citas_paciente_fecha ON citas(paciente_id, fecha, hora);
+-- notificación de última cita agendada
+CREATE INDEX IF NOT EXISTS idx_citas_creado_en ON citas(creado_en DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS sesiones (
+  id TEXT PRIMARY KEY,
+  paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+  expira_en TIMESTAMP NOT NULL,
+  revocada_en TIMESTAMP,
+  creado_en TIMESTAMP DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_sesiones_paciente ON sesiones(paciente_id);
+
+ALTER TABLE citas ADD COLUMN IF NOT EXISTS serie_id INTEGER REFERENCES series(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_citas_serie ON citas(serie_id, fecha) WHERE serie_id IS NOT NULL;
+
+-- Lista de espera: rango de fechas (y opcionalmente de horas) que le sirve al
+-- paciente. El índice GiST sobre el daterange encuentra, para una fecha que se
+-- liberó, solo las entradas que la contienen.
+CREATE TABLE IF NOT EXISTS lista_espera (
+  id SERIAL PRIMARY KEY,
+  paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+  desde DATE NOT NULL,
+  hasta DATE NOT NULL,
+  hora_min TIME,
+  hora_max TIME,
+  servicio TEXT,
+  creado_en TIMESTAMP DEFAULT now(),
+  atendida_en TIMESTAMP,
+  CHECK (hasta >= desde)
+);
+CREATE INDEX IF NOT EXISTS idx_espera_rango ON lista_espera
+  USING gist (daterange(desde, hasta, '[]')) WHERE atendida_en IS NULL;
+CREATE INDEX IF NOT EXISTS idx_espera_paciente ON lista_espera(paciente_id);
+
+-- pendiente -> enviada -> aceptada | rechazada | expirada
+CREATE TABLE IF NOT EXISTS ofertas (
+  id SERIAL PRIMARY KEY,
+  espera_id INTEGER NOT NULL REFERENCES lista_espera(id) ON DELETE CASCADE,
+  paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+  fecha DATE NOT NULL,
+  hora TIME NOT NULL,
+  estado TEXT NOT NULL DEFAULT 'pendiente',
+  expira_en TIMESTAMPTZ NOT NULL,
+  creado_en TIMESTAMP DEFAULT now()
+);
+-- expira_en se creó sin zona (hora del servidor, UTC en Neon) y el panel la
+-- mostraba como hora local; el cast la interpreta en la zona de la sesión,
+-- la misma con la que se escribió.
+DO $$
+BEGIN
+  IF (SELECT data_type FROM information_schema.columns
+      WHERE table_schema = current_schema() AND table_name = 'ofertas' AND column_name = 'expira_en')
+     = 'timestamp without time zone' THEN
+    ALTER TABLE ofertas ALTER COLUMN expira_en TYPE timestamptz;
+  END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_ofertas_espera ON ofertas(espera_id);
+CREATE INDEX IF NOT EXISTS idx_ofertas_hueco ON ofertas(fecha, hora);
+CREATE INDEX IF NOT EXISTS idx_ofertas_paciente ON ofertas(paciente_id)
+  WHERE estado IN ('pendiente', 'enviada');
+CREATE INDEX IF NOT EXISTS idx_ofertas_vigentes ON ofertas(expira_en)
+  WHERE estado IN ('pendiente', 'enviada');
+
+-- Días en que el salón no abre aunque el horario semanal diga lo contrario
+CREATE TABLE IF NOT EXISTS dias_cerrados (
+  fecha DATE PRIMARY KEY,
+  motivo TEXT,
+  creado_en TIMESTAMP DEFAULT now()
+);
+
+-- Invalidación de caché entre réplicas (modules/cache_sync.py). Avisos
+-- idénticos dentro de una misma transacción se envían una sola vez. Cada
+-- aviso lleva el esquema (un salón por esquema, ver modules/salones.py).
+CREATE OR REPLACE FUNCTION citas_notificar() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'fecha:' || to_char(OLD.fecha, 'YYYY-MM-DD'));
+    IF OLD.paciente_id IS NOT NULL THEN
+      PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'paciente:' || OLD.paciente_id);
+    END IF;
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'fecha:' || to_char(NEW.fecha, 'YYYY-MM-DD'));
+    IF NEW.paciente_id IS NOT NULL THEN
+      PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'paciente:' || NEW.paciente_id);
+    END IF;
+  END IF;
+  PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'citas');
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION pacientes_notificar() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'pacientes');
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sesiones_notificar() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'sesion:' || OLD.id);
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION dias_cerrados_notificar() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'dias_cerrados');
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION por_paciente_notificar() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'paciente:' || OLD.paciente_id);
+  ELSE
+    PERFORM pg_notify('citas_cambio', TG_TABLE_SCHEMA || '/' || 'paciente:' || NEW.paciente_id);
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_citas_notificar
+  AFTER INSERT OR UPDATE OR DELETE ON citas
+  FOR EACH ROW EXECUTE FUNCTION citas_notificar();
+CREATE OR REPLACE TRIGGER trg_pacientes_notificar
+  AFTER INSERT OR UPDATE OR DELETE ON pacientes
+  FOR EACH STATEMENT EXECUTE FUNCTION pacientes_notificar();
+CREATE OR REPLACE TRIGGER trg_sesiones_notificar
+  AFTER UPDATE OR DELETE ON sesiones
+  FOR EACH ROW EXECUTE FUNCTION sesiones_notificar();
+CREATE OR REPLACE TRIGGER trg_dias_cerrados_notificar
+  AFTER INSERT OR UPDATE OR DELETE ON dias_cerrados
+  FOR EACH STATEMENT EXECUTE FUNCTION dias_cerrados_notificar();
+CREATE OR REPLACE TRIGGER trg_espera_notificar
+  AFTER INSERT OR UPDATE OR DELETE ON lista_espera
+  FOR EACH ROW EXECUTE FUNCTION por_paciente_notificar();
+CREATE OR REPLACE TRIGGER trg_ofertas_notificar
+  AFTER INSERT OR UPDATE OR DELETE ON ofertas
+  FOR EACH ROW EXECUTE FUNCTION por_paciente_notificar();
+
+-- Registro de cambios de citas y pacientes para sistemas externos
+-- (modules/cambios.py). Solo se agregan filas; se lee por (xid, seq).
+CREATE TABLE IF NOT EXISTS cambios (
+  seq BIGSERIAL PRIMARY KEY,
+  xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+  tabla TEXT NOT NULL,
+  op CHAR(1) NOT NULL,   -- I / U / D
+  fila_id INTEGER NOT NULL,
+  antes JSONB,
+  despues JSONB,
+  creado_en TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_cambios_xid_seq ON cambios(xid, seq);
+CREATE INDEX IF NOT EXISTS idx_cambios_creado_en ON cambios USING brin (creado_en);
+
+-- TG_ARGV[0] = tabla lógica (en citas el trigger corre en cada partición).
+-- password_hash nunca sale del esquema; un UPDATE que solo la cambia no se registra.
+-- Un UPDATE que cambia la cita de mes (de partición) llega como DELETE + INSERT
+-- del mismo id en la misma transacción: el INSERT convierte esa D en una U.
+-- cambios.hubo_borrado (local a la transacción) evita buscarla en cada INSERT.
+CREATE OR REPLACE FUNCTION registrar_cambio() RETURNS trigger AS $$
+DECLARE
+  antes JSONB;
+  despues JSONB;
+BEGIN
+  IF current_setting('cambios.omitir', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP <> 'INSERT' THEN antes := to_jsonb(OLD) - 'password_hash'; END IF;
+  IF TG_OP <> 'DELETE' THEN despues := to_jsonb(NEW) - 'password_hash'; END IF;
+  IF TG_OP = 'UPDATE' AND antes = despues THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP = 'DELETE' THEN
+    PERFORM set_config('cambios.hubo_borrado', 'on', true);
+  ELSIF TG_OP = 'INSERT' AND current_setting('cambios.hubo_borrado', true) = 'on' THEN
+    UPDATE cambios k SET op = 'U', despues = to_jsonb(NEW) - 'password_hash'
+    WHERE k.seq = (SELECT max(m.seq) FROM cambios m
+                   WHERE m.xid = pg_current_xact_id() AND m.tabla = TG_ARGV[0] AND m.fila_id = NEW.id)
+      AND k.op = 'D';
+    IF FOUND THEN
+      RETURN NULL;
+    END IF;
+  END IF;
+  INSERT INTO cambios (tabla, op, fila_id, antes, despues)
+  VALUES (TG_ARGV[0], left(TG_OP, 1), (COALESCE(despues, antes)->>'id')::int, antes, despues);
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_citas_cambios
+  AFTER INSERT OR UPDATE OR DELETE ON citas
+  FOR EACH ROW EXECUTE FUNCTION registrar_cambio('citas');
+CREATE OR REPLACE TRIGGER trg_pacientes_cambios
+  AFTER INSERT OR UPDATE OR DELETE ON pacientes
+  FOR EACH ROW EXECUTE FUNCTION registrar_cambio('pacientes');
+
+-- Revisión en lote de las reglas de agenda (modules/consistencia.py)
+CREATE TABLE IF NOT EXISTS revisiones (
+  id SERIAL PRIMARY KEY,
+  empezada_en TIMESTAMP NOT NULL DEFAULT now(),
+  terminada_en TIMESTAMP,
+  hallazgos INTEGER,
+  ms INTEGER
+);
+CREATE TABLE IF NOT EXISTS hallazgos (
+  revision_id INTEGER NOT NULL REFERENCES revisiones(id) ON DELETE CASCADE,
+  regla TEXT NOT NULL,   -- mismo_dia | ventana_7_dias | sin_paciente | paciente_duplicado
+  cita_id INTEGER,
+  fecha DATE,
+  hora TIME,
+  paciente_id INTEGER,
+  relacionado_id INTEGER   -- cita anterior del paciente, o el paciente original si es duplicado
+);
+CREATE INDEX IF NOT EXISTS idx_hallazgos_revision ON hallazgos(revision_id, regla);
+"""
+
+# Aparte de SCHEMA_SQL: con datos viejos puede haber duplicados que fusionar antes
+INDICE_E164_SQL = """
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_pacientes_e164 ON pacientes(telefono_e164)
+"""
+
+# Alta o renombre del paciente por teléfono E.164, sin carrera entre dos altas
+# del mismo número. Va como CTE "pac" de la sentencia que escribe la cita: el
+# id sale del RETURNING en la misma sentencia, sin otra búsqueda.
+PACIENTE_CTE = """pac AS (
+          INSERT INTO pacientes(nombre, telefono, telefono_e164) VALUES (%(nombre)s, %(tel)s, %(e164)s)
+          ON CONFLICT (telefono_e164) DO UPDATE SET nombre = EXCLUDED.nombre
+          RETURNING id
+        )"""
+
+SQL: dict[str, str] = {
+    # ---------- Pacientes ----------
+    "paciente_por_telefono": """
+        SELECT id, nombre, telefono, password_hash FROM pacientes WHERE telefono_e164 = %s LIMIT 1
+    """,
+    # Registros viejos con un teléfono que no se pudo pasar a E.164 (ver telefonos.py)
+    "paciente_por_telefono_crudo": """
+        SELECT id, nombre, telefono, password_hash FROM pacientes
+        WHERE telefono = %s AND telefono_e164 IS NULL LIMIT 1
+    """,
+    "paciente_id_por_telefono": """
+        SELECT id FROM pacientes WHERE telefono_e164=%s LIMIT 1
+    """,
+    "registrar_paciente": """
+        INSERT INTO pacientes (nombre, telefono, telefono_e164, password_hash) VALUES (%s, %s, %s, %s) RETURNING id
+    """,
+    "insertar_paciente": """
+        INSERT INTO pacientes(nombre, telefono, telefono_e164) VALUES (%s,%s,%s) RETURNING id
+    """,
+
+    # ---------- Sesiones ----------
+    "crear_sesion": """
+        INSERT INTO sesiones (id, paciente_id, expira_en) VALUES (%s, %s, %s)
+    """,
+    "sesion_activa": """
+        SELECT s.paciente_id AS id, p.nombre, p.telefono
+        FROM sesiones s JOIN pacientes p ON p.id = s.paciente_id
+        WHERE s.id = %s AND s.revocada_en IS NULL AND s.expira_en > now()
+    """,
+    "revocar_sesion": """
+        UPDATE sesiones SET revocada_en = now() WHERE id = %s AND revocada_en IS NULL
+    """,
+    "revocar_sesiones_paciente": """
+        UPDATE sesiones SET revocada_en = now() WHERE paciente_id = %s AND revocada_en IS NULL
+    """,
+
+    # ---------- Citas del paciente ----------
+    "proxima_cita_paciente": """
+        SELECT c.id AS id_cita, c.fecha, c.hora, c.servicio, c.nota
+        FROM citas c
+        WHERE c.paciente_id = %s
+          AND c.fecha >= %s   -- hoy, como parámetro: poda las particiones al planificar
+          AND (c.fecha, c.hora) >= (CURRENT_DATE, LOCALTIME)
+        ORDER BY c.fecha, c.hora
+        LIMIT 1
+    """,
+    "cita_en_dia": """
+        SELECT 1 FROM citas WHERE paciente_id=%s AND fecha=%s LIMIT 1
+    """,
+    "cita_en_ventana_7dias": """
+        SELECT 1 FROM citas
+        WHERE paciente_id=%s
+          AND fecha BETWEEN (%s::date - 6) AND (%s::date + 6)
+        LIMIT 1
+    """,
+
+    # ---------- Agenda ----------
+    "horas_ocupadas": """
+        SELECT hora FROM citas WHERE fecha=%s ORDER BY hora
+    """,
+    "insertar_cita": """
+        INSERT INTO citas(fecha, hora, paciente_id, servicio, nota) VALUES (%s,%s,%s,%s,%s)
+    """,
+    "insertar_cita_por_telefono": """
+        WITH """ + PACIENTE_CTE + """
+        INSERT INTO citas(fecha, hora, paciente_id, servicio, nota)
+        SELECT %(fecha)s, %(hora)s, pac.id, %(servicio)s, %(nota)s FROM pac
+        RETURNING paciente_id
+    """,
+    # Devuelven la fecha y el paciente de antes y después para invalidar solo eso.
+    # La subconsulta del RETURNING lee la foto de antes del UPDATE (la misma sentencia
+    # no ve sus propios cambios): el paciente anterior sin otra búsqueda por id.
+    "actualizar_cita_por_telefono": """
+        WITH """ + PACIENTE_CTE + """
+        UPDATE citas c SET paciente_id = pac.id, servicio = %(servicio)s, nota = %(nota)s
+        FROM pac
+        WHERE c.id = %(cita)s
+        RETURNING c.fecha, (SELECT o.paciente_id FROM citas o WHERE o.id = c.id AND o.fecha = c.fecha),
+                  c.paciente_id
+    """,
+    "citas_por_dia": """
+        SELECT c.id AS id_cita, c.fecha, c.hora, p.id AS paciente_id, p.nombre, p.telefono, c.servicio, c.nota,
+               c.serie_id, p.telefono_e164
+        FROM citas c LEFT JOIN pacientes p ON p.id=c.paciente_id
+        WHERE c.fecha=%s ORDER BY c.hora
+    """,
+    "actualizar_cita": """
+        UPDATE citas c SET paciente_id = %(paciente)s, servicio = %(servicio)s, nota = %(nota)s
+        WHERE c.id = %(cita)s
+        RETURNING c.fecha, (SELECT o.paciente_id FROM citas o WHERE o.id = c.id AND o.fecha = c.fecha),
+                  c.paciente_id
+    """,
+    "eliminar_cita": """
+        DELETE FROM citas WHERE id=%s RETURNING fecha, hora, paciente_id
+    """,
+    # Autoservicio del cliente: solo sus citas que aún no pasan. La fecha de hoy
+    # va como parámetro para podar las particiones viejas al planificar.
+    "cancelar_cita_paciente": """
+        DELETE FROM citas
+        WHERE id = %s AND paciente_id = %s
+          AND fecha >= %s AND (fecha, hora) > (CURRENT_DATE, LOCALTIME)
+        RETURNING fecha, hora
+    """,
+    # Una sentencia (una transacción): bloquea la cita vieja, revisa el día
+    # nuevo y la regla de 7 días (sin contar la cita que se mueve) y la mueve.
+    # Devuelve (estado, fecha vieja, hora vieja); sin filas si la cita no es
+    # del cliente o ya pasó. Si otra transacción toma el horario entre la
+    # revisión y el UPDATE, la restricción única aborta todo: nunca quedan las
+    # dos citas ni ninguna.
+    # Serializa a un mismo paciente en su esquema. Va en su propia sentencia antes
+    # de la revisión: en READ COMMITTED la foto se toma al empezar cada sentencia,
+    # así la siguiente ya ve lo que hizo commit mientras se esperaba el candado.
+    "candado_paciente": """
+        SELECT pg_advisory_xact_lock(hashtext('paciente:' || current_schema()), %s)
+    """,
+    "reprogramar_cita_paciente": """
+        WITH vieja AS (
+          SELECT id, fecha, hora FROM citas
+          WHERE id = %(cita)s AND paciente_id = %(paciente)s
+            AND fecha >= %(hoy)s AND (fecha, hora) > (CURRENT_DATE, LOCALTIME)
+          FOR UPDATE
+        ), revision AS (
+          SELECT CASE
+            WHEN EXISTS (SELECT 1 FROM dias_cerrados WHERE fecha = %(fecha)s) THEN 'dia_cerrado'
+            WHEN EXISTS (SELECT 1 FROM citas o, vieja v
+                         WHERE o.paciente_id = %(paciente)s AND o.id <> v.id
+                           AND o.fecha BETWEEN %(fecha)s::date - 6 AND %(fecha)s::date + 6) THEN 'regla_7_dias'
+            WHEN EXISTS (SELECT 1 FROM citas WHERE fecha = %(fecha)s AND hora = %(hora)s) THEN 'horario_ocupado'
+            ELSE 'ok'
+          END AS estado
+        ), movida AS (
+          UPDATE citas c SET fecha = %(fecha)s, hora = %(hora)s
+          WHERE c.id = %(cita)s AND c.fecha >= %(hoy)s
+            AND c.fecha = (SELECT fecha FROM vieja)   -- al ejecutar: solo la partición de la cita
+            AND (SELECT estado FROM revision) = 'ok'
+        )
+        SELECT r.estado, v.fecha, v.hora FROM vieja v, revision r
+    """,
+    "ultima_cita_agendada": """
+        SELECT c.id AS id_cita, c.creado_en, c.fecha, c.hora, c.servicio, c.nota,
+               p.nombre, p.telefono
+        FROM citas c
+        LEFT JOIN pacientes p ON p.id = c.paciente_id
+        ORDER BY c.creado_en DESC, c.id DESC
+        LIMIT 1
+    """,
+
+    # ---------- Series ----------
+    # Una sola sentencia: crea la serie, revisa cada fecha contra el horario y
+    # la regla de 7 días, inserta las que pasan y devuelve el estado de todas.
+    # ON CONFLICT cubre el choque con otra transacción entre revisión e INSERT.
+    "crear_serie": """
+        WITH """ + PACIENTE_CTE + """, serie AS (
+          INSERT INTO series (paciente_id, hora, cada_semanas, desde, hasta, servicio, nota)
+          SELECT pac.id, %(hora)s, %(cada)s, %(desde)s, %(hasta)s, %(servicio)s, %(nota)s FROM pac
+          RETURNING id, paciente_id
+        ), revisadas AS (
+          SELECT f.fecha,
+                 CASE
+                   WHEN EXISTS (SELECT 1 FROM citas c
+                                WHERE c.fecha = f.fecha AND c.hora = %(hora)s
+                                  AND c.fecha BETWEEN %(desde)s AND %(hasta)s)
+                     THEN 'horario_ocupado'
+                   WHEN EXISTS (SELECT 1 FROM citas c, serie s
+                                WHERE c.paciente_id = s.paciente_id
+                                  AND c.fecha BETWEEN f.fecha - 6 AND f.fecha + 6
+                                  AND c.fecha BETWEEN %(desde)s::date - 6 AND %(hasta)s::date + 6)
+                     THEN 'regla_7_dias'
+                   ELSE 'ok'
+                 END AS estado
+          FROM unnest(%(fechas)s::date[]) AS f(fecha)
+        ), ins AS (
+          INSERT INTO citas (fecha, hora, paciente_id, servicio, nota, serie_id)
+          SELECT r.fecha, %(hora)s, s.paciente_id, %(servicio)s, %(nota)s, s.id
+          FROM revisadas r, serie s
+          WHERE r.estado = 'ok'
+          ON CONFLICT (fecha, hora) DO NOTHING
+          RETURNING fecha
+        )
+        SELECT r.fecha,
+               CASE WHEN r.estado = 'ok' AND i.fecha IS NULL THEN 'horario_ocupado' ELSE r.estado END AS estado,
+               s.id AS serie_id, s.paciente_id
+        FROM revisadas r CROSS JOIN serie s LEFT JOIN ins i ON i.fecha = r.fecha
+        ORDER BY r.fecha
+    """,
+    "recortar_serie": """
+        UPDATE series SET hasta = %s::date - 1 WHERE id = %s
+    """,
+    "cancelar_serie_desde": """
+        DELETE FROM citas WHERE serie_id = %s AND fecha >= %s RETURNING fecha, paciente_id
+    """,
+    "editar_serie": """
+        UPDATE series SET hora = %s, servicio = %s, nota = %s WHERE id = %s
+    """,
+    # Las citas cuyo nuevo horario ya está tomado conservan el anterior y
+    # vuelven con movida = false.
+    "editar_serie_desde": """
+        WITH objetivo AS (
+          SELECT id, fecha, paciente_id FROM citas WHERE serie_id = %(serie)s AND fecha >= %(desde)s
+        ), mov AS (
+          UPDATE citas c SET hora = %(hora)s, servicio = %(servicio)s, nota = %(nota)s
+          FROM objetivo o
+          WHERE c.id = o.id AND c.fecha = o.fecha AND c.fecha >= %(desde)s
+            AND (c.hora = %(hora)s
+                 OR NOT EXISTS (SELECT 1 FROM citas x
+                                WHERE x.fecha = o.fecha AND x.hora = %(hora)s AND x.fecha >= %(desde)s))
+          RETURNING c.id
+        )
+        SELECT o.fecha, o.paciente_id, (m.id IS NOT NULL) AS movida
+        FROM objetivo o LEFT JOIN mov m ON m.id = o.id
+        ORDER BY o.fecha
+    """,
+
+    # ---------- Cierre de días ----------
+    "dias_cerrados": """
+        SELECT fecha FROM dias_cerrados WHERE fecha >= CURRENT_DATE ORDER BY fecha
+    """,
+    "ocupacion_rango": """
+        SELECT fecha, hora, paciente_id FROM citas WHERE fecha BETWEEN %s AND %s
+    """,
+    "cerrar_dia": """
+        INSERT INTO dias_cerrados (fecha, motivo) VALUES (%s, %s)
+        ON CONFLICT (fecha) DO UPDATE SET motivo = EXCLUDED.motivo
+    """,
+    "reabrir_dia": """
+        DELETE FROM dias_cerrados WHERE fecha = %s
+    """,
+    # Todas las citas del día cerrado a su nuevo (fecha, hora) en un solo UPDATE
+    "reprogramar_citas": """
+        UPDATE citas c SET fecha = m.fecha, hora = m.hora
+        FROM unnest(%s::int[], %s::date[], %s::time[]) AS m(id, fecha, hora)
+        WHERE c.id = m.id AND c.fecha = %s
+        RETURNING c.id, c.fecha, c.paciente_id
+    """,
+
+    # ---------- Lista de espera ----------
+    "agregar_espera": """
+        INSERT INTO lista_espera (paciente_id, desde, hasta, hora_min, hora_max, servicio)
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+    """,
+    "esperas_paciente": """
+        SELECT id, desde, hasta, hora_min, hora_max, servicio FROM lista_espera
+        WHERE paciente_id = %s AND atendida_en IS NULL AND hasta >= CURRENT_DATE
+        ORDER BY desde, id
+    """,
+    "cancelar_espera": """
+        DELETE FROM lista_espera WHERE id = %s AND paciente_id = %s
+    """,
+    # Candidato para un hueco recién liberado: la entrada más antigua cuyo rango
+    # contiene la fecha (índice GiST), que acepte esa hora, sin otra cita a menos
+    # de 7 días, sin otra oferta vigente (de ningún hueco) y a la que no se le
+    # haya ofrecido ya este. SKIP LOCKED: dos réplicas no eligen a la misma persona.
+    "crear_oferta": """
+        WITH cand AS (
+          SELECT e.id, e.paciente_id
+          FROM lista_espera e
+          WHERE daterange(e.desde, e.hasta, '[]') @> %(fecha)s::date
+            AND e.atendida_en IS NULL
+            AND (e.hora_min IS NULL OR e.hora_min <= %(hora)s)
+            AND (e.hora_max IS NULL OR e.hora_max >= %(hora)s)
+            AND NOT EXISTS (SELECT 1 FROM citas c WHERE c.fecha = %(fecha)s AND c.hora = %(hora)s)
+            AND NOT EXISTS (SELECT 1 FROM citas c
+                            WHERE c.paciente_id = e.paciente_id
+                              AND c.fecha BETWEEN %(fecha)s::date - 6 AND %(fecha)s::date + 6)
+            AND NOT EXISTS (SELECT 1 FROM ofertas o
+                            WHERE o.fecha = %(fecha)s AND o.hora = %(hora)s AND o.espera_id = e.id)
+            AND NOT EXISTS (SELECT 1 FROM ofertas o
+                            WHERE o.paciente_id = e.paciente_id
+                              AND o.estado IN ('pendiente', 'enviada') AND o.expira_en > now())
+          ORDER BY e.creado_en, e.id
+          LIMIT 1
+          FOR UPDATE OF e SKIP LOCKED
+        ), oferta AS (
+          INSERT INTO ofertas (espera_id, paciente_id, fecha, hora, expira_en)
+          SELECT id, paciente_id, %(fecha)s, %(hora)s, now() + make_interval(mins => %(minutos)s) FROM cand
+          RETURNING id, paciente_id
+        )
+        SELECT o.id, o.paciente_id, p.nombre, p.telefono_e164
+        FROM oferta o JOIN pacientes p ON p.id = o.paciente_id
+    """,
+    "marcar_oferta": """
+        UPDATE ofertas SET estado = %s
+        WHERE id = %s AND estado IN ('pendiente', 'enviada')
+        RETURNING fecha, hora, paciente_id
+    """,
+    "rechazar_oferta": """
+        UPDATE ofertas SET estado = 'rechazada'
+        WHERE id = %s AND paciente_id = %s AND estado IN ('pendiente', 'enviada')
+        RETURNING fecha, hora
+    """,
+    # El vencimiento lo decide la BD (no un timer del proceso que ofreció): sirve
+    # tras un reinicio y desde cualquier réplica; SKIP LOCKED reparte el trabajo.
+    "vencer_ofertas": """
+        UPDATE ofertas SET estado = 'expirada'
+        WHERE id IN (SELECT id FROM ofertas
+                     WHERE estado IN ('pendiente', 'enviada') AND expira_en < now()
+                     ORDER BY expira_en
+                     LIMIT %s
+                     FOR UPDATE SKIP LOCKED)
+        RETURNING fecha, hora, paciente_id
+    """,
+    "ofertas_paciente": """
+        SELECT o.id, o.fecha, o.hora, o.expira_en, e.servicio
+        FROM ofertas o JOIN lista_espera e ON e.id = o.espera_id
+        WHERE o.paciente_id = %s AND o.estado IN ('pendiente', 'enviada') AND o.expira_en > now()
+        ORDER BY o.fecha, o.hora
+    """,
+    # Acepta la oferta, cierra la entrada de espera y crea la cita en una sola
+    # sentencia; si el horario ya se tomó, el UniqueViolation revierte todo.
+    "aceptar_oferta": """
+        WITH o AS (
+          UPDATE ofertas SET estado = 'aceptada'
+          WHERE id = %(oferta)s AND paciente_id = %(paciente)s
+            AND estado IN ('pendiente', 'enviada') AND expira_en > now()
+            AND NOT EXISTS (SELECT 1 FROM citas c
+                            WHERE c.paciente_id = %(paciente)s
+                              AND c.fecha BETWEEN ofertas.fecha - 6 AND ofertas.fecha + 6)
+          RETURNING espera_id, paciente_id, fecha, hora
+        ), e AS (
+          UPDATE lista_espera le SET atendida_en = now()
+          FROM o WHERE le.id = o.espera_id
+          RETURNING le.servicio
+        )
+        INSERT INTO citas (fecha, hora, paciente_id, servicio)
+        SELECT o.fecha, o.hora, o.paciente_id, e.servicio FROM o, e
+        RETURNING fecha, hora
+    """,
+
+    # ---------- Registro de cambios ----------
+    # Solo transacciones anteriores al xmin de la instantánea: ya terminaron y
+    # no pueden aparecer más filas con ese xid, así que la posición (xid, seq)
+    # nunca se salta un cambio que todavía no había hecho commit.
+    "cambios_desde": """
+        SELECT k.seq, k.xid::text AS xid, k.tabla, k.op, k.fila_id, k.antes, k.despues, k.creado_en
+        FROM cambios k
+        WHERE (k.xid, k.seq) > (%s::xid8, %s)
+          AND k.xid < pg_snapshot_xmin(pg_current_snapshot())
+        ORDER BY k.xid, k.seq
+        LIMIT %s
+    """,
+    "cambios_ultima_posicion": """
+        SELECT k.xid::text, k.seq FROM cambios k
+        WHERE k.xid < pg_snapshot_xmin(pg_current_snapshot())
+        ORDER BY k.xid DESC, k.seq DESC
+        LIMIT 1
+    """,
+    # Hay cambios después de la posición que cambios_desde aún no entrega
+    # (su transacción o una anterior sigue abierta)
+    "cambios_retenidos": """
+        SELECT 1 FROM cambios k WHERE (k.xid, k.seq) > (%s::xid8, %s) LIMIT 1
+    """,
+    # En lotes (lo llama modules/cambios.podar hasta que borra menos de un lote)
+    "podar_cambios": """
+        DELETE FROM cambios WHERE seq = ANY(ARRAY(
+          SELECT seq FROM cambios WHERE creado_en < now() - make_interval(days => %s) LIMIT %s))
+    """,
+
+    # ---------- Feeds iCalendar (modules/calendario.py) ----------
+    "ics_agenda_desde": """
+        SELECT c.id, c.fecha, c.hora, c.servicio, c.nota, c.creado_en, p.nombre, p.telefono
+        FROM citas c LEFT JOIN pacientes p ON p.id = c.paciente_id
+        WHERE c.fecha >= %s
+        ORDER BY c.fecha, c.hora
+    """,
+    "ics_agenda_dias": """
+        SELECT c.id, c.fecha, c.hora, c.servicio, c.nota, c.creado_en, p.nombre, p.telefono
+        FROM citas c LEFT JOIN pacientes p ON p.id = c.paciente_id
+        WHERE c.fecha = ANY(%s::date[])
+        ORDER BY c.fecha, c.hora
+    """,
+    "ics_pacientes": """
+        SELECT c.id, c.paciente_id, c.fecha, c.hora, c.servicio, c.nota, c.creado_en
+        FROM citas c
+        WHERE c.paciente_id = ANY(%s::int[]) AND c.fecha >= %s
+        ORDER BY c.paciente_id, c.fecha, c.hora
+    """,
+    "ics_pacientes_desde": """
+        SELECT c.id, c.paciente_id, c.fecha, c.hora, c.servicio, c.nota, c.creado_en
+        FROM citas c
+        WHERE c.paciente_id IS NOT NULL AND c.fecha >= %s
+        ORDER BY c.paciente_id, c.fecha, c.hora
+    """,
+
+    # ---------- Revisión de reglas (modules/consistencia.py) ----------
+    "revision_candado": """
+        SELECT pg_try_advisory_xact_lock(hashtext('revision:' || current_schema()))
+    """,
+    "revision_crear": """
+        INSERT INTO revisiones DEFAULT VALUES RETURNING id
+    """,
+    # Una pasada por citas ordenada por (paciente, fecha, hora): basta comparar
+    # cada cita con la anterior del mismo paciente, porque si dos citas están a
+    # menos de 7 días también lo están dos consecutivas. La cita que se reporta
+    # es la posterior. Y una pasada por pacientes agrupando por teléfono (el
+    # E.164 si lo tiene; la expresión regular solo para los que no).
+    "revision_hallazgos": """
+        INSERT INTO hallazgos (revision_id, regla, cita_id, fecha, hora, paciente_id, relacionado_id)
+        SELECT %(revision)s, v.regla, x.id, x.fecha, x.hora, x.paciente_id, x.previa_id
+        FROM (
+          SELECT c.id, c.fecha, c.hora, c.paciente_id,
+                 lag(c.id) OVER w AS previa_id, lag(c.fecha) OVER w AS previa_fecha
+          FROM citas c
+          WINDOW w AS (PARTITION BY c.paciente_id ORDER BY c.fecha, c.hora)
+        ) x
+        CROSS JOIN LATERAL (VALUES (CASE
+          WHEN x.paciente_id IS NULL THEN 'sin_paciente'
+          WHEN x.fecha = x.previa_fecha THEN 'mismo_dia'
+          WHEN x.fecha - x.previa_fecha < 7 THEN 'ventana_7_dias'
+        END)) AS v(regla)
+        WHERE v.regla IS NOT NULL
+        UNION ALL
+        SELECT %(revision)s, 'paciente_duplicado', NULL, NULL, NULL, d.id, d.original_id
+        FROM (
+          SELECT p.id, first_value(p.id) OVER (
+                   PARTITION BY right(coalesce(p.telefono_e164, regexp_replace(p.telefono, '\\D', '', 'g')), 10)
+                   ORDER BY p.id) AS original_id
+          FROM pacientes p
+        ) d
+        WHERE d.id <> d.original_id
+    """,
+    "revision_cerrar": """
+        UPDATE revisiones SET terminada_en = now(), hallazgos = %s, ms = %s WHERE id = %s
+    """,
+    # Los hallazgos se van con su revisión (ON DELETE CASCADE)
+    "revision_podar": """
+        DELETE FROM revisiones
+        WHERE id <= (SELECT id FROM revisiones ORDER BY id DESC OFFSET %s LIMIT 1)
+    """,
+    "revision_ultima": """
+        SELECT id, empezada_en, terminada_en, hallazgos, ms FROM revisiones
+        WHERE terminada_en IS NOT NULL
+        ORDER BY id DESC LIMIT 1
+    """,
+    "revision_resumen": """
+        SELECT regla, count(*) FROM hallazgos WHERE revision_id = %s GROUP BY regla
+    """,
+    "revision_detalle": """
+        SELECT h.regla, h.fecha, h.hora, h.cita_id, h.paciente_id, p.nombre, p.telefono, h.relacionado_id
+        FROM hallazgos h LEFT JOIN pacientes p ON p.id = h.paciente_id
+        WHERE h.revision_id = %s AND h.regla = ANY(%s::text[])
+        ORDER BY h.regla, h.fecha DESC NULLS LAST, h.hora, h.paciente_id
+        LIMIT %s
+    """,
+
+    # ---------- Recordatorios ----------
+    "citas_manana": """
+        SELECT c.id AS id_cita, c.fecha, c.hora, c.servicio, c.nota,
+               p.id AS paciente_id, p.nombre, p.telefono, p.telefono_e164
+        FROM citas c
+        JOIN pacientes p ON p.id = c.paciente_id
+        WHERE c.fecha = %s
+        ORDER BY c.hora
+    """,
+}
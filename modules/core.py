@@ -1,20 +1,24 @@
 # modules/core.py — DB + lógica común (tomado de tu archivo único)
-import os, re, bcrypt
+import os, re, bcrypt, logging, threading, time as _time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
 from datetime import date, datetime, timedelta, time
 import pandas as pd
-import psycopg
 from psycopg import errors as pg_errors
 from psycopg import OperationalError
+from psycopg_pool import ConnectionPool
 import streamlit as st
 import requests
+from modules.consultas import SQL
+from modules.storage import Repositorio, MemoriaRepo, SlotOcupado, TelefonoDuplicado
+from modules import limites, cache_sync, particiones, calendario, salones, consistencia, perfil
+from modules.telefonos import a_e164
+from modules.secretos import secreto as _get_secret, pimienta
 
-
-def _get_secret(key: str, default=None):
-    try:
-        return st.secrets.get(key, default)
-    except Exception:
-        return default
+log = logging.getLogger(__name__)
 
 # ---------- Config ----------
 HORA_INICIO: time = time(9, 0)
@@ -23,10 +27,19 @@ PASO_MIN:    int  = 30
 BLOQUEO_DIAS_MIN: int = 2   # hoy/mañana bloqueados → pacientes desde día 3
 
 NEON_URL = os.getenv("NEON_DATABASE_URL") or _get_secret("NEON_DATABASE_URL")
+# "postgres" (por defecto) o "memoria" (pruebas/benchmarks sin BD)
+BACKEND = (os.getenv("CITAS_BACKEND") or _get_secret("CITAS_BACKEND") or "postgres").lower()
 ADMIN_USER = os.getenv("ADMIN_USER") or _get_secret("CARMEN_USER", "carmen")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD") or _get_secret("CARMEN_PASSWORD")
 
-PEPPER = (os.getenv("PASSWORD_PEPPER") or _get_secret("PASSWORD_PEPPER") or "").encode()
+PEPPER = pimienta()
+# Firma de cookies de sesión; sin este secreto no se recuerdan sesiones entre visitas
+SESSION_SECRET = (os.getenv("SESSION_SECRET") or _get_secret("SESSION_SECRET") or "").encode()
+SESION_DIAS: int = 30
+# Zona del salón para mostrar horas guardadas con zona (p. ej. vencimiento de ofertas)
+ZONA_SALON = ZoneInfo(os.getenv("SALON_TZ") or _get_secret("SALON_TZ") or "America/Mexico_City")
+# Con la invalidación por LISTEN/NOTIFY el TTL es solo un respaldo
+CACHE_TTL_S: int = 300
 
 def normalize_tel(t: str) -> str:
     return re.sub(r'[-\s]+', '', t.strip().lower())
@@ -43,90 +56,513 @@ def check_password(pw: str, pw_hash: str) -> bool:
     except Exception:
         return False
 
-def is_admin_ok(user: str, pw: str) -> bool:
-    return bool(ADMIN_USER and ADMIN_PASSWORD and user == ADMIN_USER and pw == ADMIN_PASSWORD)
+def is_admin_ok(user: str, pw: str, ip: Optional[str] = None) -> bool:
+    """LoginBloqueado (antes de bcrypt) tras demasiados intentos del usuario en este salón o de la IP."""
+    s = salones.actual()
+    clave = f"{s.slug}/admin/{user}"
+    limites.permitir_login(clave, ip, cuenta="esta cuenta")
+    if s.principal:
+        ok = bool(ADMIN_USER and ADMIN_PASSWORD and user == ADMIN_USER and pw == ADMIN_PASSWORD)
+    else:
+        ok = bool(s.admin_hash and user == s.admin_user and check_password(pw, s.admin_hash))
+    if ok:
+        limites.login_exitoso(clave)
+    return ok
+
+def admin_usuario() -> Optional[str]:
+    s = salones.actual()
+    return ADMIN_USER if s.principal else s.admin_user
 
 # ---------- Conexión ----------
+POOL_MAX: int = int(os.getenv("DB_POOL_MAX") or 5)
+
 @st.cache_resource
-def _connect():
+def _pool() -> ConnectionPool:
     if not NEON_URL:
         st.error("Falta configurar NEON_DATABASE_URL (env o Streamlit secrets).")
         st.stop()
+    # max_idle < 5 min: Neon cierra conexiones inactivas al suspender el cómputo;
+    # así no hace falta un "SELECT 1" de prueba antes de cada consulta.
+    # CursorMedido: si la página se está perfilando, anota cada consulta (ver modules/perfil.py)
+    pool = ConnectionPool(NEON_URL, kwargs={"autocommit": True, "cursor_factory": perfil.CursorMedido},
+                          min_size=1, max_size=POOL_MAX,
+                          max_idle=240, open=False)
     try:
-        return psycopg.connect(NEON_URL, autocommit=True)
+        pool.open(wait=True, timeout=15)
     except OperationalError as e:
         st.error(f"No se pudo conectar a PostgreSQL/Neon: {e}")
         st.stop()
+    return pool
 
+@contextmanager
 def conn():
-    c = _connect()
-    try:
-        if getattr(c, "closed", False):
-            raise psycopg.OperationalError("closed")
-        with c.cursor() as cur:
-            cur.execute("SELECT 1")
-    except Exception:
-        try:
-            st.cache_resource.clear()
-        except Exception:
-            pass
-        c = _connect()
-    return c
-
-def exec_sql(q_ps: str, p: tuple = ()):
-    with conn().cursor() as cur:
+    """Conexión exclusiva del pool (autocommit) durante el bloque, en el esquema
+    del salón actual y dentro de su cupo (ver modules/salones.py)."""
+    s = salones.actual()
+    with s.cupo.tomar(), _pool().connection() as c:
+        salones.fijar(c, s)
+        yield c
+
+# ---------- Caché ----------
+# Las lecturas cacheadas reciben cache_sync.version(claves): cambia cuando
+# cualquier réplica escribe algo que afecte esas claves (ver cache_sync.py).
+def _k_fecha(f) -> str:
+    return f"fecha:{f:%Y-%m-%d}"
+
+def _k_paciente(pid) -> str:
+    return f"paciente:{int(pid)}"
+
+def _invalidar(*claves: str):
+    """Invalidación local inmediata; las demás réplicas se enteran por NOTIFY."""
+    if claves:
+        cache_sync.invalidar(*claves)
+    else:
+        cache_sync.invalidar_todo()
+
+def exec_sql(q_ps: str, p: tuple = (), claves: tuple = ()):
+    with conn() as c, c.cursor() as cur:
         cur.execute(q_ps, p)
-    try:
-        st.cache_data.clear()
-    except Exception:
-        pass
+    _invalidar(*claves)
 
-@st.cache_data(show_spinner=False, ttl=5)
-def query_df(q_ps: str, p: tuple = ()):
-    with conn().cursor() as cur:
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL_S)
+def query_df(q_ps: str, p: tuple = (), version: tuple = ()):
+    with conn() as c, c.cursor() as cur:
         cur.execute(q_ps, p)
-        cols = [c.name for c in cur.description]
+        cols = [d.name for d in cur.description]
         rows = cur.fetchall()
     return pd.DataFrame(rows, columns=cols)
 
 def query_df_fresh(q_ps: str, p: tuple = ()):
-    with conn().cursor() as cur:
+    with conn() as c, c.cursor() as cur:
         cur.execute(q_ps, p)
-        cols = [c.name for c in cur.description]
+        cols = [d.name for d in cur.description]
         rows = cur.fetchall()
     return pd.DataFrame(rows, columns=cols)
 
-# ---------- Esquema ----------
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS pacientes (
-  id SERIAL PRIMARY KEY,
-  nombre TEXT NOT NULL,
-  telefono TEXT NOT NULL UNIQUE,
-  password_hash TEXT,
-  creado_en TIMESTAMP DEFAULT now()
-);
-
-CREATE TABLE IF NOT EXISTS citas (
-  id SERIAL PRIMARY KEY,
-  fecha DATE NOT NULL,
-  hora TIME NOT NULL,
-  paciente_id INTEGER REFERENCES pacientes(id) ON DELETE SET NULL,
-  servicio TEXT,
-  nota TEXT,
-  creado_en TIMESTAMP DEFAULT now(),
-  UNIQUE (fecha, hora)
-);
-
-ALTER TABLE citas ADD COLUMN IF NOT EXISTS servicio TEXT;
-
-CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas(fecha);
-"""
+# ---------- Unidad de trabajo ----------
+class UnidadDeTrabajo:
+    """Varias sentencias en UNA transacción, enviadas en modo pipeline (una ida y vuelta).
+
+        with UnidadDeTrabajo() as uow:
+            uow.agregar(SQL["recortar_serie"], (desde, serie_id))
+            i = uow.agregar(SQL["..."], (...), devuelve=True)
+        uow.resultados[i]   # filas si devuelve=True, si no rowcount
+    """
+
+    def __init__(self, claves: tuple = ()):
+        self._claves = claves   # claves de caché a invalidar; vacío = todas
+        self._sentencias: list[tuple[str, tuple | dict, bool]] = []
+        self.resultados: list = []
 
+    def agregar(self, q_ps: str, p: tuple | dict = (), devuelve: bool = False) -> int:
+        self._sentencias.append((q_ps, p, devuelve))
+        return len(self._sentencias) - 1
+
+    def ejecutar(self) -> list:
+        with conn() as c:
+            curs = []
+            try:
+                # BEGIN/COMMIT como sentencias normales: c.transaction() sincroniza
+                # al entrar y al salir y serían tres idas y vueltas en vez de una.
+                with c.pipeline():
+                    c.execute("BEGIN")
+                    for q_ps, p, _ in self._sentencias:
+                        cur = c.cursor()
+                        cur.execute(q_ps, p)
+                        curs.append(cur)
+                    c.execute("COMMIT")
+            except Exception:
+                c.rollback()
+                raise
+            self.resultados = [
+                cur.fetchall() if dev else cur.rowcount
+                for cur, (_, _, dev) in zip(curs, self._sentencias)
+            ]
+            for cur in curs:
+                cur.close()
+        _invalidar(*self._claves)
+        return self.resultados
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.ejecutar()
+        return False
+
+# ---------- Esquema ----------
 def ensure_schema():
-    exec_sql(SCHEMA_SQL)
+    with conn() as c:
+        lista = salones.cargar(c, POOL_MAX)
+    for s in lista:
+        with salones.usando(s), conn() as c:
+            # tablas, teléfono E.164 y particiones: no-op lo que ya esté hecho
+            res = salones.preparar(c)
+        if res:
+            log.info("esquema %s migrado: %s", s.esquema, res)
+        if res.get("telefono_e164", {}).get("sin_e164"):
+            log.warning("esquema %s: pacientes sin telefono_e164 (teléfono no interpretable): %s",
+                        s.esquema, res["telefono_e164"]["ids_sin_e164"])
+    _invalidar()
+
+# ---------- Salones ----------
+RECARGA_SALONES_S: int = 60
+_lock_salones = threading.Lock()
+
+def _recargar_salones(forzar: bool = False):
+    """Relee public.salones cada RECARGA_SALONES_S; con forzar (slug desconocido)
+    antes, pero no más de una vez cada 5 s para que un slug inventado no cargue la BD."""
+    if not isinstance(_repo, PostgresRepo):
+        return
+    if salones.cargado_hace() < (5 if forzar else RECARGA_SALONES_S):
+        return
+    if not _lock_salones.acquire(blocking=False):
+        return
+    try:
+        with salones.usando(salones.PRINCIPAL), conn() as c:
+            lista = salones.cargar(c, POOL_MAX)
+    finally:
+        _lock_salones.release()
+    calendario.iniciar(NEON_URL, SESSION_SECRET, PASO_MIN, lista)   # feeds de salones nuevos
+
+def elegir_salon() -> salones.Salon:
+    """Salón de esta sesión según la URL: subdominio o ?salon=<slug>. Sin ninguno
+    se queda el que ya tenía la sesión (al cambiar de página se pierde el ?salon=)."""
+    _recargar_salones()
+    host = salones.de_host(st.context.headers.get("host"))
+    pedido = host if host is not None else st.query_params.get("salon")
+    slug = pedido if pedido is not None else st.session_state.get("salon", "")
+    s = salones.buscar(slug)
+    if s is None:
+        _recargar_salones(forzar=True)
+        s = salones.buscar(slug)
+    if s is None:
+        st.error("No encontramos ese salón. Revisa el enlace.")
+        st.stop()
+    if st.session_state.get("salon", "") != s.slug:
+        # la sesión iniciada en otro salón no vale en este
+        st.session_state.role = None
+        st.session_state.paciente = None
+    st.session_state["salon"] = s.slug
+    if s.slug and host is None and st.query_params.get("salon") != s.slug:
+        st.query_params["salon"] = s.slug   # que recargar la página no cambie de salón
+    _barrer_ofertas()   # ofertas vencidas aunque las haya hecho otra réplica o un proceso que ya no está
+    return s
+
+def salon_actual() -> salones.Salon:
+    return salones.actual()
+
+def uso_conexiones() -> dict:
+    """Contadores del cupo de conexiones del salón actual (en este proceso)."""
+    return salones.actual().cupo.estadisticas()
+
+# ---------- Repositorio Postgres ----------
+def _horario_tomado(e: pg_errors.UniqueViolation) -> bool:
+    """Si viene de UNIQUE (fecha, hora) de citas o de la de un mes (citas_2025_06_fecha_hora_key).
+    Cualquier otra (p. ej. el teléfono de un paciente) no es un horario ocupado."""
+    nombre = e.diag.constraint_name or ""
+    return nombre.startswith("citas") and nombre.endswith("_fecha_hora_key")
+
+class PostgresRepo:
+    """Implementación de storage.Repositorio sobre Neon/PostgreSQL."""
+
+    def paciente_por_telefono(self, tel: str) -> Optional[dict]:
+        e164 = a_e164(tel)
+        q, p = (SQL["paciente_por_telefono"], (e164,)) if e164 else (SQL["paciente_por_telefono_crudo"], (tel,))
+        df = query_df(q, p, cache_sync.version("pacientes"))
+        return None if df.empty else df.iloc[0].to_dict()
+
+    def registrar_paciente(self, nombre: str, tel: str, pw_hash: str) -> int:
+        try:
+            with conn() as c, c.cursor() as cur:
+                cur.execute(SQL["registrar_paciente"], (nombre, tel, a_e164(tel), pw_hash))
+                pid = cur.fetchone()[0]
+        except pg_errors.UniqueViolation:
+            raise TelefonoDuplicado(tel)
+        _invalidar("pacientes")
+        return int(pid)
+
+    def crear_o_encontrar_paciente(self, nombre: str, tel: str) -> int:
+        df = query_df(SQL["paciente_id_por_telefono"], (a_e164(tel),), cache_sync.version("pacientes"))
+        if not df.empty:
+            return int(df.iloc[0]["id"])
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["insertar_paciente"], (nombre, tel, a_e164(tel)))
+            new_id = cur.fetchone()[0]
+        _invalidar("pacientes")
+        return int(new_id)
+
+    def crear_sesion(self, sid: str, paciente_id: int, expira_en: datetime) -> None:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["crear_sesion"], (sid, paciente_id, expira_en))
+
+    def sesion_activa(self, sid: str) -> Optional[dict]:
+        df = query_df_fresh(SQL["sesion_activa"], (sid,))
+        if df.empty:
+            return None
+        r = df.iloc[0]
+        return {"id": int(r["id"]), "nombre": r["nombre"], "telefono": r["telefono"]}
+
+    def revocar_sesion(self, sid: str) -> None:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["revocar_sesion"], (sid,))
+
+    def revocar_sesiones_paciente(self, paciente_id: int) -> None:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["revocar_sesiones_paciente"], (paciente_id,))
+
+    def proxima_cita(self, paciente_id: int):
+        return query_df(SQL["proxima_cita_paciente"], (paciente_id, date.today()),
+                        cache_sync.version(_k_paciente(paciente_id)))
+
+    def cita_en_dia(self, paciente_id: int, fecha: date) -> bool:
+        return not query_df_fresh(SQL["cita_en_dia"], (paciente_id, fecha)).empty
+
+    def cita_en_ventana_7dias(self, paciente_id: int, fecha_ref: date) -> bool:
+        return not query_df_fresh(SQL["cita_en_ventana_7dias"], (paciente_id, fecha_ref, fecha_ref)).empty
+
+    def horas_ocupadas(self, fecha: date) -> set:
+        df = query_df(SQL["horas_ocupadas"], (fecha,), cache_sync.version(_k_fecha(fecha)))
+        return set(df["hora"].tolist())
+
+    def insertar_cita(self, fecha: date, hora: time, paciente_id: Optional[int], servicio: str, nota: Optional[str]) -> None:
+        try:
+            exec_sql(SQL["insertar_cita"], (fecha, hora, paciente_id, servicio, nota),
+                     (_k_fecha(fecha), "citas") + ((_k_paciente(paciente_id),) if paciente_id else ()))
+        except pg_errors.UniqueViolation as e:
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado((fecha, hora))
+
+    def crear_cita_con_paciente(self, fecha: date, hora: time, nombre: str, tel: str,
+                                servicio: str, nota: Optional[str]) -> None:
+        try:
+            with conn() as c, c.cursor() as cur:
+                cur.execute(SQL["insertar_cita_por_telefono"],
+                            {"nombre": nombre, "tel": tel, "e164": a_e164(tel), "fecha": fecha, "hora": hora,
+                             "servicio": servicio, "nota": nota})
+                pid = cur.fetchone()[0]
+        except pg_errors.UniqueViolation as e:
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado((fecha, hora))
+        _invalidar(_k_fecha(fecha), "citas", "pacientes", _k_paciente(pid))
+
+    def actualizar_cita_con_paciente(self, cita_id: int, nombre: str, tel: str,
+                                     servicio: str, nota: Optional[str]) -> None:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["actualizar_cita_por_telefono"],
+                        {"cita": cita_id, "nombre": nombre, "tel": tel, "e164": a_e164(tel),
+                         "servicio": servicio, "nota": nota})
+            filas = cur.fetchall()
+        _invalidar("pacientes")
+        self._invalidar_editada(filas)
+
+    def citas_por_dia(self, fecha: date):
+        return query_df(SQL["citas_por_dia"], (fecha,), cache_sync.version(_k_fecha(fecha), "pacientes"))
+
+    def actualizar_cita(self, cita_id: int, paciente_id: int, servicio: str, nota: Optional[str]) -> None:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["actualizar_cita"],
+                        {"cita": cita_id, "paciente": paciente_id, "servicio": servicio, "nota": nota})
+            filas = cur.fetchall()
+        self._invalidar_editada(filas)
+
+    @staticmethod
+    def _invalidar_editada(filas: list):
+        """El día de la cita y los pacientes de antes y después (ninguno si no existía)."""
+        for fecha, antes, despues in filas:
+            _invalidar(_k_fecha(fecha), "citas", *{_k_paciente(p) for p in (antes, despues) if p})
+
+    def eliminar_cita(self, cita_id: int) -> Optional[tuple[date, time]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["eliminar_cita"], (cita_id,))
+            fila = cur.fetchone()
+        if fila is None:
+            return None
+        fecha, hora, pid = fila
+        _invalidar(_k_fecha(fecha), "citas", *((_k_paciente(pid),) if pid else ()))
+        return fecha, hora
+
+    def cancelar_cita_paciente(self, cita_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["cancelar_cita_paciente"], (cita_id, paciente_id, date.today()))
+            fila = cur.fetchone()
+        if fila:
+            _invalidar(_k_fecha(fila[0]), _k_paciente(paciente_id))
+        return fila
+
+    def reprogramar_cita_paciente(self, cita_id: int, paciente_id: int, fecha: date,
+                                  hora: time) -> Optional[tuple[str, date, time]]:
+        try:
+            # dos cambios del mismo paciente a la vez no pueden pasar ambos la regla de 7 días
+            with UnidadDeTrabajo(claves=(_k_paciente(paciente_id),)) as uow:
+                uow.agregar(SQL["candado_paciente"], (paciente_id,))
+                i = uow.agregar(SQL["reprogramar_cita_paciente"], {"cita": cita_id, "paciente": paciente_id,
+                                                                   "hoy": date.today(), "fecha": fecha, "hora": hora},
+                                devuelve=True)
+        except pg_errors.UniqueViolation as e:
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado((fecha, hora))
+        fila = uow.resultados[i][0] if uow.resultados[i] else None
+        if fila and fila[0] == "ok":
+            # solo los dos días tocados y el paciente; las demás réplicas se enteran por NOTIFY
+            _invalidar(_k_fecha(fila[1]), _k_fecha(fecha), _k_paciente(paciente_id))
+        return fila
+
+    def ultima_cita(self):
+        return query_df(SQL["ultima_cita_agendada"], (), cache_sync.version("citas", "pacientes"))
+
+    def citas_manana(self):
+        manana = date.today() + timedelta(days=1)
+        return query_df(SQL["citas_manana"], (manana,), cache_sync.version(_k_fecha(manana), "pacientes"))
+
+    def crear_serie(self, fechas: list[date], hora: time, cada_semanas: int, nombre: str, tel: str,
+                    servicio: str, nota: Optional[str]) -> list[tuple[date, str]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["crear_serie"], {
+                "nombre": nombre, "tel": tel, "e164": a_e164(tel), "hora": hora, "cada": cada_semanas,
+                "desde": min(fechas), "hasta": max(fechas), "servicio": servicio, "nota": nota,
+                "fechas": list(fechas),
+            })
+            filas = cur.fetchall()
+        _invalidar("citas", "pacientes")
+        if filas and filas[0][3] is not None:
+            _invalidar(_k_paciente(filas[0][3]), *(_k_fecha(f) for f, e, _, _ in filas if e == "ok"))
+        return [(f, e) for f, e, _, _ in filas]
+
+    def cancelar_serie_desde(self, serie_id: int, desde: date) -> int:
+        with UnidadDeTrabajo(claves=("citas",)) as uow:
+            uow.agregar(SQL["recortar_serie"], (desde, serie_id))
+            i = uow.agregar(SQL["cancelar_serie_desde"], (serie_id, desde), devuelve=True)
+        borradas = uow.resultados[i]
+        _invalidar(*{_k_fecha(f) for f, _ in borradas}, *{_k_paciente(p) for _, p in borradas if p})
+        return len(borradas)
+
+    def editar_serie_desde(self, serie_id: int, desde: date, hora: time, servicio: str,
+                           nota: Optional[str]) -> list[tuple[date, bool]]:
+        try:
+            with UnidadDeTrabajo(claves=("citas",)) as uow:
+                uow.agregar(SQL["editar_serie"], (hora, servicio, nota, serie_id))
+                i = uow.agregar(SQL["editar_serie_desde"], {
+                    "serie": serie_id, "desde": desde, "hora": hora, "servicio": servicio, "nota": nota,
+                }, devuelve=True)
+        except pg_errors.UniqueViolation as e:
+            # otra transacción tomó uno de los horarios entre la revisión y el UPDATE
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado((desde, hora))
+        filas = uow.resultados[i]
+        _invalidar(*{_k_fecha(f) for f, _, _ in filas}, *{_k_paciente(p) for _, p, _ in filas if p})
+        return [(f, bool(m)) for f, _, m in filas]
+
+    def dias_cerrados(self) -> set:
+        return set(query_df(SQL["dias_cerrados"], (), cache_sync.version("dias_cerrados"))["fecha"])
+
+    def ocupacion(self, desde: date, hasta: date) -> list[tuple[date, time, Optional[int]]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["ocupacion_rango"], (desde, hasta))
+            return cur.fetchall()
+
+    def cerrar_dia(self, fecha: date, motivo: Optional[str], movimientos: list[tuple[int, date, time]]) -> list[int]:
+        ids, fechas, horas = (list(x) for x in zip(*movimientos)) if movimientos else ([], [], [])
+        try:
+            with UnidadDeTrabajo(claves=("dias_cerrados", "citas", _k_fecha(fecha))) as uow:
+                uow.agregar(SQL["cerrar_dia"], (fecha, motivo))
+                i = uow.agregar(SQL["reprogramar_citas"], (ids, fechas, horas, fecha), devuelve=True)
+        except pg_errors.UniqueViolation as e:
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado(fecha)
+        filas = uow.resultados[i]
+        _invalidar(*{_k_fecha(f) for _, f, _ in filas}, *{_k_paciente(p) for _, _, p in filas if p})
+        return [int(cid) for cid, _, _ in filas]
+
+    def reabrir_dia(self, fecha: date) -> None:
+        exec_sql(SQL["reabrir_dia"], (fecha,), ("dias_cerrados",))
+
+    def agregar_espera(self, paciente_id: int, desde: date, hasta: date, hora_min: Optional[time],
+                       hora_max: Optional[time], servicio: str) -> int:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["agregar_espera"], (paciente_id, desde, hasta, hora_min, hora_max, servicio))
+            eid = cur.fetchone()[0]
+        _invalidar(_k_paciente(paciente_id))
+        return int(eid)
+
+    def esperas_paciente(self, paciente_id: int):
+        return query_df(SQL["esperas_paciente"], (paciente_id,), cache_sync.version(_k_paciente(paciente_id)))
+
+    def cancelar_espera(self, espera_id: int, paciente_id: int) -> None:
+        exec_sql(SQL["cancelar_espera"], (espera_id, paciente_id), (_k_paciente(paciente_id),))
+
+    def crear_oferta(self, fecha: date, hora: time, minutos: int) -> Optional[dict]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["crear_oferta"], {"fecha": fecha, "hora": hora, "minutos": minutos})
+            fila = cur.fetchone()
+        if fila is None:
+            return None
+        _invalidar(_k_paciente(fila[1]))
+        return dict(zip(("id", "paciente_id", "nombre", "telefono_e164"), fila))
+
+    def marcar_oferta(self, oferta_id: int, estado: str) -> Optional[tuple[date, time, int]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["marcar_oferta"], (estado, oferta_id))
+            fila = cur.fetchone()
+        if fila:
+            _invalidar(_k_paciente(fila[2]))
+        return fila
+
+    def vencer_ofertas(self, limite: int) -> list[tuple[date, time, int]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["vencer_ofertas"], (limite,))
+            filas = cur.fetchall()
+        if filas:
+            _invalidar(*{_k_paciente(p) for _, _, p in filas})
+        return filas
+
+    def ofertas_paciente(self, paciente_id: int):
+        return query_df(SQL["ofertas_paciente"], (paciente_id,), cache_sync.version(_k_paciente(paciente_id)))
+
+    def aceptar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        try:
+            with conn() as c, c.cursor() as cur:
+                cur.execute(SQL["aceptar_oferta"], {"oferta": oferta_id, "paciente": paciente_id})
+                fila = cur.fetchone()
+        except pg_errors.UniqueViolation as e:
+            if not _horario_tomado(e):
+                raise
+            raise SlotOcupado(oferta_id)
+        if fila:
+            _invalidar(_k_fecha(fila[0]), "citas", _k_paciente(paciente_id))
+        return fila
+
+    def rechazar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        with conn() as c, c.cursor() as cur:
+            cur.execute(SQL["rechazar_oferta"], (oferta_id, paciente_id))
+            fila = cur.fetchone()
+        if fila:
+            _invalidar(_k_paciente(paciente_id))
+        return fila
+
+_repo: Repositorio = MemoriaRepo() if BACKEND == "memoria" else PostgresRepo()
+
+def repo() -> Repositorio:
+    return _repo
+
+def usar_repo(r: Repositorio) -> Repositorio:
+    """Cambia el backend activo (pruebas/benchmarks). Devuelve el anterior."""
+    global _repo
+    prev, _repo = _repo, r
+    return prev
 
 # Ejecuta al importar
-ensure_schema()
+if isinstance(_repo, PostgresRepo):
+    ensure_schema()
+    cache_sync.iniciar(NEON_URL)
+    particiones.iniciar(NEON_URL, salones.esquemas)
+    calendario.iniciar(NEON_URL, SESSION_SECRET, PASO_MIN, salones.todos())
 
 # ---------- Lógica agenda ----------
 def _fmt_fecha(v) -> str:
@@ -138,76 +574,94 @@ def _fmt_hora(v) -> str:
     except Exception: return str(v)
 
 def proxima_cita_paciente(paciente_id: int):
-    return query_df(
-        """
-        SELECT c.id AS id_cita, c.fecha, c.hora, c.servicio, c.nota
-        FROM citas c
-        WHERE c.paciente_id = %s
-          AND (c.fecha > CURRENT_DATE OR (c.fecha = CURRENT_DATE AND c.hora >= CURRENT_TIME))
-        ORDER BY c.fecha, c.hora
-        LIMIT 1
-        """,
-        (paciente_id,),
-    )
+    return repo().proxima_cita(paciente_id)
 
-def registrar_paciente(nombre: str, telefono: str, password: str) -> int:
+# Feeds .ics (modules/calendario.py): URL para suscribirse, None si no hay feeds
+def _url_app(ruta: Optional[str]) -> Optional[str]:
+    if not ruta:
+        return None
+    u = urlsplit(st.context.url or "")
+    return f"{u.scheme}://{u.netloc}/{ruta}" if u.netloc else ruta
+
+def feed_paciente(paciente_id: int) -> Optional[str]:
+    if not calendario.activo():
+        return None
+    if calendario.existe_paciente(paciente_id):
+        return _url_app(calendario.url_paciente(paciente_id))
+    with conn() as c:
+        return _url_app(calendario.asegurar_paciente(c, int(paciente_id)))
+
+def feed_agenda() -> Optional[str]:
+    return _url_app(calendario.url_agenda())
+
+def _tel_valido(telefono: str) -> str:
+    """normalize_tel + exige que tenga forma E.164 (se calcula al guardar)."""
     tel = normalize_tel(telefono)
+    if a_e164(tel) is None:
+        raise ValueError("Teléfono no válido: usa 10 dígitos o el formato internacional (+52…).")
+    return tel
+
+def registrar_paciente(nombre: str, telefono: str, password: str) -> int:
+    tel = _tel_valido(telefono)
     pw_hash = hash_password(password)
     try:
-        with conn().cursor() as cur:
-            cur.execute(
-                "INSERT INTO pacientes (nombre, telefono, password_hash) VALUES (%s, %s, %s) RETURNING id",
-                (nombre.strip(), tel, pw_hash),
-            )
-            pid = cur.fetchone()[0]
-    except pg_errors.UniqueViolation:
+        return repo().registrar_paciente(nombre.strip(), tel, pw_hash)
+    except TelefonoDuplicado:
         raise ValueError("Ese teléfono ya está registrado. Inicia sesión.")
-    try: st.cache_data.clear()
-    except Exception: pass
-    return int(pid)
 
-def login_paciente(telefono: str, password: str) -> Optional[dict]:
+# Proxies propios delante de la app (Railway: 1). Cada uno agrega al final de
+# X-Forwarded-For la IP de quien le habló; lo que está más a la izquierda lo
+# escribió el cliente y no sirve para limitar nada.
+PROXIES_CONFIABLES: int = int(os.getenv("TRUSTED_PROXY_HOPS") or 0)
+
+def ip_cliente() -> Optional[str]:
+    """IP del cliente para el límite de intentos: la que anotó el proxy más externo."""
+    if PROXIES_CONFIABLES > 0:
+        saltos = [x.strip() for x in (st.context.headers.get("X-Forwarded-For") or "").split(",") if x.strip()]
+        if len(saltos) >= PROXIES_CONFIABLES:
+            return saltos[-PROXIES_CONFIABLES]
+    return st.context.ip_address
+
+def login_paciente(telefono: str, password: str, ip: Optional[str] = None) -> Optional[dict]:
     tel = normalize_tel(telefono)
-    df = query_df(
-        "SELECT id, nombre, telefono, password_hash FROM pacientes WHERE telefono = %s LIMIT 1",
-        (tel,),
-    )
-    if df.empty:
+    e164 = a_e164(tel)
+    # "55 1234 5678" y "+525512345678" comparten límite; cada salón lleva el suyo
+    clave = f"{salones.actual().slug}/{e164 or tel}"
+    limites.permitir_login(clave, ip)   # LoginBloqueado antes de BD/bcrypt
+    row = repo().paciente_por_telefono(tel)
+    if row is None:
         return None
-    row = df.iloc[0]
     if row.get("password_hash") and check_password(password, str(row["password_hash"])):
+        limites.login_exitoso(clave)
         return {"id": int(row["id"]), "nombre": row["nombre"], "telefono": row["telefono"]}
     return None
 
 def ya_tiene_cita_en_dia(paciente_id: int, fecha: date) -> bool:
-    df = query_df_fresh("SELECT 1 FROM citas WHERE paciente_id=%s AND fecha=%s LIMIT 1", (paciente_id, fecha))
-    return not df.empty
+    return repo().cita_en_dia(paciente_id, fecha)
 
 def ya_tiene_cita_en_ventana_7dias(paciente_id: int, fecha_ref: date) -> bool:
-    df = query_df_fresh(
-        """
-        SELECT 1 FROM citas
-        WHERE paciente_id=%s
-          AND fecha BETWEEN (%s::date - INTERVAL '6 days') AND (%s::date + INTERVAL '6 days')
-        LIMIT 1
-        """,
-        (paciente_id, fecha_ref, fecha_ref),
-    )
-    return not df.empty
+    return repo().cita_en_ventana_7dias(paciente_id, fecha_ref)
 
 def is_fecha_permitida(fecha: date) -> bool:
     return fecha >= (date.today() + timedelta(days=BLOQUEO_DIAS_MIN))
 
+# Horario por día de la semana (lunes = 0) si el salón no tiene uno propio
+HORARIO: dict[int, list[tuple[time, time]]] = {
+    **{wd: [(time(10,0), time(12,0)), (time(14,0), time(16,30)), (time(18,30), time(19,0))] for wd in range(5)},
+    5: [(time(8,0), time(14,0))],
+}
+
+SERVICIOS: list[str] = ["Corte", "Coloración", "Manicure", "Pedicure", "Peinado", "Tratamiento capilar", "Maquillaje", "Depilación"]
+
+def servicios() -> list[str]:
+    return salones.actual().servicios or SERVICIOS
+
 def _bloques_del_dia(fecha: date) -> list[tuple[time, time]]:
-    wd = fecha.weekday()
-    if 0 <= wd <= 4:
-        return [(time(10,0), time(12,0)), (time(14,0), time(16,30)), (time(18,30), time(19,0))]
-    elif wd == 5:
-        return [(time(8,0), time(14,0))]
-    else:
-        return []
+    return (salones.actual().horario or HORARIO).get(fecha.weekday(), [])
 
 def generar_slots(fecha: date) -> list[time]:
+    if fecha in repo().dias_cerrados():
+        return []
     slots, delta = [], timedelta(minutes=PASO_MIN)
     for ini, fin in _bloques_del_dia(fecha):
         t = datetime.combine(fecha, ini); tfin = datetime.combine(fecha, fin)
@@ -216,8 +670,7 @@ def generar_slots(fecha: date) -> list[time]:
     return slots
 
 def slots_ocupados(fecha: date) -> set:
-    df = query_df("SELECT hora FROM citas WHERE fecha=%s ORDER BY hora", (fecha,))
-    return set(df["hora"].tolist())
+    return repo().horas_ocupadas(fecha)
 
 def agendar_cita_autenticado(fecha: date, hora: time, paciente_id: int, servicio: str, nota: Optional[str] = None):
     assert is_fecha_permitida(fecha), "La fecha seleccionada no está permitida (mínimo día 3)."
@@ -226,79 +679,230 @@ def agendar_cita_autenticado(fecha: date, hora: time, paciente_id: int, servicio
     if ya_tiene_cita_en_ventana_7dias(paciente_id, fecha):
         raise ValueError("Solo se permite una cita cada 7 días (respecto a la fecha elegida).")
     try:
-        exec_sql("INSERT INTO citas(fecha, hora, paciente_id, servicio, nota) VALUES (%s,%s,%s,%s,%s)",
-                 (fecha, hora, paciente_id, servicio.strip(), nota))
-    except pg_errors.UniqueViolation:
+        repo().insertar_cita(fecha, hora, paciente_id, servicio.strip(), nota)
+    except SlotOcupado:
         raise ValueError("Ese horario ya fue tomado. Elige otro.")
 
 def crear_o_encontrar_paciente(nombre: str, telefono: str) -> int:
-    tel = normalize_tel(telefono)
-    df = query_df("SELECT id FROM pacientes WHERE telefono=%s LIMIT 1", (tel,))
-    if not df.empty:
-        return int(df.iloc[0]["id"])
-    with conn().cursor() as cur:
-        cur.execute("INSERT INTO pacientes(nombre, telefono) VALUES (%s,%s) RETURNING id", (nombre.strip(), tel))
-        new_id = cur.fetchone()[0]
-    try: st.cache_data.clear()
-    except Exception: pass
-    return int(new_id)
+    return repo().crear_o_encontrar_paciente(nombre.strip(), _tel_valido(telefono))
 
 def crear_cita_manual(fecha: date, hora: time, nombre: str, telefono: str, servicio: str, nota: Optional[str] = None):
-    pid = crear_o_encontrar_paciente(nombre, telefono)
-    exec_sql("INSERT INTO citas(fecha, hora, paciente_id, servicio, nota) VALUES (%s,%s,%s,%s,%s)",
-             (fecha, hora, pid, servicio.strip(), nota))
+    try:
+        repo().crear_cita_con_paciente(fecha, hora, nombre.strip(), _tel_valido(telefono), servicio.strip(), nota)
+    except SlotOcupado:
+        raise ValueError("Ese horario ya fue tomado. Elige otro.")
 
 def citas_por_dia(fecha: date):
-    return query_df(
-        """
-        SELECT c.id AS id_cita, c.fecha, c.hora, p.id AS paciente_id, p.nombre, p.telefono, c.servicio, c.nota
-        FROM citas c LEFT JOIN pacientes p ON p.id=c.paciente_id
-        WHERE c.fecha=%s ORDER BY c.hora
-        """,
-        (fecha,),
-    )
+    return repo().citas_por_dia(fecha)
 
 def actualizar_cita(cita_id: int, nombre: str, telefono: str, servicio: str, nota: Optional[str]):
-    pid = crear_o_encontrar_paciente(nombre, telefono)
-    exec_sql("UPDATE citas SET paciente_id=%s, servicio=%s, nota=%s WHERE id=%s", (pid, servicio.strip(), nota, cita_id))
+    repo().actualizar_cita_con_paciente(cita_id, nombre.strip(), _tel_valido(telefono), servicio.strip(), nota)
 
 def eliminar_cita(cita_id: int) -> int:
-    with conn().cursor() as cur:
-        cur.execute("DELETE FROM citas WHERE id=%s", (cita_id,))
-        n = cur.rowcount or 0
-    try: st.cache_data.clear()
-    except Exception: pass
-    return n
+    hueco = repo().eliminar_cita(cita_id)
+    if hueco is None:
+        return 0
+    encolar_hueco(*hueco)
+    return 1
+
+# Autoservicio del cliente sobre sus citas pendientes
+def cancelar_cita_paciente(cita_id: int, paciente_id: int) -> bool:
+    hueco = repo().cancelar_cita_paciente(int(cita_id), int(paciente_id))
+    if hueco is None:
+        return False
+    encolar_hueco(*hueco)
+    return True
+
+_NO_REPROGRAMADA = {
+    "dia_cerrado": "Ese día el salón no abre. Elige otro.",
+    "regla_7_dias": "Solo se permite una cita cada 7 días (respecto a la fecha elegida).",
+    "horario_ocupado": "Ese horario ya fue tomado. Elige otro.",
+}
+
+def reprogramar_cita(cita_id: int, paciente_id: int, fecha: date, hora: time):
+    """Mueve la cita a (fecha, hora) en una sola transacción: o queda en el horario
+    nuevo o sigue en el viejo. El horario liberado se ofrece a la lista de espera."""
+    if not is_fecha_permitida(fecha):
+        raise ValueError("La fecha seleccionada no está permitida (mínimo día 3).")
+    if hora not in generar_slots(fecha):
+        raise ValueError("Ese horario no está disponible.")
+    try:
+        res = repo().reprogramar_cita_paciente(int(cita_id), int(paciente_id), fecha, hora)
+    except SlotOcupado:
+        raise ValueError(_NO_REPROGRAMADA["horario_ocupado"])
+    if res is None:
+        raise ValueError("Esa cita ya no se puede cambiar (pasó o se canceló).")
+    estado, fecha_vieja, hora_vieja = res
+    if estado != "ok":
+        raise ValueError(_NO_REPROGRAMADA[estado])
+    encolar_hueco(fecha_vieja, hora_vieja)
+
+# ---------- Series recurrentes ----------
+SERIE_MAX: int = 52   # citas por serie como máximo
+
+def fechas_serie(inicio: date, cada_semanas: int, hasta: Optional[date] = None,
+                 veces: Optional[int] = None) -> list[date]:
+    """Fechas de una serie: cada N semanas desde inicio, hasta una fecha o K veces."""
+    if cada_semanas < 1:
+        raise ValueError("La frecuencia debe ser de al menos una semana.")
+    if hasta is None and not veces:
+        raise ValueError("Indica una fecha final o un número de citas.")
+    paso = timedelta(weeks=cada_semanas)
+    if veces:
+        if veces > SERIE_MAX:
+            raise ValueError(f"Como máximo {SERIE_MAX} citas por serie.")
+        n = veces
+    else:
+        n = (hasta - inicio) // paso + 1 if hasta >= inicio else 0
+    if n > SERIE_MAX:
+        # nada de recortar en silencio: la dueña elige otra fecha final
+        ultima = inicio + (SERIE_MAX - 1) * paso
+        raise ValueError(f"Serían {n} citas y el máximo por serie es {SERIE_MAX}: "
+                         f"elige como última fecha el {ultima:%d-%m-%Y} o antes.")
+    fechas = [inicio + i * paso for i in range(n)]
+    return [f for f in fechas if hasta is None or f <= hasta]
+
+def crear_serie(inicio: date, hora: time, nombre: str, telefono: str, servicio: str,
+                cada_semanas: int = 1, hasta: Optional[date] = None, veces: Optional[int] = None,
+                nota: Optional[str] = None) -> pd.DataFrame:
+    """Crea una serie recurrente y devuelve el reporte por fecha (fecha, estado).
+
+    estado: ok | horario_ocupado | regla_7_dias | fuera_de_horario. Las fechas
+    con conflicto se omiten; el resto se inserta en una sola sentencia.
+    """
+    fechas = fechas_serie(inicio, cada_semanas, hasta, veces)
+    validas = [f for f in fechas if hora in generar_slots(f)]
+    reporte = {f: "fuera_de_horario" for f in fechas if f not in validas}
+    if validas:
+        reporte.update(repo().crear_serie(validas, hora, cada_semanas, nombre.strip(),
+                                          _tel_valido(telefono), servicio.strip(), nota))
+    return pd.DataFrame(sorted(reporte.items()), columns=["fecha", "estado"])
+
+def cancelar_serie_desde(serie_id: int, desde: date) -> int:
+    """Elimina las citas de la serie desde esa fecha (inclusive)."""
+    return repo().cancelar_serie_desde(serie_id, desde)
+
+def editar_serie_desde(serie_id: int, desde: date, hora: time, servicio: str,
+                       nota: Optional[str] = None) -> pd.DataFrame:
+    """Cambia hora/servicio/nota de las citas de la serie desde esa fecha.
 
+    Devuelve (fecha, movida); las que no caben en la nueva hora se quedan igual.
+    """
+    if hora not in generar_slots(desde):
+        raise ValueError("Esa hora no está dentro del horario de ese día.")
+    try:
+        filas = repo().editar_serie_desde(serie_id, desde, hora, servicio.strip(), nota)
+    except SlotOcupado:
+        raise ValueError("Uno de los horarios se ocupó mientras se editaba. Inténtalo de nuevo.")
+    return pd.DataFrame(filas, columns=["fecha", "movida"])
+
+# ---------- Cierre de días ----------
+CIERRE_DIAS_MAX: int = 14   # días hacia adelante donde buscar lugar
+
+def dia_cerrado(fecha: date) -> bool:
+    return fecha in repo().dias_cerrados()
+
+def _minutos(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+def planear_cierre(fecha: date, dias_max: int = CIERRE_DIAS_MAX) -> pd.DataFrame:
+    """Propone nuevo (fecha, hora) para cada cita del día, sin escribir nada.
+
+    Una pasada sobre la disponibilidad de los días siguientes, en orden: en cada
+    día, cada cita pendiente toma el horario libre más cercano a su hora
+    original, sin dejar al paciente con otra cita a menos de 7 días (la misma
+    regla que al agendar). Las que no caben en dias_max días quedan con
+    fecha_nueva vacía y estado "sin_hueco".
+    """
+    df = citas_por_dia(fecha).sort_values("hora")
+    plan = df[["id_cita", "hora", "paciente_id", "nombre", "telefono", "telefono_e164", "servicio"]].copy()
+    plan["fecha_nueva"], plan["hora_nueva"], plan["estado"] = None, None, "sin_hueco"
+    if plan.empty:
+        return plan
+    # 6 días de margen a cada lado: citas que chocarían con la regla de 7 días
+    ocup = repo().ocupacion(fecha - timedelta(days=6), fecha + timedelta(days=dias_max + 6))
+    tomados = {(f, h) for f, h, _ in ocup}
+    otras: dict[int, list[date]] = {}
+    for f, _, p in ocup:
+        if p is not None and f != fecha:   # las del día que se cierra son las que se mueven
+            otras.setdefault(p, []).append(f)
+
+    def choca(pid: Optional[int], d: date) -> bool:
+        return pid is not None and any(abs((d - f).days) < 7 for f in otras.get(pid, ()))
+
+    pendientes = list(plan.index)
+    for i in range(1, dias_max + 1):
+        if not pendientes:
+            break
+        d = fecha + timedelta(days=i)
+        libres = [h for h in generar_slots(d) if (d, h) not in tomados]
+        resto = []
+        for ix in pendientes:
+            pid = plan.at[ix, "paciente_id"]
+            pid = None if pd.isna(pid) else int(pid)
+            if not libres or choca(pid, d):
+                resto.append(ix)
+                continue
+            objetivo = _minutos(plan.at[ix, "hora"])
+            h = min(libres, key=lambda t: abs(_minutos(t) - objetivo))
+            libres.remove(h)
+            plan.at[ix, "fecha_nueva"], plan.at[ix, "hora_nueva"], plan.at[ix, "estado"] = d, h, "propuesta"
+            if pid is not None:
+                otras.setdefault(pid, []).append(d)
+        pendientes = resto
+    return plan.reset_index(drop=True)
 
+def cerrar_dia(fecha: date, motivo: Optional[str] = None, dias_max: int = CIERRE_DIAS_MAX) -> pd.DataFrame:
+    """Cierra el día y mueve sus citas en UNA transacción. Devuelve el plan con
+    estado "movida" o "sin_hueco" (estas siguen en el día cerrado)."""
+    plan = planear_cierre(fecha, dias_max)
+    mov = plan.dropna(subset=["fecha_nueva"])
+    try:
+        movidas = set(repo().cerrar_dia(fecha, motivo, [
+            (int(c), f, h) for c, f, h in zip(mov["id_cita"], mov["fecha_nueva"], mov["hora_nueva"])]))
+    except SlotOcupado:
+        raise ValueError("La agenda cambió mientras se cerraba el día. Inténtalo de nuevo.")
+    plan["estado"] = ["movida" if int(c) in movidas else "sin_hueco" for c in plan["id_cita"]]
+    return plan
+
+def reabrir_dia(fecha: date):
+    repo().reabrir_dia(fecha)
+
+def notificar_reprogramadas(plan: pd.DataFrame, dry_run: bool = False) -> dict:
+    """Avisa por WhatsApp (plantilla TEMPLATE_CAMBIO) la nueva fecha/hora de las citas movidas."""
+    mov = (plan[plan["estado"] == "movida"].drop(columns=["hora"])
+           .rename(columns={"fecha_nueva": "fecha", "hora_nueva": "hora"}))
+    plantilla = None if dry_run else st.secrets["whatsapp"]["TEMPLATE_CAMBIO"]
+    return _enviar_lote(mov, plantilla, dry_run)
 
 def ultima_cita_agendada():
     """Devuelve la última cita creada (la más reciente por creado_en)."""
-    return query_df_fresh(
-        """
-        SELECT c.id AS id_cita, c.creado_en, c.fecha, c.hora, c.servicio, c.nota,
-               p.nombre, p.telefono
-        FROM citas c
-        LEFT JOIN pacientes p ON p.id = c.paciente_id
-        ORDER BY c.creado_en DESC, c.id DESC
-        LIMIT 1
-        """
-    )
+    return repo().ultima_cita()
+
+# Revisión en lote de las reglas (modules/consistencia.py); solo con Postgres
+def revision_disponible() -> bool:
+    return isinstance(_repo, PostgresRepo)
+
+def revisar_reglas() -> Optional[dict]:
+    """Corre una revisión ahora. None si ya hay otra en curso para este salón."""
+    with conn() as c:
+        return consistencia.revisar(c)
+
+def ultima_revision() -> Optional[dict]:
+    with conn() as c:
+        return consistencia.ultima(c)
+
+def hallazgos_revision(revision_id: int, reglas=consistencia.REGLAS, limite: int = 500) -> pd.DataFrame:
+    with conn() as c:
+        filas = consistencia.hallazgos(c, revision_id, reglas, limite)
+    return pd.DataFrame(filas, columns=["regla", "fecha", "hora", "cita_id", "paciente_id", "nombre",
+                                        "telefono", "relacionado_id"])
 
 # ========== WHATSAPP / RECORDATORIOS ==========
 
 def citas_manana():
     """Citas de mañana (fecha = hoy + 1) con datos de paciente."""
-    return query_df(
-        """
-        SELECT c.id AS id_cita, c.fecha, c.hora, c.servicio, c.nota,
-               p.id AS paciente_id, p.nombre, p.telefono
-        FROM citas c
-        JOIN pacientes p ON p.id = c.paciente_id
-        WHERE c.fecha = CURRENT_DATE + INTERVAL '1 day'
-        ORDER BY c.hora
-        """
-    )
+    return repo().citas_manana()
 
 def _fmt_fecha_es(v) -> str:
     try: return pd.to_datetime(v).strftime("%d/%m/%Y")
@@ -308,21 +912,8 @@ def _fmt_hora_es(v) -> str:
     try: return pd.to_datetime(str(v)).strftime("%H:%M")
     except Exception: return str(v)
 
-def _to_e164_mx(tel: str) -> str | None:
-    """Normaliza teléfonos a E.164 (+52XXXXXXXXXX si recibe 10 dígitos de MX)."""
-    if not tel: return None
-    t = re.sub(r"\D+", "", str(tel))
-    if not t: return None
-    if str(tel).startswith("+"):
-        return str(tel)
-    if t.startswith("52"):
-        return f"+{t}"
-    if len(t) == 10:
-        return f"+52{t}"
-    return None
-
-def _wa_send_meta(to_e164: str, nombre: str, fecha_txt: str, hora_txt: str):
-    """Envía mensaje por plantilla (WhatsApp Cloud API / Meta)."""
+def _wa_send_meta(to_e164: str, nombre: str, fecha_txt: str, hora_txt: str, plantilla: Optional[str] = None):
+    """Envía mensaje por plantilla (WhatsApp Cloud API / Meta). Por defecto, la de recordatorio."""
     cfg = st.secrets["whatsapp"]
     url = f"https://graph.facebook.com/v19.0/{cfg['PHONE_NUMBER_ID']}/messages"
     headers = {
@@ -334,7 +925,7 @@ def _wa_send_meta(to_e164: str, nombre: str, fecha_txt: str, hora_txt: str):
         "to": to_e164,
         "type": "template",
         "template": {
-            "name": cfg["TEMPLATE"],
+            "name": plantilla or cfg["TEMPLATE"],
             "language": {"code": cfg.get("LANG", "es_MX")},
             "components": [
                 {"type": "body", "parameters": [
@@ -354,7 +945,10 @@ def enviar_recordatorios_manana(dry_run: bool = False) -> dict:
     Envía (o simula) recordatorios de WhatsApp para TODAS las citas de mañana.
     Devuelve resumen {"total", "enviados", "fallidos", "detalles":[...]}.
     """
-    df = citas_manana()
+    return _enviar_lote(citas_manana(), dry_run=dry_run)
+
+def _enviar_lote(df, plantilla: Optional[str] = None, dry_run: bool = False) -> dict:
+    """Un mensaje de plantilla por fila (id_cita, nombre, telefono, telefono_e164, fecha, hora)."""
     res = {"total": int(len(df)), "enviados": 0, "fallidos": 0, "detalles": []}
     if df.empty:
         return res
@@ -362,7 +956,7 @@ def enviar_recordatorios_manana(dry_run: bool = False) -> dict:
     for _, r in df.iterrows():
         nombre = (r.get("nombre") or "").strip()
         tel_raw = (r.get("telefono") or "").strip()
-        to = _to_e164_mx(tel_raw)
+        to = r.get("telefono_e164") if pd.notna(r.get("telefono_e164")) else None
         fecha_txt = _fmt_fecha_es(r["fecha"])
         hora_txt  = _fmt_hora_es(r["hora"])
 
@@ -385,7 +979,7 @@ def enviar_recordatorios_manana(dry_run: bool = False) -> dict:
 
         try:
             if not dry_run:
-                _wa_send_meta(to, nombre, fecha_txt, hora_txt)
+                _wa_send_meta(to, nombre, fecha_txt, hora_txt, plantilla=plantilla)
             item["ok"] = True
             res["enviados"] += 1
         except Exception as e:
@@ -395,3 +989,100 @@ def enviar_recordatorios_manana(dry_run: bool = False) -> dict:
         res["detalles"].append(item)
 
     return res
+
+
+# ========== LISTA DE ESPERA ==========
+# Al liberarse un horario se ofrece a UNA persona de la lista de espera por
+# WhatsApp; si no responde en OFERTA_MIN minutos (o lo rechaza) pasa a la
+# siguiente. Los envíos van por un único hilo para no bloquear la página.
+# Qué ofertas vencieron lo dice la BD (expira_en): el timer del proceso que
+# ofreció solo adelanta el barrido, y cada recarga de página de un salón lo
+# corre como mucho cada BARRIDO_OFERTAS_S, así que un reinicio o un despliegue
+# no deja huecos ofrecidos a nadie.
+OFERTA_MIN: int = 30
+BARRIDO_OFERTAS_S: int = 60
+
+_cola_ofertas = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ofertas")
+_lock_barrido = threading.Lock()
+_barridos: dict[str, float] = {}   # esquema -> último barrido (monotonic)
+
+def unirse_lista_espera(paciente_id: int, desde: date, hasta: date, servicio: str,
+                        hora_min: Optional[time] = None, hora_max: Optional[time] = None) -> int:
+    if hasta < desde:
+        raise ValueError("La fecha final debe ser posterior a la inicial.")
+    if hora_min and hora_max and hora_max < hora_min:
+        raise ValueError("El rango de horas no es válido.")
+    return repo().agregar_espera(paciente_id, desde, hasta, hora_min, hora_max, servicio.strip())
+
+def esperas_paciente(paciente_id: int):
+    return repo().esperas_paciente(paciente_id)
+
+def salir_lista_espera(espera_id: int, paciente_id: int):
+    repo().cancelar_espera(espera_id, paciente_id)
+
+def ofertas_paciente(paciente_id: int):
+    """Ofertas vigentes; expira_en en la hora del salón (la BD la guarda con zona)."""
+    df = repo().ofertas_paciente(paciente_id)
+    if not df.empty:
+        df = df.assign(expira_en=pd.to_datetime(df["expira_en"], utc=True).dt.tz_convert(ZONA_SALON))
+    return df
+
+def _enviar_oferta(o: dict, fecha: date, hora: time):
+    to = o["telefono_e164"]
+    if not to:
+        raise ValueError("Teléfono inválido/no E.164")
+    _wa_send_meta(to, o["nombre"], _fmt_fecha_es(fecha), _fmt_hora_es(hora),
+                  plantilla=st.secrets["whatsapp"]["TEMPLATE_OFERTA"])
+
+def _ofrecer_hueco(fecha: date, hora: time) -> Optional[dict]:
+    if hora not in generar_slots(fecha):   # p. ej. el día se cerró
+        return None
+    o = repo().crear_oferta(fecha, hora, OFERTA_MIN)
+    if o is None:
+        return None
+    try:
+        _enviar_oferta(o, fecha, hora)
+        repo().marcar_oferta(o["id"], "enviada")
+    except Exception as e:
+        # La oferta sigue visible en el panel del paciente hasta que expire
+        log.warning("lista de espera: no se pudo enviar la oferta %s (%s)", o["id"], e)
+    t = threading.Timer(OFERTA_MIN * 60 + 1, _cola_ofertas.submit, args=(salones.ligar(vencer_ofertas),))
+    t.daemon = True
+    t.start()
+    return o
+
+def vencer_ofertas(limite: int = 50) -> int:
+    """Vence las ofertas sin respuesta y ofrece cada hueco a la siguiente persona."""
+    vencidas = repo().vencer_ofertas(limite)
+    for fecha, hora, _ in vencidas:
+        _ofrecer_hueco(fecha, hora)
+    return len(vencidas)
+
+def _barrer_ofertas():
+    """En segundo plano y como mucho cada BARRIDO_OFERTAS_S por salón en este proceso."""
+    esquema, ahora = salones.actual().esquema, _time.monotonic()
+    with _lock_barrido:
+        if ahora - _barridos.get(esquema, -BARRIDO_OFERTAS_S) < BARRIDO_OFERTAS_S:
+            return
+        _barridos[esquema] = ahora
+    _cola_ofertas.submit(salones.ligar(vencer_ofertas))
+
+def encolar_hueco(fecha: date, hora: time):
+    """Busca (en segundo plano) a quién ofrecerle un horario recién liberado."""
+    if fecha > date.today():
+        return _cola_ofertas.submit(salones.ligar(_ofrecer_hueco), fecha, hora)
+
+def aceptar_oferta(oferta_id: int, paciente_id: int):
+    try:
+        hueco = repo().aceptar_oferta(oferta_id, paciente_id)
+    except SlotOcupado:
+        repo().marcar_oferta(oferta_id, "expirada")
+        raise ValueError("Lo sentimos, ese horario ya fue tomado.")
+    if hueco is None:
+        raise ValueError("La oferta ya no está disponible (venció o ya tienes otra cita esa semana).")
+    return hueco
+
+def rechazar_oferta(oferta_id: int, paciente_id: int):
+    rechazada = repo().rechazar_oferta(oferta_id, paciente_id)
+    if rechazada:
+        encolar_hueco(rechazada[0], rechazada[1])
@@ -0,0 +1,92 @@
+# modules/limites.py — Límite de intentos de login (token bucket en proceso)
+#
+# Se consulta ANTES de buscar al paciente y de correr bcrypt, para que un
+# ataque de fuerza bruta no sature la CPU del worker.
+import threading, time as _time
+from collections import OrderedDict
+from typing import Optional
+
+
+class LoginBloqueado(ValueError):
+    """Demasiados intentos de inicio de sesión para ese teléfono o IP."""
+
+
+class LimitadorTokens:
+    """Token bucket por clave con memoria acotada (expulsión LRU)."""
+
+    def __init__(self, capacidad: int, recarga_s: float, max_claves: int = 10_000):
+        self.capacidad = float(capacidad)
+        self.por_segundo = 1.0 / recarga_s
+        self.max_claves = max_claves
+        self._cubetas: OrderedDict[str, list[float]] = OrderedDict()   # clave -> [tokens, ultimo]
+        self._lock = threading.Lock()
+        self.expulsadas = 0
+
+    def _cubeta(self, clave: str, ahora: float) -> list[float]:
+        b = self._cubetas.get(clave)
+        if b is None:
+            b = self._cubetas[clave] = [self.capacidad, ahora]
+            if len(self._cubetas) > self.max_claves:
+                self._cubetas.popitem(last=False)
+                self.expulsadas += 1
+        else:
+            self._cubetas.move_to_end(clave)
+            b[0] = min(self.capacidad, b[0] + (ahora - b[1]) * self.por_segundo)
+            b[1] = ahora
+        return b
+
+    def hay_token(self, clave: str) -> bool:
+        with self._lock:
+            return self._cubeta(clave, _time.monotonic())[0] >= 1.0
+
+    def consumir(self, clave: str) -> bool:
+        with self._lock:
+            b = self._cubeta(clave, _time.monotonic())
+            if b[0] < 1.0:
+                return False
+            b[0] -= 1.0
+            return True
+
+    def reiniciar(self, clave: str):
+        with self._lock:
+            self._cubetas.pop(clave, None)
+
+    def __len__(self) -> int:
+        return len(self._cubetas)
+
+
+# 5 intentos seguidos por teléfono (+1 cada minuto); 20 por IP (+1 cada 6 s)
+POR_TELEFONO = LimitadorTokens(capacidad=5, recarga_s=60)
+POR_IP = LimitadorTokens(capacidad=20, recarga_s=6)
+
+_contadores = {"permitidos": 0, "bloqueados_telefono": 0, "bloqueados_ip": 0}
+_lock_contadores = threading.Lock()
+
+def _contar(k: str):
+    with _lock_contadores:
+        _contadores[k] += 1
+
+def permitir_login(tel: str, ip: Optional[str] = None, cuenta: str = "este teléfono"):
+    """Consume un intento o lanza LoginBloqueado. No toca la BD. `tel` es la clave
+    de la cuenta (también "<salón>/admin/<usuario>"); `cuenta` la nombra en el mensaje."""
+    if ip and not POR_IP.hay_token(ip):
+        _contar("bloqueados_ip")
+        raise LoginBloqueado("Demasiados intentos desde esta conexión. Espera un momento e inténtalo de nuevo.")
+    if not POR_TELEFONO.consumir(tel):
+        _contar("bloqueados_telefono")
+        raise LoginBloqueado(f"Demasiados intentos para {cuenta}. Espera un minuto e inténtalo de nuevo.")
+    if ip:
+        POR_IP.consumir(ip)
+    _contar("permitidos")
+
+def login_exitoso(tel: str):
+    POR_TELEFONO.reiniciar(tel)
+
+def estadisticas() -> dict:
+    with _lock_contadores:
+        res = dict(_contadores)
+    res.update(
+        claves_telefono=len(POR_TELEFONO), claves_ip=len(POR_IP),
+        expulsadas_lru=POR_TELEFONO.expulsadas + POR_IP.expulsadas,
+    )
+    return res
@@ -0,0 +1,243 @@
+# modules/particiones.py — citas particionada por mes + archivo de meses viejos
+#
+# citas es una tabla particionada por rango de fecha: una partición por mes
+# (citas_AAAA_MM) y una DEFAULT (citas_default) para lo que caiga fuera de los
+# meses creados, p. ej. una serie que llega muy lejos. Las consultas que filtran
+# por fecha (agenda del día, recordatorios, ventana de 7 días) solo tocan los
+# meses que les corresponden.
+#
+#   python -m modules.particiones --url $NEON_DATABASE_URL [--meses 3]
+#   python -m modules.particiones --url ... --archivar-meses 24 --carpeta archivo/
+#
+# Al arrancar, la app convierte una tabla citas sin particionar (una sola vez)
+# y crea los meses que falten; un hilo repite esto último una vez al día.
+# Archivar: cada mes viejo se copia a <carpeta>/citas_AAAA_MM.csv.gz (con nombre
+# y teléfono del paciente) y luego se desengancha y se borra.
+import argparse, gzip, logging, os, re, sys, threading, time as _time
+from datetime import date
+from pathlib import Path
+from typing import Callable, Optional
+import psycopg
+from modules.consultas import CITAS_SQL, SCHEMA_SQL
+
+MESES_ADELANTE: int = 3   # lo que quede más lejos cae en la DEFAULT hasta que llegue su mes
+DEFAULT = "citas_default"
+COLUMNAS = "id, fecha, hora, paciente_id, servicio, nota, creado_en, serie_id"
+
+log = logging.getLogger(__name__)
+
+_RANGO = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def _mes(d: date) -> date:
+    return d.replace(day=1)
+
+def _sumar_meses(d: date, n: int) -> date:
+    m = d.year * 12 + d.month - 1 + n
+    return date(m // 12, m % 12 + 1, 1)
+
+def nombre_mes(mes: date) -> str:
+    return f"citas_{mes:%Y_%m}"
+
+
+def particionada(c: psycopg.Connection) -> bool:
+    fila = c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('citas')").fetchone()
+    return bool(fila and fila[0] == "p")
+
+def particiones(c: psycopg.Connection) -> list[tuple[str, Optional[date], Optional[date]]]:
+    """(nombre, desde, hasta) de cada partición; la DEFAULT va con (None, None)."""
+    filas = c.execute(
+        """
+        SELECT p.relname, pg_get_expr(p.relpartbound, p.oid)
+        FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('citas')
+        ORDER BY p.relname
+        """
+    ).fetchall()
+    res = []
+    for nombre, limites in filas:
+        r = _RANGO.search(limites)
+        res.append((nombre, *(date.fromisoformat(x) for x in r.groups())) if r else (nombre, None, None))
+    return res
+
+
+def crear_mes(c: psycopg.Connection, mes: date) -> bool:
+    """Crea la partición del mes si falta. Las filas de ese mes que hayan caído
+    en la DEFAULT se mudan a la nueva antes de engancharla."""
+    nombre, fin = nombre_mes(mes), _sumar_meses(mes, 1)
+    with c.transaction():
+        # varias réplicas pueden arrancar a la vez
+        c.execute("SELECT pg_advisory_xact_lock(hashtext('particiones_citas'))")
+        if c.execute("SELECT to_regclass(%s)", (nombre,)).fetchone()[0]:
+            return False
+        c.execute(f"CREATE TABLE {nombre} (LIKE citas INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        if c.execute("SELECT to_regclass(%s)", (DEFAULT,)).fetchone()[0]:
+            # mudanza interna: no es un borrado para el registro de cambios
+            c.execute("SET LOCAL cambios.omitir = 'on'")
+            c.execute(
+                f"""
+                WITH m AS (DELETE FROM {DEFAULT} WHERE fecha >= %s AND fecha < %s RETURNING {COLUMNAS})
+                INSERT INTO {nombre} ({COLUMNAS}) SELECT {COLUMNAS} FROM m
+                """,
+                (mes, fin),
+            )
+        c.execute(f"ALTER TABLE citas ATTACH PARTITION {nombre} FOR VALUES FROM ('{mes}') TO ('{fin}')")
+    return True
+
+def asegurar(c: psycopg.Connection, desde: Optional[date] = None, hasta: Optional[date] = None) -> list[str]:
+    """Crea la DEFAULT y los meses de `desde` (hoy) a `hasta` (hoy + MESES_ADELANTE)."""
+    hoy = date.today()
+    with c.transaction():
+        c.execute("SELECT pg_advisory_xact_lock(hashtext('particiones_citas'))")
+        c.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT} PARTITION OF citas DEFAULT")
+    mes, ultimo = _mes(desde or hoy), _mes(hasta or _sumar_meses(hoy, MESES_ADELANTE))
+    creadas = []
+    while mes <= ultimo:
+        if crear_mes(c, mes):
+            creadas.append(nombre_mes(mes))
+        mes = _sumar_meses(mes, 1)
+    return creadas
+
+
+def migrar(c: psycopg.Connection) -> Optional[dict]:
+    """Convierte una tabla citas sin particionar. No hace nada si ya lo está.
+
+    Todo en una transacción: renombra la tabla vieja (y sus índices y su
+    secuencia), crea la particionada con los meses que cubren sus datos, copia
+    las filas conservando los ids, recrea índices y trigger y borra la vieja.
+    """
+    if particionada(c):
+        return None
+    c.execute("SELECT pg_advisory_lock(hashtext('migrar_particiones'))")
+    try:
+        if particionada(c):
+            return None
+        with c.transaction():
+            c.execute("LOCK TABLE citas IN ACCESS EXCLUSIVE MODE")
+            n, minima = c.execute("SELECT count(*), min(fecha) FROM citas").fetchone()
+            secuencia = c.execute("SELECT pg_get_serial_sequence('citas', 'id')").fetchone()[0]
+            c.execute("ALTER TABLE citas RENAME TO citas_sin_particionar")
+            indices = c.execute(
+                """
+                SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = to_regclass('citas_sin_particionar')
+                """
+            ).fetchall()
+            for (idx,) in indices:   # los nombres de índice son únicos por esquema
+                c.execute(f"ALTER INDEX {idx} RENAME TO {idx}_viejo")
+            c.execute(f"ALTER SEQUENCE {secuencia} RENAME TO citas_id_seq_viejo")
+            c.execute(CITAS_SQL)
+            hoy = date.today()
+            creadas = asegurar(c, desde=min(minima or hoy, hoy))   # lo de más adelante va a la DEFAULT
+            c.execute(f"INSERT INTO citas ({COLUMNAS}) SELECT {COLUMNAS} FROM citas_sin_particionar")
+            c.execute(
+                "SELECT setval(pg_get_serial_sequence('citas', 'id'), last_value, is_called) FROM citas_id_seq_viejo"
+            )
+            # índices y trigger sobre la tabla nueva, ya con los datos cargados
+            c.execute(SCHEMA_SQL)
+            c.execute("DROP TABLE citas_sin_particionar")
+        c.execute("ANALYZE citas")
+        return {"citas": n, "particiones": len(creadas)}
+    finally:
+        c.execute("SELECT pg_advisory_unlock(hashtext('migrar_particiones'))")
+
+
+def _copiar(c: psycopg.Connection, nombre: str, destino: Path) -> int:
+    """COPY de la partición (con nombre y teléfono del paciente) a un .csv.gz."""
+    with open(destino, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz, c.cursor() as cur:
+            with cur.copy(
+                f"""
+                COPY (SELECT c.*, p.nombre, p.telefono_e164
+                      FROM {nombre} c LEFT JOIN pacientes p ON p.id = c.paciente_id
+                      ORDER BY c.fecha, c.hora)
+                TO STDOUT WITH (FORMAT csv, HEADER)
+                """
+            ) as cp:
+                for datos in cp:
+                    gz.write(datos)
+            filas = cur.rowcount
+        f.flush()
+        os.fsync(f.fileno())
+    return filas
+
+def archivar(c: psycopg.Connection, antes_de: date, carpeta: Path) -> list[dict]:
+    """Archiva y borra los meses que terminan antes de `antes_de`.
+
+    La copia se hace con el mes todavía enganchado (solo lectura, sin bloquear
+    citas); luego, en una transacción corta, se desengancha, se comprueba que
+    no cambió el número de filas y se borra. Si algo falla el mes se queda.
+    """
+    carpeta.mkdir(parents=True, exist_ok=True)
+    res = []
+    for nombre, desde, hasta in particiones(c):
+        if hasta is None or hasta > antes_de:
+            continue
+        destino = carpeta / f"{nombre}.csv.gz"
+        tmp = destino.with_name(destino.name + ".tmp")
+        filas = _copiar(c, nombre, tmp)
+        try:
+            with c.transaction():
+                c.execute(f"ALTER TABLE citas DETACH PARTITION {nombre}")
+                ahora = c.execute(f"SELECT count(*) FROM {nombre}").fetchone()[0]
+                if ahora != filas:
+                    raise RuntimeError(f"{nombre}: {ahora} filas, se copiaron {filas}; se reintentará")
+                c.execute(f"DROP TABLE {nombre}")
+                tmp.replace(destino)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        res.append({"particion": nombre, "filas": filas, "archivo": str(destino)})
+    return res
+
+
+def _mantener(url: str, esquemas: Callable[[], list[str]]):
+    while True:
+        for esquema in esquemas():
+            try:
+                with psycopg.connect(url, autocommit=True) as c:
+                    c.execute("SELECT set_config('search_path', %s, false)", (esquema,))
+                    creadas = asegurar(c)
+                if creadas:
+                    log.info("particiones: creadas %s.%s", esquema, ", ".join(creadas))
+            except Exception as e:
+                log.warning("particiones: no se pudieron crear los meses próximos en %s (%s)", esquema, e)
+        _time.sleep(86400)
+
+_hilo: threading.Thread | None = None
+_lock = threading.Lock()
+
+def iniciar(url: str, esquemas: Callable[[], list[str]] = lambda: ["public"]):
+    """Arranca (una vez por proceso) el hilo que crea los meses próximos cada día,
+    en cada esquema que devuelva `esquemas` (uno por salón)."""
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        _hilo = threading.Thread(target=_mantener, args=(url, esquemas), daemon=True, name="particiones")
+        _hilo.start()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Particiones mensuales de citas: migrar, crear meses y archivar")
+    ap.add_argument("--url", required=True)
+    ap.add_argument("--meses", type=int, default=MESES_ADELANTE, help="meses futuros a tener creados")
+    ap.add_argument("--archivar-meses", type=int, help="archivar los meses terminados hace más de N meses")
+    ap.add_argument("--carpeta", default="archivo")
+    args = ap.parse_args(argv)
+    with psycopg.connect(args.url, autocommit=True) as c:
+        res = migrar(c)
+        if res:
+            print(f"citas convertida a particionada: {res}")
+        hoy = date.today()
+        creadas = asegurar(c, hasta=_sumar_meses(hoy, args.meses))
+        print(f"particiones creadas: {', '.join(creadas) or 'ninguna'}")
+        if args.archivar_meses is not None:
+            limite = _sumar_meses(_mes(hoy), -args.archivar_meses)
+            for a in archivar(c, limite, Path(args.carpeta)):
+                print(f"{a['particion']}: {a['filas']} citas -> {a['archivo']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
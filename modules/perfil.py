@@ -0,0 +1,284 @@
+# modules/perfil.py — Perfil de cada ejecución de página (opcional)
+#
+# Para saber en qué se va el tiempo de una recarga lenta: consultas a la BD,
+# pandas, bcrypt, el CSS y las imágenes en base64, o Streamlit dibujando.
+# Home.py envuelve cada ejecución en `ejecucion()`: corre cProfile sobre el
+# script y el cursor del pool (CursorMedido) anota cada ida y vuelta a la BD
+# con el nombre de la consulta del catálogo (modules/consultas.py). Al final de
+# la página aparece un desglose y los últimos PERFILES_MAX perfiles de este
+# proceso quedan en memoria (anillo) para descargarlos como .prof (pstats,
+# snakeviz) o .speedscope.json (https://www.speedscope.app).
+#
+#   CITAS_PERFIL=1   perfila todas las sesiones (solo en local: lo ve cualquiera)
+#
+# Sin la variable, la dueña puede activarlo para su propia sesión desde su
+# panel. Los fragmentos que se recargan solos (st.fragment) no pasan por
+# Home.py y no se perfilan.
+import cProfile, itertools, json, marshal, os, pstats, threading, time as _time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+import pandas as pd
+import psycopg
+import streamlit as st
+from modules.consultas import SQL
+from modules import salones
+
+PERFIL_ENV: bool = os.getenv("CITAS_PERFIL", "").lower() in ("1", "true", "si", "sí")
+PERFILES_MAX: int = int(os.getenv("CITAS_PERFIL_MAX") or 20)
+CLAVE_SESION = "perfil_activo"   # st.toggle del panel de la dueña
+# speedscope: el árbol se reparte en proporción al tiempo de cada llamador
+# (pstats no guarda pilas completas); se corta en esta profundidad y se
+# descartan ramas de menos de MIN_RAMA_S.
+PROFUNDIDAD_MAX: int = 60
+MIN_RAMA_S: float = 0.0002
+
+_NOMBRES = {q: k for k, q in SQL.items()}
+# (categoría, trozos de la ruta/nombre de la función) — la primera que coincide
+_CATEGORIAS = (
+    ("BD (psycopg)", ("psycopg",)),
+    ("bcrypt", ("bcrypt",)),
+    ("pandas / numpy", ("pandas", "numpy", "pyarrow")),
+    ("base64", ("base64", "binascii")),
+    ("Streamlit", ("streamlit", "protobuf", "google/protobuf")),
+    ("app (modules/, pages/)", ("/modules/", "/pages/", "Home.py")),
+)
+
+_lock = threading.Lock()
+_anillo: deque = deque(maxlen=PERFILES_MAX)
+_ids = itertools.count(1)
+_actual: ContextVar[Optional["Perfil"]] = ContextVar("perfil", default=None)
+
+
+class Perfil:
+    """Una ejecución de página: cProfile del hilo del script + idas a la BD."""
+
+    def __init__(self):
+        self.id = next(_ids)
+        self.salon = ""
+        self.pagina = "?"
+        self.cuando = datetime.now()
+        self.consultas: list[tuple[str, float, float, int]] = []   # nombre, inicio_s, ms, filas
+        self.total_ms = 0.0
+        self.stats: dict = {}
+        self._t0 = _time.perf_counter()
+        self._prof: Optional[cProfile.Profile] = cProfile.Profile()
+        try:
+            self._prof.enable()
+        except ValueError:   # ya hay otro perfilador activo en este hilo: solo tiempos
+            self._prof = None
+
+    def consulta(self, query, t0: float, filas: int):
+        nombre = _NOMBRES.get(query) if isinstance(query, str) else None
+        if nombre is None:
+            nombre = " ".join(str(query).split())[:50]
+        self.consultas.append((nombre, t0 - self._t0, (_time.perf_counter() - t0) * 1000, filas))
+
+    def terminar(self):
+        self.total_ms = (_time.perf_counter() - self._t0) * 1000
+        if self._prof is not None:
+            self._prof.disable()
+            self.stats = pstats.Stats(self._prof).stats
+            self._prof = None
+
+    @property
+    def bd_ms(self) -> float:
+        return sum(ms for _, _, ms, _ in self.consultas)
+
+    # ---------- Desgloses ----------
+    def categorias(self) -> pd.DataFrame:
+        """Tiempo propio (sin lo que llaman) de cada función, sumado por categoría."""
+        suma, memo = defaultdict(float), {}
+        for f, (_, _, tt, _, _) in self.stats.items():
+            suma[self._categoria(f, memo, set())] += tt
+        df = pd.DataFrame({"categoría": list(suma), "ms": [round(v * 1000, 1) for v in suma.values()]})
+        return df.sort_values("ms", ascending=False, ignore_index=True)
+
+    def _categoria(self, f, memo: dict, vistos: set) -> str:
+        """La de su ruta; si es stdlib o builtin, la de quien más tiempo la llamó."""
+        if f not in memo:
+            txt = f"{f[0]} {f[2]}".replace("\\", "/")
+            cat = next((c for c, trozos in _CATEGORIAS if any(t in txt for t in trozos)), None)
+            llamadores = self.stats[f][4] if f in self.stats else {}
+            if cat is None and llamadores and f not in vistos:
+                vistos.add(f)
+                padre = max(llamadores, key=lambda g: llamadores[g][3])
+                cat = self._categoria(padre, memo, vistos)
+            memo[f] = cat or "otros (esperas, stdlib)"
+        return memo[f]
+
+    def llamadas_core(self) -> pd.DataFrame:
+        """Funciones de modules/ llamadas en esta ejecución, con su tiempo acumulado."""
+        filas = [{"función": f"{os.path.basename(archivo)}:{linea} {funcion}", "llamadas": nc,
+                  "ms": round(ct * 1000, 1), "ms propio": round(tt * 1000, 1)}
+                 for (archivo, linea, funcion), (_, nc, tt, ct, _) in self.stats.items()
+                 if "/modules/" in archivo.replace("\\", "/") and not funcion.startswith("<")]
+        df = pd.DataFrame(filas, columns=["función", "llamadas", "ms", "ms propio"])
+        return df.sort_values("ms", ascending=False, ignore_index=True)
+
+    def tabla_consultas(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.consultas, columns=["consulta", "inicio_s", "ms", "filas"])
+        df["inicio_s"] = df["inicio_s"].round(3)
+        df["ms"] = df["ms"].round(2)
+        return df
+
+    # ---------- Descargas ----------
+    def prof(self) -> bytes:
+        """Mismo formato que cProfile.Profile.dump_stats (pstats.Stats, snakeviz)."""
+        return marshal.dumps(self.stats)
+
+    def speedscope(self) -> bytes:
+        """Dos perfiles: llamadas (muestreado desde pstats) y la línea de tiempo de la BD."""
+        frames, indice = [], {}
+
+        def frame(nombre: str, archivo: str = "", linea: int = 0) -> int:
+            k = (nombre, archivo, linea)
+            if k not in indice:
+                indice[k] = len(frames)
+                frames.append({"name": nombre, "file": archivo, "line": linea} if archivo else {"name": nombre})
+            return indice[k]
+
+        hijos = defaultdict(list)
+        for f, (_, _, _, _, llamadores) in self.stats.items():
+            for padre, (_, _, _, ct) in llamadores.items():
+                hijos[padre].append((f, ct))
+        muestras, pesos = [], []
+
+        def bajar(f, ct: float, pila: list):
+            escala = ct / (self.stats[f][3] or ct or 1)
+            en_hijos = 0.0
+            if len(pila) < PROFUNDIDAD_MAX:
+                for h, hct in hijos[f]:
+                    w = min(hct * escala, ct - en_hijos)
+                    if w < MIN_RAMA_S or h in pila:
+                        continue
+                    en_hijos += w
+                    bajar(h, w, pila + [h])
+            if ct - en_hijos > 0:
+                muestras.append([frame(g[2], g[0], g[1]) for g in pila])
+                pesos.append(ct - en_hijos)
+
+        for f, (_, _, _, ct, llamadores) in self.stats.items():
+            if not llamadores and ct >= MIN_RAMA_S:
+                bajar(f, ct, [f])
+
+        raiz = frame(f"{self.pagina} ({self.total_ms:.0f} ms)")
+        eventos = [{"type": "O", "frame": raiz, "at": 0.0}]
+        for nombre, inicio, ms, _ in sorted(self.consultas, key=lambda c: c[1]):
+            a = min(inicio * 1000, self.total_ms)
+            eventos += [{"type": "O", "frame": frame(nombre, "consultas.py"), "at": a},
+                        {"type": "C", "frame": frame(nombre, "consultas.py"), "at": min(a + ms, self.total_ms)}]
+        eventos.append({"type": "C", "frame": raiz, "at": self.total_ms})
+        doc = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.nombre_archivo(),
+            "exporter": "modules.perfil",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [
+                {"type": "sampled", "name": "llamadas (cProfile)", "unit": "seconds", "startValue": 0,
+                 "endValue": sum(pesos), "samples": muestras, "weights": pesos},
+                {"type": "evented", "name": "BD (idas y vueltas)", "unit": "milliseconds", "startValue": 0,
+                 "endValue": self.total_ms, "events": eventos},
+            ],
+        }
+        return json.dumps(doc, ensure_ascii=False).encode()
+
+    def nombre_archivo(self) -> str:
+        pagina = "".join(ch if ch.isalnum() else "_" for ch in self.pagina)
+        return f"perfil_{self.cuando:%Y%m%d_%H%M%S}_{self.id}_{pagina}"
+
+
+class CursorMedido(psycopg.Cursor):
+    """Cursor del pool: si hay un perfil activo en este hilo, anota cada execute."""
+
+    def execute(self, query, params=None, **kwargs):
+        p = _actual.get()
+        if p is None:
+            return super().execute(query, params, **kwargs)
+        t0 = _time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            p.consulta(query, t0, self.rowcount)
+
+    def executemany(self, query, params_seq, **kwargs):
+        p = _actual.get()
+        if p is None:
+            return super().executemany(query, params_seq, **kwargs)
+        t0 = _time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            p.consulta(query, t0, self.rowcount)
+
+
+# ---------- Ejecución de página ----------
+def activo() -> bool:
+    return PERFIL_ENV or bool(st.session_state.get(CLAVE_SESION))
+
+@contextmanager
+def ejecucion():
+    """Envuelve una ejecución del script; no hace nada si el perfil no está activo."""
+    if not activo() or _actual.get() is not None:
+        yield None
+        return
+    p = Perfil()
+    token = _actual.set(p)
+    try:
+        yield p
+    except BaseException:
+        # st.rerun / st.switch_page / st.stop: se guarda, pero no hay página donde mostrarlo
+        p.terminar()
+        _guardar(p)
+        raise
+    finally:
+        _actual.reset(token)
+    p.terminar()
+    _guardar(p)
+    mostrar(p)
+
+def pagina(nombre: str):
+    """Página y salón de la ejecución (Home.py los sabe después de st.navigation)."""
+    p = _actual.get()
+    if p is not None:
+        p.pagina = nombre
+        p.salon = salones.actual().slug
+
+def _guardar(p: Perfil):
+    with _lock:
+        _anillo.append(p)
+
+def recientes() -> list[Perfil]:
+    """Perfiles del salón actual en este proceso, el más nuevo primero."""
+    slug = salones.actual().slug
+    with _lock:
+        return [p for p in reversed(_anillo) if p.salon == slug]
+
+
+# ---------- Vista ----------
+def descargas(p: Perfil, key: str):
+    c1, c2 = st.columns(2)
+    c1.download_button("⬇️ .prof (pstats)", p.prof, file_name=f"{p.nombre_archivo()}.prof",
+                       mime="application/octet-stream", key=f"{key}_prof", on_click="ignore",
+                       disabled=not p.stats)
+    c2.download_button("⬇️ speedscope", p.speedscope, file_name=f"{p.nombre_archivo()}.speedscope.json",
+                       mime="application/json", key=f"{key}_ss", on_click="ignore")
+
+def mostrar(p: Perfil):
+    titulo = (f"⏱️ Perfil: {p.pagina} • {p.total_ms:.0f} ms • {len(p.consultas)} consultas "
+              f"({p.bd_ms:.0f} ms en BD)")
+    with st.expander(titulo):
+        if p.stats:
+            st.caption("Tiempo propio por categoría (cProfile; lo que se espera a la BD cae en psycopg u otros).")
+            st.dataframe(p.categorias(), hide_index=True)
+            st.caption("Funciones de modules/ (ms incluye lo que llaman).")
+            st.dataframe(p.llamadas_core().head(25), hide_index=True)
+        else:
+            st.caption("Otro perfilador estaba activo: solo se midieron las consultas.")
+        if p.consultas:
+            st.caption("Idas y vueltas a la BD, en orden.")
+            st.dataframe(p.tabla_consultas(), hide_index=True)
+        descargas(p, f"perfil_{p.id}")
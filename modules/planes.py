@@ -0,0 +1,288 @@
+# modules/planes.py — Regresión de planes de consulta para el catálogo SQL
+#
+# Siembra una BD local grande en un esquema aparte, corre
+# EXPLAIN (ANALYZE, BUFFERS) sobre cada consulta de modules/consultas.py y
+# falla si alguna cae en Seq Scan o se pasa del presupuesto de costo/latencia.
+#
+#   python -m modules.planes --url postgresql://localhost/citas_bench
+#
+# Las escrituras se ejecutan dentro de una transacción que se revierte.
+import argparse, json, sys
+from datetime import date, time, timedelta
+import psycopg
+from modules.consultas import SCHEMA_SQL, SQL, INDICE_E164_SQL
+from modules import particiones
+
+ESQUEMA_BENCH = "planes_bench"
+
+COSTO_MAX: float = 500.0   # unidades del planificador
+LATENCIA_MAX_MS: float = 25.0
+# Un Seq Scan que lee menos filas que esto no cuenta (meses vacíos o de un
+# solo salón: recorrer la partición entera es más barato que el índice)
+SEQ_SCAN_FILAS_MAX: int = 1000
+
+# Sobrescrituras por consulta: {"nombre": {"costo": x, "ms": y, "seq_scan": True}}
+PRESUPUESTOS: dict[str, dict] = {
+    # reconstrucción completa de la agenda .ics: al arrancar y una vez al día
+    "ics_agenda_desde": {"costo": 2000.0, "seq_scan": True},
+    # revisión de reglas en lote (modules/consistencia.py): recorre todo a propósito
+    "revision_hallazgos": {"costo": 20000.0, "ms": 500.0, "seq_scan": True},
+}
+
+
+def sembrar(c: psycopg.Connection, pacientes: int, dias: int, ocupacion: float) -> dict:
+    """Crea el esquema de prueba y lo llena del lado del servidor (generate_series)."""
+    c.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA_BENCH} CASCADE")
+    c.execute(f"CREATE SCHEMA {ESQUEMA_BENCH}")
+    c.execute(f"SET search_path TO {ESQUEMA_BENCH}")
+    c.execute(SCHEMA_SQL)
+    inicio = date.today() - timedelta(days=dias - 30)
+    particiones.asegurar(c, desde=inicio)
+    c.execute(
+        """
+        INSERT INTO pacientes (nombre, telefono, telefono_e164, password_hash, creado_en)
+        SELECT 'Paciente ' || i, '55' || lpad(i::text, 8, '0'), '+5255' || lpad(i::text, 8, '0'), NULL,
+               now() - (i || ' minutes')::interval
+        FROM generate_series(1, %s) AS i
+        """,
+        (pacientes,),
+    )
+    c.execute(INDICE_E164_SQL)
+    c.execute(
+        """
+        INSERT INTO citas (fecha, hora, paciente_id, servicio, nota, creado_en)
+        SELECT d::date, h::time, 1 + floor(random() * %s)::int, 'Corte', NULL,
+               d - interval '3 days' + (random() * interval '2 days')
+        FROM generate_series(%s::date, %s::date + %s, interval '1 day') AS d,
+             generate_series(timestamp '2000-01-01 08:00', timestamp '2000-01-01 18:30', interval '30 minutes') AS h
+        WHERE random() < %s
+        """,
+        (pacientes, inicio, inicio, dias, ocupacion),
+    )
+    c.execute(
+        """
+        INSERT INTO sesiones (id, paciente_id, expira_en)
+        SELECT md5(i::text), 1 + (i %% %s), now() + interval '30 days'
+        FROM generate_series(1, %s) AS i
+        """,
+        (pacientes, pacientes),
+    )
+    # ~2 % de los pacientes con una serie; sus citas de las 10:00 cuelgan de ella
+    c.execute(
+        """
+        INSERT INTO series (id, paciente_id, hora, cada_semanas, desde, hasta, servicio)
+        SELECT i, i, '10:00', 2, %s, %s::date + %s, 'Corte' FROM generate_series(1, %s) AS i
+        """,
+        (inicio, inicio, dias, max(pacientes // 50, 1)),
+    )
+    c.execute("UPDATE citas SET serie_id = paciente_id WHERE paciente_id <= %s AND hora = '10:00'",
+              (max(pacientes // 50, 1),))
+    c.execute("SELECT setval('series_id_seq', (SELECT max(id) FROM series))")
+    # lista de espera: 1 de cada 5 pacientes, rangos de 1-3 semanas; una oferta vencida por cada 10
+    c.execute(
+        """
+        INSERT INTO lista_espera (id, paciente_id, desde, hasta, servicio, creado_en)
+        SELECT i, i, d, d + (7 + (i %% 15)), 'Corte', now() - (i || ' minutes')::interval
+        FROM (SELECT i, %s::date + (i %% %s) AS d FROM generate_series(1, %s) AS i) AS t
+        """,
+        (inicio, dias, max(pacientes // 5, 1)),
+    )
+    c.execute(
+        """
+        INSERT INTO ofertas (espera_id, paciente_id, fecha, hora, estado, expira_en)
+        SELECT id, paciente_id, desde, '19:00', 'expirada', now() - interval '1 day'
+        FROM lista_espera WHERE id % 10 = 1
+        """
+    )
+    c.execute("UPDATE ofertas SET estado = 'enviada', expira_en = now() + interval '1 hour' WHERE id = 1")
+    c.execute("SELECT setval('lista_espera_id_seq', (SELECT max(id) FROM lista_espera))")
+    c.execute("INSERT INTO revisiones (terminada_en, hallazgos, ms) VALUES (now(), 0, 0)")
+    c.execute("ANALYZE lista_espera")
+    c.execute("ANALYZE ofertas")
+    c.execute("ANALYZE series")
+    c.execute("ANALYZE pacientes")
+    c.execute("ANALYZE citas")
+    c.execute("ANALYZE sesiones")
+    # el registro real se escribe a lo largo de meses (lo que aprovecha el índice BRIN)
+    c.execute("UPDATE cambios SET creado_en = now() - ((SELECT max(seq) FROM cambios) - seq) * interval '1 minute'")
+    c.execute("VACUUM ANALYZE cambios")
+    pid = c.execute(
+        "SELECT paciente_id FROM citas WHERE fecha >= CURRENT_DATE GROUP BY paciente_id ORDER BY count(*) DESC LIMIT 1"
+    ).fetchone()[0]
+    tel, e164 = c.execute("SELECT telefono, telefono_e164 FROM pacientes WHERE id=%s", (pid,)).fetchone()
+    cid = c.execute("SELECT id, paciente_id FROM citas WHERE fecha = CURRENT_DATE + 3 LIMIT 1").fetchone()
+    return {
+        "paciente_id": pid,
+        "telefono": tel,
+        "e164": e164,
+        "cita_id": cid[0] if cid else 1,
+        "paciente_cita": cid[1] if cid else 1,
+        "fecha": date.today() + timedelta(days=3),
+        "fecha_libre": inicio + timedelta(days=dias + 60),
+    }
+
+
+def _parametros(nombre: str, m: dict) -> tuple | dict:
+    hoy3, libre = m["fecha"], m["fecha_libre"]
+    return {
+        "paciente_por_telefono": (m["e164"],),
+        "paciente_por_telefono_crudo": (m["telefono"],),
+        "paciente_id_por_telefono": (m["e164"],),
+        "registrar_paciente": ("Nueva", "5599999999", "+525599999999", "x"),
+        "insertar_paciente": ("Nueva", "5599999999", "+525599999999"),
+        "crear_sesion": ("nueva", m["paciente_id"], libre),
+        "sesion_activa": ("c4ca4238a0b923820dcc509a6f75849b",),
+        "revocar_sesion": ("c4ca4238a0b923820dcc509a6f75849b",),
+        "revocar_sesiones_paciente": (m["paciente_id"],),
+        "proxima_cita_paciente": (m["paciente_id"], date.today()),
+        "cita_en_dia": (m["paciente_id"], hoy3),
+        "cita_en_ventana_7dias": (m["paciente_id"], hoy3, hoy3),
+        "horas_ocupadas": (hoy3,),
+        "insertar_cita": (libre, time(10, 0), m["paciente_id"], "Corte", None),
+        "insertar_cita_por_telefono": {"nombre": "Nueva", "tel": m["telefono"], "e164": m["e164"], "fecha": libre,
+                                       "hora": time(10, 0), "servicio": "Corte", "nota": None},
+        "actualizar_cita_por_telefono": {"cita": m["cita_id"], "nombre": "Nueva", "tel": m["telefono"],
+                                         "e164": m["e164"], "servicio": "Corte", "nota": "nota"},
+        "citas_por_dia": (hoy3,),
+        "actualizar_cita": {"cita": m["cita_id"], "paciente": m["paciente_id"], "servicio": "Corte", "nota": "nota"},
+        "eliminar_cita": (m["cita_id"],),
+        "cancelar_cita_paciente": (m["cita_id"], m["paciente_cita"], date.today()),
+        "candado_paciente": (m["paciente_cita"],),
+        "reprogramar_cita_paciente": {"cita": m["cita_id"], "paciente": m["paciente_cita"], "hoy": date.today(),
+                                      "fecha": libre, "hora": time(10, 0)},
+        "crear_serie": {"nombre": "Nueva", "tel": m["telefono"], "e164": m["e164"], "hora": time(10, 0), "cada": 1, "desde": libre,
+                        "hasta": libre + timedelta(weeks=11), "servicio": "Corte", "nota": None,
+                        "fechas": [libre + timedelta(weeks=i) for i in range(12)]},
+        "recortar_serie": (hoy3, 1),
+        "cancelar_serie_desde": (1, hoy3),
+        "editar_serie": (time(11, 0), "Corte", None, 1),
+        "editar_serie_desde": {"serie": 1, "desde": hoy3, "hora": time(11, 0), "servicio": "Corte", "nota": None},
+        "dias_cerrados": (),
+        "ocupacion_rango": (hoy3, hoy3 + timedelta(days=14)),
+        "cerrar_dia": (hoy3, "Cierre"),
+        "reabrir_dia": (hoy3,),
+        "reprogramar_citas": ([m["cita_id"]], [libre], [time(10, 0)], hoy3),
+        "agregar_espera": (m["paciente_id"], libre, libre + timedelta(days=14), None, None, "Corte"),
+        "esperas_paciente": (m["paciente_id"],),
+        "cancelar_espera": (1, 1),
+        "crear_oferta": {"fecha": hoy3, "hora": time(19, 0), "minutos": 30},
+        "marcar_oferta": ("expirada", 1),
+        "vencer_ofertas": (50,),
+        "ofertas_paciente": (m["paciente_id"],),
+        "aceptar_oferta": {"oferta": 1, "paciente": 1},
+        "rechazar_oferta": (1, 1),
+        "citas_manana": (date.today() + timedelta(days=1),),
+        "cambios_desde": ("0", 0, 500),
+        "cambios_retenidos": ("0", 0),
+        "podar_cambios": (30, 1000),
+        "ics_agenda_desde": (date.today() - timedelta(days=30),),
+        "ics_agenda_dias": ([hoy3, hoy3 + timedelta(days=1), libre],),
+        "ics_pacientes": ([m["paciente_id"], 1, 2, 3], date.today()),
+        "ics_pacientes_desde": (date.today(),),
+        "revision_hallazgos": {"revision": 1},
+        "revision_cerrar": (0, 0, 1),
+        "revision_podar": (10,),
+        "revision_resumen": (1,),
+        "revision_detalle": (1, ["mismo_dia", "sin_paciente"], 500),
+    }.get(nombre, ())
+
+
+def _nodos(plan: dict):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _filas_leidas(n: dict) -> float:
+    # Actual Rows y Rows Removed by Filter son promedios por vuelta
+    return (n.get("Actual Rows", 0) + n.get("Rows Removed by Filter", 0)) * n.get("Actual Loops", 1)
+
+
+def explicar(c: psycopg.Connection, nombre: str, m: dict) -> dict:
+    """EXPLAIN (ANALYZE, BUFFERS) de una consulta; siempre revierte."""
+    cur = psycopg.ClientCursor(c)
+    try:
+        with c.transaction(force_rollback=True):
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + SQL[nombre], _parametros(nombre, m))
+            salida = cur.fetchone()[0]
+    finally:
+        cur.close()
+    if isinstance(salida, str):
+        salida = json.loads(salida)
+    raiz = salida[0]
+    plan = raiz["Plan"]
+    nodos = list(_nodos(plan))
+    return {
+        "consulta": nombre,
+        "costo": float(plan["Total Cost"]),
+        "ms": float(raiz["Execution Time"]),
+        "seq_scans": sorted({n.get("Relation Name", "?") for n in nodos
+                             if n["Node Type"] == "Seq Scan" and _filas_leidas(n) >= SEQ_SCAN_FILAS_MAX}),
+        "buffers": int(plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)),
+    }
+
+
+def revisar(r: dict, costo_max: float, ms_max: float) -> list[str]:
+    p = PRESUPUESTOS.get(r["consulta"], {})
+    fallas = []
+    if r["seq_scans"] and not p.get("seq_scan"):
+        fallas.append(f"Seq Scan en {', '.join(r['seq_scans'])}")
+    if r["costo"] > p.get("costo", costo_max):
+        fallas.append(f"costo {r['costo']:.0f} > {p.get('costo', costo_max):.0f}")
+    if r["ms"] > p.get("ms", ms_max):
+        fallas.append(f"{r['ms']:.2f} ms > {p.get('ms', ms_max):.2f} ms")
+    return fallas
+
+
+def correr(c: psycopg.Connection, m: dict, costo_max: float, ms_max: float) -> list[dict]:
+    resultados = []
+    for nombre in SQL:
+        r = explicar(c, nombre, m)
+        r["fallas"] = revisar(r, costo_max, ms_max)
+        resultados.append(r)
+    return resultados
+
+
+def revisar_feed(c: psycopg.Connection, m: dict) -> list[str]:
+    """Mover una cita de mes (de partición) debe quedar en cambios como una sola U."""
+    with c.transaction(force_rollback=True):
+        c.execute("UPDATE citas SET fecha = %s WHERE id = %s", (m["fecha_libre"], m["cita_id"]))
+        ops = [r[0] for r in c.execute(
+            "SELECT op FROM cambios WHERE xid = pg_current_xact_id() AND tabla = 'citas' AND fila_id = %s ORDER BY seq",
+            (m["cita_id"],))]
+    return [] if ops == ["U"] else [f"mover de mes registró {'+'.join(ops) or 'nada'} en vez de U"]
+
+
+def imprimir(resultados: list[dict]):
+    print(f"{'consulta':28} {'costo':>10} {'ms':>9} {'buffers':>8}  estado")
+    for r in resultados:
+        estado = "OK" if not r["fallas"] else "FALLA: " + "; ".join(r["fallas"])
+        print(f"{r['consulta']:28} {r['costo']:10.1f} {r['ms']:9.3f} {r['buffers']:8d}  {estado}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Regresión de planes del catálogo SQL")
+    ap.add_argument("--url", required=True, help="BD local desechable (NO la de producción)")
+    ap.add_argument("--pacientes", type=int, default=50_000)
+    ap.add_argument("--dias", type=int, default=3 * 365)
+    ap.add_argument("--ocupacion", type=float, default=0.7)
+    ap.add_argument("--costo-max", type=float, default=COSTO_MAX)
+    ap.add_argument("--ms-max", type=float, default=LATENCIA_MAX_MS)
+    ap.add_argument("--conservar", action="store_true", help="no borrar el esquema de prueba al terminar")
+    args = ap.parse_args(argv)
+
+    with psycopg.connect(args.url, autocommit=True) as c:
+        m = sembrar(c, args.pacientes, args.dias, args.ocupacion)
+        try:
+            resultados = correr(c, m, args.costo_max, args.ms_max)
+            feed = revisar_feed(c, m)
+        finally:
+            if not args.conservar:
+                c.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA_BENCH} CASCADE")
+    imprimir(resultados)
+    print(f"{'cambios (mover de mes)':28} {'':29}  {'OK' if not feed else 'FALLA: ' + '; '.join(feed)}")
+    return 1 if feed or any(r["fallas"] for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
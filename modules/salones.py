@@ -0,0 +1,287 @@
+# modules/salones.py — Varios salones en un mismo despliegue (un esquema por salón)
+#
+# Cada salón tiene su propio esquema de PostgreSQL (salon_<slug>) con las
+# mismas tablas; el salón principal usa public, así que un despliegue de un
+# solo salón no cambia nada. core.conn() fija el search_path de la conexión
+# del pool al esquema del salón actual: el catálogo SQL no sabe de salones.
+# La configuración de cada salón (nombre, administradora, servicios, horario,
+# cupo de conexiones) vive en public.salones.
+#
+# La URL elige el salón: ?salon=<slug> o el subdominio (<slug>.midominio.com).
+# Cada salón puede tener a la vez como mucho `cupo` conexiones del pool
+# compartido (por defecto todas menos una), así uno con mucho tráfico no deja
+# sin conexiones a los demás.
+#
+#   python -m modules.salones --url $NEON_DATABASE_URL --crear centro --nombre "Salón Centro" --admin ana
+#   python -m modules.salones --url ... --crear centro --servicios "Corte,Manicure" --cupo 2
+#   python -m modules.salones --url ... --listar
+#
+# La contraseña de la administradora se pide por consola (o SALON_PASSWORD) y
+# se guarda con bcrypt + PASSWORD_PEPPER (env o .streamlit/secrets.toml, como en
+# la app; ver modules/secretos.py), igual que las de los clientes.
+import argparse, getpass, json, os, re, sys, threading, time as _time, weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import time
+from typing import Callable, Optional
+import bcrypt
+import psycopg
+from modules.consultas import SCHEMA_SQL
+from modules import particiones, secretos, telefonos
+
+SLUG = re.compile(r"^[a-z0-9]+(-[a-z0-9]+)*$")
+ESPERA_CUPO_S: float = 30.0   # lo mismo que espera el pool por una conexión
+
+REGISTRO_SQL = """
+CREATE TABLE IF NOT EXISTS public.salones (
+  slug TEXT PRIMARY KEY CHECK (slug ~ '^[a-z0-9]+(-[a-z0-9]+)*$' AND length(slug) <= 30),
+  nombre TEXT NOT NULL,
+  admin_user TEXT NOT NULL,
+  admin_password_hash TEXT NOT NULL,
+  servicios TEXT[],          -- NULL = lista por defecto
+  horario JSONB,             -- {"0": [["10:00", "12:00"], ...], ...} lunes = 0; NULL = por defecto
+  max_conexiones INTEGER CHECK (max_conexiones > 0),   -- NULL = todas menos una
+  activo BOOLEAN NOT NULL DEFAULT true,
+  creado_en TIMESTAMP DEFAULT now()
+);
+"""
+
+
+class SalonSaturado(RuntimeError):
+    """El salón ya usa todas las conexiones de su cupo y ninguna se liberó a tiempo."""
+
+
+class Cupo:
+    """Conexiones del pool que un salón puede tener a la vez, con contadores."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self._sem = threading.BoundedSemaphore(n)
+        self._lock = threading.Lock()
+        self.en_uso = 0
+        self.usos = 0
+        self.esperas = 0
+        self.espera_s = 0.0
+        self.saturado = 0
+
+    @contextmanager
+    def tomar(self, timeout: float = ESPERA_CUPO_S):
+        if not self._sem.acquire(blocking=False):
+            t0 = _time.monotonic()
+            ok = self._sem.acquire(timeout=timeout)
+            with self._lock:
+                self.esperas += 1
+                self.espera_s += _time.monotonic() - t0
+                self.saturado += not ok
+            if not ok:
+                raise SalonSaturado("El salón tiene demasiadas operaciones en curso. Inténtalo de nuevo.")
+        with self._lock:
+            self.en_uso += 1
+            self.usos += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.en_uso -= 1
+            self._sem.release()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"cupo": self.n, "en_uso": self.en_uso, "usos": self.usos, "esperas": self.esperas,
+                    "espera_s": round(self.espera_s, 3), "saturado": self.saturado}
+
+
+class Salon:
+    def __init__(self, slug: str, nombre: str, admin_user: Optional[str] = None,
+                 admin_hash: Optional[str] = None, servicios: Optional[list[str]] = None,
+                 horario: Optional[dict] = None, max_conexiones: Optional[int] = None):
+        self.slug = slug
+        self.nombre = nombre
+        self.esquema = f"salon_{slug.replace('-', '_')}" if slug else "public"
+        self.admin_user = admin_user
+        self.admin_hash = admin_hash
+        self.servicios = list(servicios) if servicios else None
+        self.horario = _horario(horario) if horario else None
+        self.max_conexiones = max_conexiones
+        self.cupo = Cupo(1)
+
+    @property
+    def principal(self) -> bool:
+        return not self.slug
+
+    def __repr__(self):
+        return f"Salon({self.slug or 'principal'!r})"
+
+
+def _horario(h: dict) -> dict[int, list[tuple[time, time]]]:
+    return {int(d): [(time.fromisoformat(a), time.fromisoformat(b)) for a, b in bloques]
+            for d, bloques in h.items()}
+
+
+PRINCIPAL = Salon("", "Salón de Belleza")
+
+_lock = threading.Lock()
+_registro: dict[str, Salon] = {"": PRINCIPAL}
+_cargado_en = 0.0
+_actual: ContextVar[Optional[Salon]] = ContextVar("salon", default=None)
+_fijado: "weakref.WeakKeyDictionary[psycopg.Connection, str]" = weakref.WeakKeyDictionary()
+
+
+# ---------- Registro ----------
+def cargar(c: psycopg.Connection, pool_max: int) -> list[Salon]:
+    """Lee public.salones (la crea si falta) y reparte los cupos. Devuelve los salones."""
+    global _registro, _cargado_en
+    c.execute(REGISTRO_SQL)
+    filas = c.execute(
+        """
+        SELECT slug, nombre, admin_user, admin_password_hash, servicios, horario, max_conexiones
+        FROM public.salones WHERE activo ORDER BY slug
+        """
+    ).fetchall()
+    # con un solo salón no hay a quién proteger: puede usar el pool entero
+    defecto = max(1, pool_max - 1) if filas else pool_max
+    nuevos = {"": PRINCIPAL}
+    for f in filas:
+        nuevos[f[0]] = Salon(*f)
+    with _lock:
+        for slug, s in nuevos.items():
+            n = min(s.max_conexiones or defecto, pool_max)
+            previo = _registro.get(slug)
+            # conservar el cupo (y sus contadores) si no cambió de tamaño
+            s.cupo = previo.cupo if previo is not None and previo.cupo.n == n else Cupo(n)
+        _registro = nuevos
+        _cargado_en = _time.monotonic()
+    return list(nuevos.values())
+
+def cargado_hace() -> float:
+    return _time.monotonic() - _cargado_en
+
+def buscar(slug: Optional[str]) -> Optional[Salon]:
+    return _registro.get(slug or "")
+
+def todos() -> list[Salon]:
+    return list(_registro.values())
+
+def esquemas() -> list[str]:
+    return [s.esquema for s in todos()]
+
+def de_host(host: Optional[str]) -> Optional[str]:
+    """Slug del subdominio (centro.midominio.com -> "centro") si es un salón registrado."""
+    partes = (host or "").split(":")[0].lower().split(".")
+    if len(partes) >= 3 and partes[0] in _registro:
+        return partes[0]
+    return None
+
+
+# ---------- Salón actual ----------
+def _de_sesion() -> Optional[Salon]:
+    # en una corrida de Streamlit (también la de un fragmento) el salón es el de la sesión
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None or "salon" not in ctx.session_state:
+        return None
+    return buscar(ctx.session_state["salon"])
+
+def actual() -> Salon:
+    """El fijado con usando() en este contexto, o el de la sesión de Streamlit, o el principal."""
+    return _actual.get() or _de_sesion() or PRINCIPAL
+
+@contextmanager
+def usando(s: Salon):
+    tok = _actual.set(s)
+    try:
+        yield s
+    finally:
+        _actual.reset(tok)
+
+def ligar(fn: Callable) -> Callable:
+    """fn con el salón actual fijado, para correrla en otro hilo (colas, timers)."""
+    s = actual()
+    def con_salon(*args, **kwargs):
+        with usando(s):
+            return fn(*args, **kwargs)
+    return con_salon
+
+def fijar(c: psycopg.Connection, s: Salon):
+    """search_path de la conexión al esquema del salón (sin ida y vuelta si ya lo tiene)."""
+    if _fijado.get(c) != s.esquema:
+        c.execute("SELECT set_config('search_path', %s, false)", (s.esquema,))
+        _fijado[c] = s.esquema
+
+
+# ---------- Esquema ----------
+def preparar(c: psycopg.Connection) -> dict:
+    """Tablas, migraciones y particiones del esquema de la conexión (idempotente)."""
+    c.execute(SCHEMA_SQL)
+    res = {}
+    e164 = telefonos.migrar(c)   # no-op si el índice único de telefono_e164 ya existe
+    if e164:
+        res["telefono_e164"] = e164
+    migradas = particiones.migrar(c)   # no-op si citas ya está particionada
+    if migradas:
+        res["particiones"] = migradas
+    creadas = particiones.asegurar(c)
+    if creadas:
+        res["meses"] = creadas
+    return res
+
+def crear(c: psycopg.Connection, slug: str, nombre: str, admin_user: str, admin_hash: str,
+          servicios: Optional[list[str]] = None, horario: Optional[dict] = None,
+          max_conexiones: Optional[int] = None) -> Salon:
+    """Crea (o actualiza) el salón: su esquema con todas las tablas y su fila en el registro."""
+    if not SLUG.match(slug) or len(slug) > 30:
+        raise ValueError("El slug solo puede tener minúsculas, números y guiones (máx. 30).")
+    s = Salon(slug, nombre, admin_user, admin_hash, servicios, horario, max_conexiones)
+    c.execute(REGISTRO_SQL)
+    c.execute(f"CREATE SCHEMA IF NOT EXISTS {s.esquema}")
+    fijar(c, s)
+    try:
+        preparar(c)
+    finally:
+        fijar(c, PRINCIPAL)
+    c.execute(
+        """
+        INSERT INTO public.salones (slug, nombre, admin_user, admin_password_hash, servicios, horario, max_conexiones)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (slug) DO UPDATE SET
+          nombre = EXCLUDED.nombre, admin_user = EXCLUDED.admin_user,
+          admin_password_hash = EXCLUDED.admin_password_hash, servicios = EXCLUDED.servicios,
+          horario = EXCLUDED.horario, max_conexiones = EXCLUDED.max_conexiones, activo = true
+        """,
+        (slug, nombre, admin_user, admin_hash, servicios, json.dumps(horario) if horario else None, max_conexiones),
+    )
+    return s
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Salones de un despliegue multi-salón (un esquema por salón)")
+    ap.add_argument("--url", required=True)
+    ap.add_argument("--listar", action="store_true")
+    ap.add_argument("--crear", metavar="SLUG", help="crear o actualizar un salón")
+    ap.add_argument("--nombre")
+    ap.add_argument("--admin", help="usuario de la administradora")
+    ap.add_argument("--servicios", help="separados por comas (por defecto, la lista de siempre)")
+    ap.add_argument("--horario", help='JSON por día, lunes = 0: {"0": [["10:00", "14:00"]], ...}')
+    ap.add_argument("--cupo", type=int, help="conexiones del pool que puede usar a la vez")
+    args = ap.parse_args(argv)
+    with psycopg.connect(args.url, autocommit=True) as c:
+        if args.crear:
+            if not (args.nombre and args.admin):
+                ap.error("--crear necesita --nombre y --admin")
+            pw = os.getenv("SALON_PASSWORD") or getpass.getpass("Contraseña de la administradora: ")
+            pw_hash = bcrypt.hashpw(pw.encode() + secretos.pimienta(), bcrypt.gensalt()).decode()
+            servicios = [x.strip() for x in args.servicios.split(",") if x.strip()] if args.servicios else None
+            s = crear(c, args.crear, args.nombre, args.admin, pw_hash, servicios,
+                      json.loads(args.horario) if args.horario else None, args.cupo)
+            print(f"salón {s.slug}: esquema {s.esquema} listo")
+        if args.listar or not args.crear:
+            for s in cargar(c, pool_max=int(os.getenv("DB_POOL_MAX") or 5)):
+                print(f"{s.slug or '(principal)':20} {s.esquema:24} {s.nombre}  cupo={s.cupo.n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+# modules/secretos.py — Secretos de la app, también para los CLI
+#
+# La app y los comandos (python -m modules.salones ...) leen igual: la variable
+# de entorno y, si no está, st.secrets (.streamlit/secrets.toml). No toca la BD
+# al importarse, así que un CLI puede usarlo sin arrancar core.
+import os
+
+
+def secreto(clave: str, default=None):
+    """st.secrets[clave], o default si no hay secrets (o no hay Streamlit)."""
+    try:
+        import streamlit as st
+        return st.secrets.get(clave, default)
+    except Exception:
+        return default
+
+
+def pimienta() -> bytes:
+    """PASSWORD_PEPPER: va en las contraseñas de clientes y administradoras."""
+    return (os.getenv("PASSWORD_PEPPER") or secreto("PASSWORD_PEPPER") or "").encode()
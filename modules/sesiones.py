@@ -0,0 +1,101 @@
+# modules/sesiones.py — Sesiones persistentes de clientes (cookie firmada)
+#
+# Token: "<sid>.<expira_unix>.<firma>", firma = HMAC-SHA256(SESSION_SECRET).
+# Validar un token cuesta un HMAC + una búsqueda de sesión en caché; bcrypt
+# solo corre al iniciar sesión con contraseña. La revocación es del lado del
+# servidor (tabla sesiones).
+import base64, hashlib, hmac, secrets, time as _time
+from datetime import datetime, timedelta
+from typing import Optional
+import streamlit as st
+import streamlit.components.v1 as components
+from modules.core import SESSION_SECRET, SESION_DIAS, CACHE_TTL_S, repo
+from modules import cache_sync, salones
+
+COOKIE = "citas_sesion"
+
+def _cookie() -> str:
+    # una cookie por salón: con ?salon= todos comparten el mismo dominio
+    s = salones.actual()
+    return COOKIE if s.principal else f"{COOKIE}_{s.slug}"
+
+
+def _firma(datos: str) -> str:
+    d = hmac.new(SESSION_SECRET, datos.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(d).rstrip(b"=").decode()
+
+def emitir_token(paciente_id: int) -> Optional[str]:
+    if not SESSION_SECRET:
+        return None
+    sid = secrets.token_urlsafe(24)
+    expira = datetime.now() + timedelta(days=SESION_DIAS)
+    repo().crear_sesion(sid, paciente_id, expira)
+    datos = f"{sid}.{int(expira.timestamp())}"
+    return f"{datos}.{_firma(datos)}"
+
+def _sid_valido(token: str) -> Optional[str]:
+    """Chequeo barato (sin BD): formato, expiración y firma."""
+    if not (SESSION_SECRET and token) or token.count(".") != 2:
+        return None
+    sid, exp, firma = token.split(".")
+    if not exp.isdigit() or int(exp) <= _time.time():
+        return None
+    if not hmac.compare_digest(firma, _firma(f"{sid}.{exp}")):
+        return None
+    return sid
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL_S)
+def _sesion(sid: str, version: tuple = ()) -> Optional[dict]:
+    return repo().sesion_activa(sid)
+
+def validar_token(token: str) -> Optional[dict]:
+    sid = _sid_valido(token)
+    # la revocación en cualquier réplica llega por NOTIFY "sesion:<sid>"
+    return _sesion(sid, cache_sync.version(f"sesion:{sid}")) if sid else None
+
+def revocar_token(token: str):
+    sid = _sid_valido(token)
+    if sid:
+        repo().revocar_sesion(sid)
+        cache_sync.invalidar(f"sesion:{sid}")
+
+# ---------- Cookie (Streamlit) ----------
+def _escribir_cookie(valor: str, max_age: int):
+    components.html(
+        f"""<script>
+        window.parent.document.cookie = "{_cookie()}={valor}; path=/; max-age={max_age}; SameSite=Lax"
+          + (window.parent.location.protocol === "https:" ? "; Secure" : "");
+        </script>""",
+        height=0,
+    )
+
+def recordar_sesion(user: dict):
+    """Tras un login correcto: crea la sesión y deja la cookie pendiente de escribir."""
+    token = emitir_token(int(user["id"]))
+    if token:
+        st.session_state["_cookie_sesion"] = (token, SESION_DIAS * 86400)
+
+def cerrar_sesion():
+    token = st.context.cookies.get(_cookie())
+    if token:
+        revocar_token(token)
+    st.session_state["_cookie_sesion"] = ("", 0)
+    st.session_state["_sin_restaurar"] = True
+    st.session_state.role = None
+    st.session_state.paciente = None
+
+def restaurar_sesion():
+    """Si no hay sesión en memoria, la recupera de la cookie (sin bcrypt)."""
+    if st.session_state.get("role") or st.session_state.get("_sin_restaurar"):
+        return
+    user = validar_token(st.context.cookies.get(_cookie(), ""))
+    if user:
+        st.session_state.role = "paciente"
+        st.session_state.paciente = user
+
+def escribir_cookie_pendiente():
+    # Se escribe en la corrida siguiente al login/logout: st.rerun() corta el
+    # script antes de que el componente llegue al navegador.
+    pendiente = st.session_state.pop("_cookie_sesion", None)
+    if pendiente is not None:
+        _escribir_cookie(*pendiente)
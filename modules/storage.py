@@ -0,0 +1,510 @@
+# modules/storage.py — Interfaz de almacenamiento + motor en memoria
+#
+# core.py habla con un Repositorio. En producción es PostgresRepo (core.py);
+# con CITAS_BACKEND=memoria se usa MemoriaRepo, que no necesita BD y sirve
+# para pruebas y benchmarks de la lógica de agenda.
+import bisect, itertools, threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, Protocol
+import pandas as pd
+from modules.telefonos import a_e164
+
+COLS_PROXIMA = ["id_cita", "fecha", "hora", "servicio", "nota"]
+COLS_DIA = ["id_cita", "fecha", "hora", "paciente_id", "nombre", "telefono", "servicio", "nota", "serie_id",
+            "telefono_e164"]
+COLS_ULTIMA = ["id_cita", "creado_en", "fecha", "hora", "servicio", "nota", "nombre", "telefono"]
+COLS_MANANA = ["id_cita", "fecha", "hora", "servicio", "nota", "paciente_id", "nombre", "telefono", "telefono_e164"]
+COLS_ESPERA = ["id", "desde", "hasta", "hora_min", "hora_max", "servicio"]
+COLS_OFERTA = ["id", "fecha", "hora", "expira_en", "servicio"]
+
+
+class SlotOcupado(Exception):
+    """Ya existe una cita en ese (fecha, hora)."""
+
+
+class TelefonoDuplicado(Exception):
+    """Ya existe un paciente con ese teléfono."""
+
+
+class Repositorio(Protocol):
+    # ---------- Pacientes ----------
+    # tel es el teléfono tal como se guarda (core.normalize_tel); el repositorio
+    # busca y deduplica por su forma canónica (telefonos.a_e164).
+    # Por E.164; si tel no se puede interpretar, el registro viejo con ese teléfono tal cual
+    def paciente_por_telefono(self, tel: str) -> Optional[dict]: ...
+    def registrar_paciente(self, nombre: str, tel: str, pw_hash: str) -> int: ...
+    def crear_o_encontrar_paciente(self, nombre: str, tel: str) -> int: ...
+
+    # ---------- Sesiones ----------
+    def crear_sesion(self, sid: str, paciente_id: int, expira_en: datetime) -> None: ...
+    def sesion_activa(self, sid: str) -> Optional[dict]: ...
+    def revocar_sesion(self, sid: str) -> None: ...
+    def revocar_sesiones_paciente(self, paciente_id: int) -> None: ...
+
+    # ---------- Citas ----------
+    def proxima_cita(self, paciente_id: int) -> pd.DataFrame: ...
+    def cita_en_dia(self, paciente_id: int, fecha: date) -> bool: ...
+    def cita_en_ventana_7dias(self, paciente_id: int, fecha_ref: date) -> bool: ...
+    def horas_ocupadas(self, fecha: date) -> set: ...
+    def insertar_cita(self, fecha: date, hora: time, paciente_id: Optional[int], servicio: str, nota: Optional[str]) -> None: ...
+    def crear_cita_con_paciente(self, fecha: date, hora: time, nombre: str, tel: str, servicio: str, nota: Optional[str]) -> None: ...
+    def actualizar_cita_con_paciente(self, cita_id: int, nombre: str, tel: str, servicio: str, nota: Optional[str]) -> None: ...
+    def citas_por_dia(self, fecha: date) -> pd.DataFrame: ...
+    def actualizar_cita(self, cita_id: int, paciente_id: int, servicio: str, nota: Optional[str]) -> None: ...
+    # Devuelve el (fecha, hora) liberado, o None si la cita no existía
+    def eliminar_cita(self, cita_id: int) -> Optional[tuple[date, time]]: ...
+    def ultima_cita(self) -> pd.DataFrame: ...
+    def citas_manana(self) -> pd.DataFrame: ...
+    # Autoservicio: solo citas del paciente que aún no pasan; None si no hay tal cita
+    def cancelar_cita_paciente(self, cita_id: int, paciente_id: int) -> Optional[tuple[date, time]]: ...
+    # (estado, fecha vieja, hora vieja); estado: "ok" | "dia_cerrado" | "regla_7_dias" | "horario_ocupado"
+    def reprogramar_cita_paciente(self, cita_id: int, paciente_id: int, fecha: date,
+                                  hora: time) -> Optional[tuple[str, date, time]]: ...
+
+    # ---------- Series ----------
+    # estado por fecha: "ok" | "horario_ocupado" | "regla_7_dias"
+    def crear_serie(self, fechas: list[date], hora: time, cada_semanas: int, nombre: str, tel: str,
+                    servicio: str, nota: Optional[str]) -> list[tuple[date, str]]: ...
+    def cancelar_serie_desde(self, serie_id: int, desde: date) -> int: ...
+    def editar_serie_desde(self, serie_id: int, desde: date, hora: time, servicio: str,
+                           nota: Optional[str]) -> list[tuple[date, bool]]: ...
+
+    # ---------- Cierre de días ----------
+    def dias_cerrados(self) -> set: ...
+    def ocupacion(self, desde: date, hasta: date) -> list[tuple[date, time, Optional[int]]]: ...
+    # Cierra el día y mueve las citas [(id, fecha, hora)] todo o nada; devuelve ids movidos
+    def cerrar_dia(self, fecha: date, motivo: Optional[str], movimientos: list[tuple[int, date, time]]) -> list[int]: ...
+    def reabrir_dia(self, fecha: date) -> None: ...
+
+    # ---------- Lista de espera ----------
+    def agregar_espera(self, paciente_id: int, desde: date, hasta: date, hora_min: Optional[time],
+                       hora_max: Optional[time], servicio: str) -> int: ...
+    def esperas_paciente(self, paciente_id: int) -> pd.DataFrame: ...
+    def cancelar_espera(self, espera_id: int, paciente_id: int) -> None: ...
+    # dict con id, paciente_id, nombre, telefono_e164; None si nadie espera ese hueco
+    def crear_oferta(self, fecha: date, hora: time, minutos: int) -> Optional[dict]: ...
+    # Solo cambia ofertas vigentes; devuelve (fecha, hora, paciente_id) o None
+    def marcar_oferta(self, oferta_id: int, estado: str) -> Optional[tuple[date, time, int]]: ...
+    # Marca expiradas las vigentes que ya vencieron; devuelve sus (fecha, hora, paciente_id)
+    def vencer_ofertas(self, limite: int) -> list[tuple[date, time, int]]: ...
+    def ofertas_paciente(self, paciente_id: int) -> pd.DataFrame: ...
+    def aceptar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]: ...
+    # Solo la oferta vigente de ese paciente; devuelve el hueco (fecha, hora) o None
+    def rechazar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]: ...
+
+
+class MemoriaRepo:
+    """Repositorio en memoria con estructuras ordenadas e indexadas por fecha.
+
+    - agenda:        fecha -> {hora: id_cita}
+    - por_paciente:  paciente_id -> lista ordenada de (fecha, hora, id_cita)
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids_pac = itertools.count(1)
+        self._ids_cita = itertools.count(1)
+        self._pacientes: dict[int, dict] = {}
+        self._por_tel: dict[str, int] = {}         # telefono_e164 -> id
+        self._citas: dict[int, dict] = {}          # orden de inserción = orden de creado_en
+        self._agenda: dict[date, dict[time, int]] = {}
+        self._por_paciente: dict[int, list[tuple[date, time, int]]] = {}
+        self._sesiones: dict[str, dict] = {}
+        self._ids_serie = itertools.count(1)
+        self._series: dict[int, dict] = {}
+        self._cerrados: dict[date, Optional[str]] = {}
+        self._cerrados_set: frozenset = frozenset()   # se reemplaza al escribir; leer no toma el lock
+        self._ids_espera = itertools.count(1)
+        self._esperas: dict[int, dict] = {}
+        self._espera_por_dia: dict[date, list[int]] = {}   # fecha -> ids en orden de alta
+        self._ids_oferta = itertools.count(1)
+        self._ofertas: dict[int, dict] = {}
+
+    # ---------- Pacientes ----------
+    def paciente_por_telefono(self, tel: str) -> Optional[dict]:
+        e164 = a_e164(tel)
+        with self._lock:
+            if e164 is None:
+                return next((dict(p) for p in self._pacientes.values()
+                             if p["telefono"] == tel and p["telefono_e164"] is None), None)
+            pid = self._por_tel.get(e164)
+            return dict(self._pacientes[pid]) if pid is not None else None
+
+    def _nuevo_paciente(self, nombre: str, tel: str, pw_hash: Optional[str]) -> int:
+        pid = next(self._ids_pac)
+        e164 = a_e164(tel)
+        self._pacientes[pid] = {"id": pid, "nombre": nombre, "telefono": tel, "telefono_e164": e164,
+                                "password_hash": pw_hash, "creado_en": datetime.now()}
+        if e164:
+            self._por_tel[e164] = pid
+        return pid
+
+    def registrar_paciente(self, nombre: str, tel: str, pw_hash: str) -> int:
+        with self._lock:
+            if a_e164(tel) in self._por_tel:
+                raise TelefonoDuplicado(tel)
+            return self._nuevo_paciente(nombre, tel, pw_hash)
+
+    def crear_o_encontrar_paciente(self, nombre: str, tel: str) -> int:
+        with self._lock:
+            pid = self._por_tel.get(a_e164(tel))
+            return pid if pid is not None else self._nuevo_paciente(nombre, tel, None)
+
+    # ---------- Sesiones ----------
+    def crear_sesion(self, sid: str, paciente_id: int, expira_en: datetime) -> None:
+        with self._lock:
+            self._sesiones[sid] = {"paciente_id": paciente_id, "expira_en": expira_en, "revocada": False}
+
+    def sesion_activa(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            s = self._sesiones.get(sid)
+            if not s or s["revocada"] or s["expira_en"] <= datetime.now():
+                return None
+            p = self._pacientes[s["paciente_id"]]
+            return {"id": p["id"], "nombre": p["nombre"], "telefono": p["telefono"]}
+
+    def revocar_sesion(self, sid: str) -> None:
+        with self._lock:
+            if sid in self._sesiones:
+                self._sesiones[sid]["revocada"] = True
+
+    def revocar_sesiones_paciente(self, paciente_id: int) -> None:
+        with self._lock:
+            for s in self._sesiones.values():
+                if s["paciente_id"] == paciente_id:
+                    s["revocada"] = True
+
+    # ---------- Citas ----------
+    def _fila(self, cid: int, cols: list[str]) -> dict:
+        c = self._citas[cid]
+        p = self._pacientes.get(c["paciente_id"]) or {}
+        fila = {**c, "id_cita": cid, "nombre": p.get("nombre"), "telefono": p.get("telefono"),
+                "telefono_e164": p.get("telefono_e164")}
+        return {k: fila.get(k) for k in cols}
+
+    def proxima_cita(self, paciente_id: int) -> pd.DataFrame:
+        ahora = datetime.now()
+        with self._lock:
+            lst = self._por_paciente.get(paciente_id, [])
+            i = bisect.bisect_left(lst, (ahora.date(), ahora.time()))
+            rows = [self._fila(lst[i][2], COLS_PROXIMA)] if i < len(lst) else []
+        return pd.DataFrame(rows, columns=COLS_PROXIMA)
+
+    def _hay_entre(self, paciente_id: int, desde: date, hasta: date) -> bool:
+        lst = self._por_paciente.get(paciente_id, [])
+        i = bisect.bisect_left(lst, (desde,))
+        return i < len(lst) and lst[i][0] <= hasta
+
+    def cita_en_dia(self, paciente_id: int, fecha: date) -> bool:
+        with self._lock:
+            return self._hay_entre(paciente_id, fecha, fecha)
+
+    def cita_en_ventana_7dias(self, paciente_id: int, fecha_ref: date) -> bool:
+        with self._lock:
+            return self._hay_entre(paciente_id, fecha_ref - timedelta(days=6), fecha_ref + timedelta(days=6))
+
+    def horas_ocupadas(self, fecha: date) -> set:
+        with self._lock:
+            return set(self._agenda.get(fecha, ()))
+
+    def insertar_cita(self, fecha: date, hora: time, paciente_id: Optional[int], servicio: str, nota: Optional[str],
+                      serie_id: Optional[int] = None) -> None:
+        with self._lock:
+            dia = self._agenda.setdefault(fecha, {})
+            if hora in dia:
+                raise SlotOcupado((fecha, hora))
+            cid = next(self._ids_cita)
+            self._citas[cid] = {"fecha": fecha, "hora": hora, "paciente_id": paciente_id,
+                                "servicio": servicio, "nota": nota, "serie_id": serie_id,
+                                "creado_en": datetime.now()}
+            dia[hora] = cid
+            if paciente_id is not None:
+                bisect.insort(self._por_paciente.setdefault(paciente_id, []), (fecha, hora, cid))
+
+    def crear_cita_con_paciente(self, fecha: date, hora: time, nombre: str, tel: str, servicio: str, nota: Optional[str]) -> None:
+        with self._lock:
+            if hora in self._agenda.get(fecha, {}):
+                raise SlotOcupado((fecha, hora))
+            self.insertar_cita(fecha, hora, self.crear_o_encontrar_paciente(nombre, tel), servicio, nota)
+
+    def actualizar_cita_con_paciente(self, cita_id: int, nombre: str, tel: str, servicio: str, nota: Optional[str]) -> None:
+        with self._lock:
+            if cita_id in self._citas:
+                self.actualizar_cita(cita_id, self.crear_o_encontrar_paciente(nombre, tel), servicio, nota)
+
+    def citas_por_dia(self, fecha: date) -> pd.DataFrame:
+        with self._lock:
+            dia = self._agenda.get(fecha, {})
+            rows = [self._fila(dia[h], COLS_DIA) for h in sorted(dia)]
+        return pd.DataFrame(rows, columns=COLS_DIA)
+
+    def _quitar_de_paciente(self, cid: int):
+        c = self._citas[cid]
+        lst = self._por_paciente.get(c["paciente_id"])
+        if lst:
+            i = bisect.bisect_left(lst, (c["fecha"], c["hora"], cid))
+            if i < len(lst) and lst[i][2] == cid:
+                lst.pop(i)
+
+    def actualizar_cita(self, cita_id: int, paciente_id: int, servicio: str, nota: Optional[str]) -> None:
+        with self._lock:
+            c = self._citas.get(cita_id)
+            if c is None:
+                return
+            if c["paciente_id"] != paciente_id:
+                self._quitar_de_paciente(cita_id)
+                bisect.insort(self._por_paciente.setdefault(paciente_id, []), (c["fecha"], c["hora"], cita_id))
+            c.update(paciente_id=paciente_id, servicio=servicio, nota=nota)
+
+    def _mover(self, cid: int, fecha: date, hora: time):
+        c = self._citas[cid]
+        self._quitar_de_paciente(cid)
+        dia = self._agenda[c["fecha"]]
+        del dia[c["hora"]]
+        if not dia:
+            del self._agenda[c["fecha"]]
+        self._agenda.setdefault(fecha, {})[hora] = cid
+        c.update(fecha=fecha, hora=hora)
+        if c["paciente_id"] is not None:
+            bisect.insort(self._por_paciente.setdefault(c["paciente_id"], []), (fecha, hora, cid))
+
+    def eliminar_cita(self, cita_id: int) -> Optional[tuple[date, time]]:
+        with self._lock:
+            if cita_id not in self._citas:
+                return None
+            self._quitar_de_paciente(cita_id)
+            c = self._citas.pop(cita_id)
+            dia = self._agenda.get(c["fecha"], {})
+            dia.pop(c["hora"], None)
+            if not dia:
+                self._agenda.pop(c["fecha"], None)
+            return c["fecha"], c["hora"]
+
+    def ultima_cita(self) -> pd.DataFrame:
+        with self._lock:
+            rows = [self._fila(next(reversed(self._citas)), COLS_ULTIMA)] if self._citas else []
+        return pd.DataFrame(rows, columns=COLS_ULTIMA)
+
+    def citas_manana(self) -> pd.DataFrame:
+        manana = date.today() + timedelta(days=1)
+        with self._lock:
+            dia = self._agenda.get(manana, {})
+            rows = [self._fila(dia[h], COLS_MANANA) for h in sorted(dia)
+                    if self._citas[dia[h]]["paciente_id"] is not None]
+        return pd.DataFrame(rows, columns=COLS_MANANA)
+
+    def _de_paciente_pendiente(self, cita_id: int, paciente_id: int) -> Optional[dict]:
+        c = self._citas.get(cita_id)
+        ahora = datetime.now()
+        if c is None or c["paciente_id"] != paciente_id or (c["fecha"], c["hora"]) <= (ahora.date(), ahora.time()):
+            return None
+        return c
+
+    def cancelar_cita_paciente(self, cita_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        with self._lock:
+            if self._de_paciente_pendiente(cita_id, paciente_id) is None:
+                return None
+            return self.eliminar_cita(cita_id)
+
+    def reprogramar_cita_paciente(self, cita_id: int, paciente_id: int, fecha: date,
+                                  hora: time) -> Optional[tuple[str, date, time]]:
+        with self._lock:
+            c = self._de_paciente_pendiente(cita_id, paciente_id)
+            if c is None:
+                return None
+            antes = c["fecha"], c["hora"]
+            lst = self._por_paciente.get(paciente_id, [])
+            i = bisect.bisect_left(lst, (fecha - timedelta(days=6),))
+            hasta = fecha + timedelta(days=6)
+            en_ventana = itertools.takewhile(lambda x: x[0] <= hasta, itertools.islice(lst, i, None))
+            if fecha in self._cerrados:
+                return "dia_cerrado", *antes
+            if any(cid != cita_id for _, _, cid in en_ventana):
+                return "regla_7_dias", *antes
+            if hora in self._agenda.get(fecha, {}):
+                return "horario_ocupado", *antes
+            self._mover(cita_id, fecha, hora)
+            return "ok", *antes
+
+    # ---------- Series ----------
+    def _de_serie(self, serie_id: int, desde: date) -> list[int]:
+        return sorted((cid for cid, c in self._citas.items()
+                       if c.get("serie_id") == serie_id and c["fecha"] >= desde),
+                      key=lambda cid: self._citas[cid]["fecha"])
+
+    def crear_serie(self, fechas: list[date], hora: time, cada_semanas: int, nombre: str, tel: str,
+                    servicio: str, nota: Optional[str]) -> list[tuple[date, str]]:
+        with self._lock:
+            pid = self.crear_o_encontrar_paciente(nombre, tel)
+            sid = next(self._ids_serie)
+            self._series[sid] = {"paciente_id": pid, "hora": hora, "cada_semanas": cada_semanas,
+                                 "desde": min(fechas), "hasta": max(fechas),
+                                 "servicio": servicio, "nota": nota}
+            # Se revisa contra el estado previo, igual que la sentencia única de Postgres
+            estados = []
+            for f in fechas:
+                if hora in self._agenda.get(f, {}):
+                    estados.append((f, "horario_ocupado"))
+                elif self._hay_entre(pid, f - timedelta(days=6), f + timedelta(days=6)):
+                    estados.append((f, "regla_7_dias"))
+                else:
+                    estados.append((f, "ok"))
+            for f, e in estados:
+                if e == "ok":
+                    self.insertar_cita(f, hora, pid, servicio, nota, serie_id=sid)
+            return estados
+
+    def cancelar_serie_desde(self, serie_id: int, desde: date) -> int:
+        with self._lock:
+            if serie_id in self._series:
+                self._series[serie_id]["hasta"] = desde - timedelta(days=1)
+            ids = self._de_serie(serie_id, desde)
+            for cid in ids:
+                self.eliminar_cita(cid)
+            return len(ids)
+
+    def editar_serie_desde(self, serie_id: int, desde: date, hora: time, servicio: str,
+                           nota: Optional[str]) -> list[tuple[date, bool]]:
+        with self._lock:
+            if serie_id in self._series:
+                self._series[serie_id].update(hora=hora, servicio=servicio, nota=nota)
+            res = []
+            for cid in self._de_serie(serie_id, desde):
+                c = self._citas[cid]
+                movida = c["hora"] == hora or hora not in self._agenda.get(c["fecha"], {})
+                if movida:
+                    if c["hora"] != hora:
+                        self._mover(cid, c["fecha"], hora)
+                    c.update(servicio=servicio, nota=nota)
+                res.append((c["fecha"], movida))
+            return res
+
+    # ---------- Cierre de días ----------
+    def dias_cerrados(self) -> set:
+        return self._cerrados_set
+
+    def ocupacion(self, desde: date, hasta: date) -> list[tuple[date, time, Optional[int]]]:
+        with self._lock:
+            return [(f, h, self._citas[cid]["paciente_id"])
+                    for f, dia in self._agenda.items() if desde <= f <= hasta
+                    for h, cid in dia.items()]
+
+    def cerrar_dia(self, fecha: date, motivo: Optional[str], movimientos: list[tuple[int, date, time]]) -> list[int]:
+        with self._lock:
+            for _, f, h in movimientos:
+                if h in self._agenda.get(f, {}):
+                    raise SlotOcupado((f, h))
+            self._cerrados[fecha] = motivo
+            self._cerrados_set = frozenset(self._cerrados)
+            movidas = []
+            for cid, f, h in movimientos:
+                if cid in self._citas and self._citas[cid]["fecha"] == fecha:
+                    self._mover(cid, f, h)
+                    movidas.append(cid)
+            return movidas
+
+    def reabrir_dia(self, fecha: date) -> None:
+        with self._lock:
+            self._cerrados.pop(fecha, None)
+            self._cerrados_set = frozenset(self._cerrados)
+
+    # ---------- Lista de espera ----------
+    def agregar_espera(self, paciente_id: int, desde: date, hasta: date, hora_min: Optional[time],
+                       hora_max: Optional[time], servicio: str) -> int:
+        with self._lock:
+            eid = next(self._ids_espera)
+            self._esperas[eid] = {"id": eid, "paciente_id": paciente_id, "desde": desde, "hasta": hasta,
+                                  "hora_min": hora_min, "hora_max": hora_max, "servicio": servicio,
+                                  "atendida": False}
+            for i in range((hasta - desde).days + 1):
+                self._espera_por_dia.setdefault(desde + timedelta(days=i), []).append(eid)
+            return eid
+
+    def esperas_paciente(self, paciente_id: int) -> pd.DataFrame:
+        hoy = date.today()
+        with self._lock:
+            rows = [{k: e[k] for k in COLS_ESPERA} for e in self._esperas.values()
+                    if e["paciente_id"] == paciente_id and not e["atendida"] and e["hasta"] >= hoy]
+        return pd.DataFrame(sorted(rows, key=lambda r: (r["desde"], r["id"])), columns=COLS_ESPERA)
+
+    def cancelar_espera(self, espera_id: int, paciente_id: int) -> None:
+        with self._lock:
+            e = self._esperas.get(espera_id)
+            if e and e["paciente_id"] == paciente_id:
+                # el índice por día se limpia solo: los ids borrados se saltan
+                del self._esperas[espera_id]
+                self._ofertas = {k: o for k, o in self._ofertas.items() if o["espera_id"] != espera_id}
+
+    def _oferta_vigente(self, o: dict) -> bool:
+        return o["estado"] in ("pendiente", "enviada") and o["expira_en"] > datetime.now(timezone.utc)
+
+    def crear_oferta(self, fecha: date, hora: time, minutos: int) -> Optional[dict]:
+        with self._lock:
+            if hora in self._agenda.get(fecha, {}):
+                return None
+            for eid in self._espera_por_dia.get(fecha, ()):
+                e = self._esperas.get(eid)
+                if e is None or e["atendida"]:
+                    continue
+                if (e["hora_min"] and hora < e["hora_min"]) or (e["hora_max"] and hora > e["hora_max"]):
+                    continue
+                if self._hay_entre(e["paciente_id"], fecha - timedelta(days=6), fecha + timedelta(days=6)):
+                    continue
+                if any((o["espera_id"] == eid and (o["fecha"], o["hora"]) == (fecha, hora))
+                       or (o["paciente_id"] == e["paciente_id"] and self._oferta_vigente(o))
+                       for o in self._ofertas.values()):
+                    continue
+                oid = next(self._ids_oferta)
+                self._ofertas[oid] = {"espera_id": eid, "paciente_id": e["paciente_id"], "fecha": fecha,
+                                      "hora": hora, "estado": "pendiente",
+                                      "expira_en": datetime.now(timezone.utc) + timedelta(minutes=minutos)}
+                p = self._pacientes[e["paciente_id"]]
+                return {"id": oid, "paciente_id": p["id"], "nombre": p["nombre"], "telefono_e164": p["telefono_e164"]}
+            return None
+
+    def marcar_oferta(self, oferta_id: int, estado: str) -> Optional[tuple[date, time, int]]:
+        with self._lock:
+            o = self._ofertas.get(oferta_id)
+            if not o or o["estado"] not in ("pendiente", "enviada"):
+                return None
+            o["estado"] = estado
+            return o["fecha"], o["hora"], o["paciente_id"]
+
+    def vencer_ofertas(self, limite: int) -> list[tuple[date, time, int]]:
+        with self._lock:
+            ahora = datetime.now(timezone.utc)
+            vencidas = sorted((o for o in self._ofertas.values()
+                               if o["estado"] in ("pendiente", "enviada") and o["expira_en"] <= ahora),
+                              key=lambda o: o["expira_en"])[:limite]
+            for o in vencidas:
+                o["estado"] = "expirada"
+            return [(o["fecha"], o["hora"], o["paciente_id"]) for o in vencidas]
+
+    def ofertas_paciente(self, paciente_id: int) -> pd.DataFrame:
+        with self._lock:
+            rows = [{"id": k, "fecha": o["fecha"], "hora": o["hora"], "expira_en": o["expira_en"],
+                     "servicio": self._esperas[o["espera_id"]]["servicio"]}
+                    for k, o in self._ofertas.items()
+                    if o["paciente_id"] == paciente_id and self._oferta_vigente(o)]
+        return pd.DataFrame(sorted(rows, key=lambda r: (r["fecha"], r["hora"])), columns=COLS_OFERTA)
+
+    def aceptar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        with self._lock:
+            o = self._ofertas.get(oferta_id)
+            if not o or o["paciente_id"] != paciente_id or not self._oferta_vigente(o):
+                return None
+            if self._hay_entre(paciente_id, o["fecha"] - timedelta(days=6), o["fecha"] + timedelta(days=6)):
+                return None
+            e = self._esperas[o["espera_id"]]
+            self.insertar_cita(o["fecha"], o["hora"], paciente_id, e["servicio"], None)   # SlotOcupado si ya se tomó
+            o["estado"] = "aceptada"
+            e["atendida"] = True
+            return o["fecha"], o["hora"]
+
+    def rechazar_oferta(self, oferta_id: int, paciente_id: int) -> Optional[tuple[date, time]]:
+        with self._lock:
+            o = self._ofertas.get(oferta_id)
+            if not o or o["paciente_id"] != paciente_id or o["estado"] not in ("pendiente", "enviada"):
+                return None
+            o["estado"] = "rechazada"
+            return o["fecha"], o["hora"]
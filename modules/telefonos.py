@@ -0,0 +1,148 @@
+# modules/telefonos.py — Teléfono canónico E.164 + migración de la columna
+#
+# pacientes.telefono guarda lo que escribió la persona (sin espacios/guiones);
+# pacientes.telefono_e164 es la forma canónica, se calcula al escribir y tiene
+# índice único: "351 123 4567", "3511234567" y "+52 351 123 4567" son el mismo
+# paciente. Búsquedas, altas y recordatorios usan la columna canónica; los
+# registros viejos cuyo teléfono no se pudo interpretar se quedan con
+# telefono_e164 NULL (la migración los lista) y entran con el teléfono tal cual.
+#
+#   python -m modules.telefonos --url $NEON_DATABASE_URL [--lote 1000]
+#
+# La migración (rellenar la columna en lotes, fusionar duplicados y crear el
+# índice único) también corre sola al arrancar la app si el índice no existe.
+import argparse, re, sys
+from typing import Optional
+import psycopg
+from modules.consultas import INDICE_E164_SQL
+
+_NO_DIGITOS = re.compile(r"\D+")
+
+
+def a_e164(tel: Optional[str]) -> Optional[str]:
+    """Forma canónica E.164 (MX por defecto) o None si no se puede interpretar."""
+    if not tel:
+        return None
+    crudo = str(tel).strip()
+    t = _NO_DIGITOS.sub("", crudo)
+    if crudo.startswith("00"):
+        crudo, t = "+", t[2:]
+    if crudo.startswith("+") or (len(t) in (12, 13) and t.startswith("52")):
+        if t.startswith("521") and len(t) == 13:   # prefijo móvil antiguo de MX
+            t = "52" + t[3:]
+        return f"+{t}" if 8 <= len(t) <= 15 else None
+    if len(t) == 10:
+        return f"+52{t}"
+    return None
+
+
+# Por lote: (ids, telefonos) -> se calcula en Python y se escribe en un UPDATE
+_LOTE_SQL = """
+    SELECT id, telefono FROM pacientes
+    WHERE telefono_e164 IS NULL AND id > %s ORDER BY id LIMIT %s
+"""
+_ESCRIBIR_SQL = """
+    UPDATE pacientes p SET telefono_e164 = v.e164
+    FROM unnest(%s::int[], %s::text[]) AS v(id, e164)
+    WHERE p.id = v.id
+"""
+
+# Se queda el registro con contraseña y, entre iguales, el más antiguo; sus
+# citas, sesiones, series y lista de espera pasan al que se queda.
+_FUSION_SQL = [
+    """
+    CREATE TEMP TABLE fusion ON COMMIT DROP AS
+    SELECT id, queda FROM (
+      SELECT id, first_value(id) OVER (PARTITION BY telefono_e164
+                                       ORDER BY password_hash IS NULL, id) AS queda
+      FROM pacientes WHERE telefono_e164 IS NOT NULL
+    ) d WHERE id <> queda
+    """,
+    "UPDATE citas t SET paciente_id = f.queda FROM fusion f WHERE t.paciente_id = f.id",
+    "UPDATE series t SET paciente_id = f.queda FROM fusion f WHERE t.paciente_id = f.id",
+    "UPDATE sesiones t SET paciente_id = f.queda FROM fusion f WHERE t.paciente_id = f.id",
+    "UPDATE lista_espera t SET paciente_id = f.queda FROM fusion f WHERE t.paciente_id = f.id",
+    "UPDATE ofertas t SET paciente_id = f.queda FROM fusion f WHERE t.paciente_id = f.id",
+    "DELETE FROM pacientes p USING fusion f WHERE p.id = f.id",
+]
+
+
+def rellenar(c: psycopg.Connection, lote: int = 1000) -> dict:
+    """Calcula telefono_e164 donde falta, en lotes (cada lote es su propia transacción).
+
+    ids_sin_e164: pacientes cuyo teléfono no se pudo interpretar; se quedan en NULL.
+    """
+    res = {"actualizados": 0, "sin_e164": 0, "ids_sin_e164": []}
+    ultimo = 0
+    while True:
+        filas = c.execute(_LOTE_SQL, (ultimo, lote)).fetchall()
+        if not filas:
+            return res
+        ultimo = filas[-1][0]
+        pares = [(pid, a_e164(tel)) for pid, tel in filas]
+        validos = [(pid, e) for pid, e in pares if e]
+        res["ids_sin_e164"] += [pid for pid, e in pares if not e]
+        res["sin_e164"] = len(res["ids_sin_e164"])
+        if validos:
+            with c.transaction():
+                c.execute(_ESCRIBIR_SQL, ([p for p, _ in validos], [e for _, e in validos]))
+            res["actualizados"] += len(validos)
+
+
+def fusionar(c: psycopg.Connection) -> int:
+    """Une pacientes con el mismo telefono_e164. Devuelve cuántos se eliminaron."""
+    with c.transaction():
+        for q in _FUSION_SQL[:-1]:
+            c.execute(q)
+        return c.execute(_FUSION_SQL[-1]).rowcount
+
+
+def _indice_listo(c: psycopg.Connection) -> bool:
+    fila = c.execute(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('idx_pacientes_e164')"
+    ).fetchone()
+    if fila and not fila[0]:
+        # un CREATE INDEX CONCURRENTLY que falló deja el índice inválido
+        c.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_pacientes_e164")
+    return bool(fila and fila[0])
+
+
+def migrar(c: psycopg.Connection, lote: int = 1000) -> Optional[dict]:
+    """Rellena, fusiona y crea el índice único. No hace nada si el índice ya existe.
+
+    Necesita una conexión en autocommit (CREATE INDEX CONCURRENTLY).
+    """
+    if _indice_listo(c):
+        return None
+    # Una sola réplica migra; las demás esperan aquí y luego ven el índice
+    c.execute("SELECT pg_advisory_lock(hashtext('migrar_e164'))")
+    try:
+        if _indice_listo(c):
+            return None
+        res = rellenar(c, lote)
+        res["fusionados"] = fusionar(c)
+        c.execute(INDICE_E164_SQL)
+        return res
+    finally:
+        c.execute("SELECT pg_advisory_unlock(hashtext('migrar_e164'))")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Rellena pacientes.telefono_e164, fusiona duplicados y crea el índice único")
+    ap.add_argument("--url", required=True)
+    ap.add_argument("--lote", type=int, default=1000)
+    args = ap.parse_args(argv)
+    with psycopg.connect(args.url, autocommit=True) as c:
+        res = migrar(c, args.lote)
+    if res is None:
+        print("El índice ya existía; nada que hacer.")
+        return 0
+    print(f"actualizados: {res['actualizados']}  fusionados: {res['fusionados']}")
+    if res["sin_e164"]:
+        print(f"{res['sin_e164']} pacientes con un teléfono que no se pudo interpretar (siguen sin "
+              f"telefono_e164; corrígelos a mano): ids {', '.join(map(str, res['ids_sin_e164']))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
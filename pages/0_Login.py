@@ -1,5 +1,6 @@
 import streamlit as st
-from modules.core import is_admin_ok, login_paciente, registrar_paciente, normalize_tel, ADMIN_USER
+from modules.core import is_admin_ok, login_paciente, registrar_paciente, normalize_tel, admin_usuario, salon_actual, ip_cliente
+from modules.sesiones import recordar_sesion
 import base64
 from urllib.parse import quote_plus
 
@@ -32,12 +33,15 @@ def load_b64(path: str) -> str:
         return base64.b64encode(f.read()).decode()
 
 logo_base64 = load_b64("assets/Logo.png")
+salon = salon_actual()
+bienvenida = ("Bienvenida/o al salón de belleza." if salon.principal else f"Bienvenida/o a {salon.nombre}.") \
+    + " Elige cómo quieres entrar."
 
 st.markdown(
     f"""
     <div style="text-align: center;">
         <img src="data:image/png;base64,{logo_base64}" width="300">
-        <p>Bienvenida/o al salón de belleza. Elige cómo quieres entrar.</p>
+        <p>{bienvenida}</p>
     </div>
     """,
     unsafe_allow_html=True
@@ -65,15 +69,20 @@ tab_coach, tab_pac, tab_social = st.tabs(["👩‍💼 Dueña", "💅 Cliente",
 with tab_coach:
     st.subheader("Acceso de administradora")
     with st.form("form_admin"):
-        st.text_input("Usuario", value=(ADMIN_USER or "admin"), disabled=True)
+        st.text_input("Usuario", value=(admin_usuario() or "admin"), disabled=True)
         p = st.text_input("Contraseña", type="password")
         ok = st.form_submit_button("Entrar como administradora")
     if ok:
-        if p and is_admin_ok((ADMIN_USER or "admin"), p):
-            st.session_state.role = "admin"
-            st.rerun()
+        try:
+            admin_ok = bool(p) and is_admin_ok((admin_usuario() or "admin"), p, ip=ip_cliente())
+        except ValueError as e:
+            st.error(str(e))
         else:
-            st.error("Credenciales inválidas.")
+            if admin_ok:
+                st.session_state.role = "admin"
+                st.rerun()
+            else:
+                st.error("Credenciales inválidas.")
 
 # ---- Paciente
 with tab_pac:
@@ -86,13 +95,18 @@ with tab_pac:
             pw  = st.text_input("Contraseña", type="password")
             ok  = st.form_submit_button("Entrar")
         if ok:
-            user = login_paciente(tel, pw)
-            if user:
-                st.session_state.role = "paciente"
-                st.session_state.paciente = user
-                st.rerun()
+            try:
+                user = login_paciente(tel, pw, ip=ip_cliente())
+            except ValueError as e:
+                st.error(str(e))
             else:
-                st.error("Teléfono o contraseña incorrectos.")
+                if user:
+                    st.session_state.role = "paciente"
+                    st.session_state.paciente = user
+                    recordar_sesion(user)
+                    st.rerun()
+                else:
+                    st.error("Teléfono o contraseña incorrectos.")
     else:
         with st.form("form_reg"):
             nombre = st.text_input("Nombre completo")
@@ -112,6 +126,7 @@ with tab_pac:
                     st.session_state.paciente = {
                         "id": pid, "nombre": nombre.strip(), "telefono": normalize_tel(tel)
                     }
+                    recordar_sesion(st.session_state.paciente)
                     st.rerun()
                 except ValueError as e:
                     st.error(str(e))
@@ -1,9 +1,14 @@
 import streamlit as st
 from datetime import date, datetime, timedelta
+import pandas as pd
 from modules.core import (
     generar_slots, slots_ocupados, agendar_cita_autenticado,
-    proxima_cita_paciente, is_fecha_permitida, BLOQUEO_DIAS_MIN
+    proxima_cita_paciente, is_fecha_permitida, BLOQUEO_DIAS_MIN,
+    unirse_lista_espera, esperas_paciente, salir_lista_espera,
+    ofertas_paciente, aceptar_oferta, rechazar_oferta, feed_paciente, servicios,
+    cancelar_cita_paciente, reprogramar_cita
 )
+from modules.sesiones import cerrar_sesion
 
 st.set_page_config(page_title="Cliente — Agenda", page_icon="💅", layout="wide")
 
@@ -110,10 +115,29 @@ if st.session_state.get("role") != "paciente" or not st.session_state.get("pacie
 p = st.session_state.paciente
 pid = int(p["id"])
 
-SERVICIOS = ["Corte", "Coloración", "Manicure", "Pedicure", "Peinado", "Tratamiento capilar", "Maquillaje", "Depilación"]
+SERVICIOS = servicios()
+min_day = date.today() + timedelta(days=BLOQUEO_DIAS_MIN)
 
 st.title(f"👋 Hola, {p['nombre']}")
 
+# --- Ofertas de la lista de espera
+for _, o in ofertas_paciente(pid).iterrows():
+    oid = int(o["id"])
+    st.warning(f"🎉 Se liberó un horario para ti: **{o['fecha'].strftime('%d-%m-%Y')}** a las "
+               f"**{str(o['hora'])[:5]}** ({o.get('servicio') or 'sin servicio'}). "
+               f"Válido hasta las {o['expira_en'].strftime('%H:%M')}.")
+    ca, cr = st.columns(2)
+    if ca.button("✅ Lo quiero", key=f"aceptar_{oid}"):
+        try:
+            aceptar_oferta(oid, pid)
+            st.success("¡Cita agendada! ✨")
+            st.rerun()
+        except ValueError as e:
+            st.error(str(e))
+    if cr.button("No, gracias", key=f"rechazar_{oid}"):
+        rechazar_oferta(oid, pid)
+        st.rerun()
+
 # --- Próxima cita
 st.subheader("📌 Tu próxima cita programada")
 next_df = proxima_cita_paciente(pid)
@@ -122,11 +146,40 @@ if next_df.empty:
 else:
     r = next_df.iloc[0]
     st.success(f"**Fecha:** {r['fecha']} — **Hora:** {str(r['hora'])[:5]}  \n**Servicio:** {r.get('servicio') or '—'}  \n**Nota:** {r.get('nota') or '—'}")
+    cita_id = int(r["id_cita"])
+    with st.expander("✏️ Cambiar o cancelar esta cita"):
+        nueva_f = st.date_input("Nuevo día", value=min_day, min_value=min_day, key="cambio_fecha")
+        libres_c = [t for t in generar_slots(nueva_f) if t not in slots_ocupados(nueva_f)]
+        nueva_h = st.selectbox("Nuevo horario", [t.strftime("%H:%M") for t in libres_c],
+                               key="cambio_hora") if libres_c else None
+        if not libres_c:
+            st.warning("No hay horarios libres en este día.")
+        if st.button("🔁 Cambiar a este horario", disabled=(nueva_h is None)):
+            try:
+                reprogramar_cita(cita_id, pid, nueva_f, datetime.strptime(nueva_h, "%H:%M").time())
+                st.success("¡Listo! Tu cita cambió. ✨")
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+        st.divider()
+        confirm_c = st.checkbox("Sí, quiero cancelar mi cita", key="confirm_cancelar")
+        if st.button("🗑️ Cancelar cita", disabled=not confirm_c):
+            if cancelar_cita_paciente(cita_id, pid):
+                st.success("Cita cancelada.")
+                st.rerun()
+            else:
+                st.error("Esa cita ya no se puede cancelar.")
+
+url_ics = feed_paciente(pid)
+if url_ics:
+    with st.expander("📲 Ver mis citas en el calendario del teléfono"):
+        st.link_button("Suscribirme", "webcal://" + url_ics.split("://", 1)[-1])
+        st.caption("O copia este enlace en Google Calendar (Otros calendarios → Desde URL). Es personal: no lo compartas.")
+        st.code(url_ics, language=None)
 
 # --- Agendar
 st.subheader("📅 Agendar nueva cita")
 servicio = st.selectbox("Tipo de servicio", SERVICIOS)
-min_day = date.today() + timedelta(days=BLOQUEO_DIAS_MIN)
 fecha = st.date_input("Día (disponible desde el tercer día)", value=min_day, min_value=min_day)
 
 if not is_fecha_permitida(fecha):
@@ -135,7 +188,7 @@ else:
     libres = [t for t in generar_slots(fecha) if t not in slots_ocupados(fecha)]
     slot = st.selectbox("Horario", [t.strftime("%H:%M") for t in libres]) if libres else None
     if not libres:
-        st.warning("No hay horarios libres en este día.")
+        st.warning("No hay horarios libres en este día. Puedes anotarte en la lista de espera (abajo).")
 
     nota = st.text_area("Motivo/nota (opcional)")
     if st.button("Confirmar cita", disabled=(slot is None)):
@@ -147,9 +200,37 @@ else:
         except Exception as e:
             st.error(str(e))
 
+# --- Lista de espera
+st.subheader("⏳ Lista de espera")
+st.caption("Si se libera un horario en tus fechas, te lo ofrecemos por WhatsApp.")
+horas = sorted({t for d in range(7) for t in generar_slots(min_day + timedelta(days=d))})
+with st.form("form_espera"):
+    c1, c2 = st.columns(2)
+    desde = c1.date_input("Desde", value=min_day, min_value=date.today() + timedelta(days=1), key="espera_desde")
+    hasta = c2.date_input("Hasta", value=min_day + timedelta(days=14), min_value=date.today() + timedelta(days=1), key="espera_hasta")
+    c3, c4 = st.columns(2)
+    hmin = c3.selectbox("Desde la hora", ["Cualquiera"] + [t.strftime("%H:%M") for t in horas], key="espera_hmin")
+    hmax = c4.selectbox("Hasta la hora", ["Cualquiera"] + [t.strftime("%H:%M") for t in horas], key="espera_hmax")
+    servicio_e = st.selectbox("Servicio", SERVICIOS, key="espera_servicio")
+    if st.form_submit_button("Anotarme"):
+        _h = lambda v: None if v == "Cualquiera" else datetime.strptime(v, "%H:%M").time()
+        try:
+            unirse_lista_espera(pid, desde, hasta, servicio_e, _h(hmin), _h(hmax))
+            st.success("Listo, te avisaremos si se libera un horario.")
+        except ValueError as e:
+            st.error(str(e))
+
+for _, e in esperas_paciente(pid).iterrows():
+    rango = "" if pd.isna(e["hora_min"]) and pd.isna(e["hora_max"]) else \
+        f" • {str(e['hora_min'])[:5] if pd.notna(e['hora_min']) else '…'}–{str(e['hora_max'])[:5] if pd.notna(e['hora_max']) else '…'}"
+    ce, cb = st.columns([4, 1])
+    ce.write(f"{e['desde'].strftime('%d-%m-%Y')} a {e['hasta'].strftime('%d-%m-%Y')}{rango} • {e['servicio'] or '—'}")
+    if cb.button("Salir", key=f"salir_espera_{int(e['id'])}"):
+        salir_lista_espera(int(e["id"]), pid)
+        st.rerun()
+
 st.divider()
 if st.button("🚪 Cerrar sesión"):
-    st.session_state.role = None
-    st.session_state.paciente = None
+    cerrar_sesion()
     st.rerun()
 
@@ -3,8 +3,14 @@ from datetime import date, datetime
 import pandas as pd
 from modules.core import (
     generar_slots, crear_cita_manual, citas_por_dia,
-    actualizar_cita, eliminar_cita, ultima_cita_agendada
+    actualizar_cita, eliminar_cita, ultima_cita_agendada, enviar_recordatorios_manana,
+    crear_serie, cancelar_serie_desde, editar_serie_desde, SERIE_MAX,
+    dia_cerrado, planear_cierre, cerrar_dia, reabrir_dia, notificar_reprogramadas, CIERRE_DIAS_MAX,
+    feed_agenda, servicios, uso_conexiones,
+    revision_disponible, revisar_reglas, ultima_revision, hallazgos_revision
 )
+from modules.sesiones import cerrar_sesion
+from modules import limites, perfil
 
 st.set_page_config(page_title="Dueña — Panel", page_icon="🗂️", layout="wide")
 
@@ -108,12 +114,19 @@ st.markdown(f"<style>{CUSTOM_CSS}</style>", unsafe_allow_html=True)
 if st.session_state.get("role") != "admin":
     st.switch_page("pages/0_Login.py")
 
-SERVICIOS = ["Corte", "Coloración", "Manicure", "Pedicure", "Peinado", "Tratamiento capilar", "Maquillaje", "Depilación"]
+SERVICIOS = servicios()
 
 st.title("🗂️ Panel de administración")
 
-ult_df = ultima_cita_agendada()
-if not ult_df.empty:
+# Cada sección es un fragmento: interactuar con una solo vuelve a correr esa
+# sección (y solo consulta sus propios datos). Las escrituras sí relanzan la
+# página completa para refrescar la grilla y el aviso.
+
+@st.fragment(run_every="30s")
+def aviso_ultima_cita():
+    ult_df = ultima_cita_agendada()
+    if ult_df.empty:
+        return
     ult = ult_df.iloc[0]
     etiqueta = f"{ult['nombre'] or 'Cliente'} • {ult['fecha']} {str(ult['hora'])[:5]} • {ult.get('servicio') or 'Sin servicio'}"
     if st.session_state.get("last_seen_booking_id") != int(ult["id_cita"]):
@@ -121,31 +134,139 @@ if not ult_df.empty:
         st.session_state.last_seen_booking_id = int(ult["id_cita"])
     st.info(f"Última cita agendada: {etiqueta}")
 
-colf, colr = st.columns([1, 2], gap="large")
-
-with colf:
-    fecha_sel = st.date_input("Día", value=date.today(), key="fecha_admin")
-
+@st.fragment
+def form_crear(fecha_sel: date):
     opts_admin = [t.strftime("%H:%M") for t in generar_slots(fecha_sel)]
-    slot = st.selectbox("Hora", opts_admin) if opts_admin else None
     if not opts_admin:
         st.info("Día no laborable o sin bloques disponibles.")
-
-    nombre = st.text_input("Nombre paciente")
-    tel    = st.text_input("Teléfono")
-    servicio = st.selectbox("Servicio", SERVICIOS)
-    nota   = st.text_area("Nota (opcional)")
-
-    if st.button("➕ Crear cita"):
+    with st.form("form_crear_cita"):
+        slot = st.selectbox("Hora", opts_admin) if opts_admin else None
+        nombre = st.text_input("Nombre paciente")
+        tel    = st.text_input("Teléfono")
+        servicio = st.selectbox("Servicio", SERVICIOS)
+        nota   = st.text_area("Nota (opcional)")
+        ok = st.form_submit_button("➕ Crear cita")
+
+    if ok:
         if not slot:
             st.error("Selecciona un día con horarios disponibles.")
         elif not (nombre.strip() and tel.strip()):
             st.error("Nombre y teléfono son obligatorios.")
         else:
-            crear_cita_manual(fecha_sel, datetime.strptime(slot, "%H:%M").time(), nombre, tel, servicio, nota or None)
-            st.success("Cita creada."); st.rerun()
+            try:
+                crear_cita_manual(fecha_sel, datetime.strptime(slot, "%H:%M").time(), nombre, tel, servicio, nota or None)
+                st.success("Cita creada."); st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+
+ESTADOS_SERIE = {
+    "ok": "✅ creada", "horario_ocupado": "⛔ horario ocupado",
+    "regla_7_dias": "⛔ otra cita a menos de 7 días", "fuera_de_horario": "⛔ fuera de horario",
+}
 
-with colr:
+@st.fragment
+def form_serie(fecha_sel: date):
+    opts = [t.strftime("%H:%M") for t in generar_slots(fecha_sel)]
+    with st.expander("🔁 Cita recurrente (serie)"):
+        if not opts:
+            st.info("Elige un día laborable como inicio de la serie.")
+            return
+        with st.form("form_serie"):
+            slot = st.selectbox("Hora", opts, key="serie_hora")
+            cada = st.number_input("Cada cuántas semanas", min_value=1, max_value=12, value=1)
+            fin = st.radio("Termina", ["Después de N citas", "En una fecha"], horizontal=True)
+            veces = st.number_input("Número de citas", min_value=1, max_value=SERIE_MAX, value=8)
+            hasta = st.date_input("Última fecha", value=fecha_sel, min_value=fecha_sel, key="serie_hasta")
+            nombre = st.text_input("Nombre paciente", key="serie_nombre")
+            tel = st.text_input("Teléfono", key="serie_tel")
+            servicio = st.selectbox("Servicio", SERVICIOS, key="serie_servicio")
+            nota = st.text_area("Nota (opcional)", key="serie_nota")
+            ok = st.form_submit_button("🔁 Crear serie")
+
+        if ok:
+            if not (nombre.strip() and tel.strip()):
+                st.error("Nombre y teléfono son obligatorios.")
+                return
+            try:
+                rep = crear_serie(
+                    fecha_sel, datetime.strptime(slot, "%H:%M").time(), nombre, tel, servicio,
+                    cada_semanas=int(cada), nota=nota or None,
+                    **({"veces": int(veces)} if fin.startswith("Después") else {"hasta": hasta}),
+                )
+            except ValueError as e:
+                st.error(str(e))
+                return
+            # el reporte sobrevive al rerun que refresca la grilla
+            st.session_state.reporte_serie = rep
+            st.rerun()
+
+        rep = st.session_state.pop("reporte_serie", None)
+        if rep is not None:
+            creadas = int((rep["estado"] == "ok").sum())
+            st.success(f"Serie creada: {creadas} de {len(rep)} citas.")
+            rep["fecha"] = rep["fecha"].map(lambda f: f.strftime("%d-%m-%Y"))
+            rep["estado"] = rep["estado"].map(ESTADOS_SERIE)
+            st.dataframe(rep, use_container_width=True, hide_index=True)
+
+def _tabla_cierre(plan: pd.DataFrame) -> pd.DataFrame:
+    t = plan[["nombre", "telefono", "servicio"]].copy()
+    t["hora"] = plan["hora"].map(lambda h: str(h)[:5])
+    t["nueva"] = [f"{f.strftime('%d-%m-%Y')} {str(h)[:5]}" if f is not None and pd.notna(f) else "— sin hueco —"
+                  for f, h in zip(plan["fecha_nueva"], plan["hora_nueva"])]
+    return t
+
+@st.fragment
+def cierre_dia(fecha_sel: date):
+    with st.expander("🚫 Cerrar este día"):
+        if dia_cerrado(fecha_sel):
+            st.info("Este día está cerrado: no se ofrecen horarios.")
+            if st.button("🔓 Reabrir día"):
+                reabrir_dia(fecha_sel)
+                st.rerun()
+        else:
+            motivo = st.text_input("Motivo (opcional)", key="cierre_motivo")
+            dias = st.number_input("Buscar lugar en los próximos días", min_value=1, max_value=60, value=CIERRE_DIAS_MAX)
+            if st.toggle("Ver propuesta", key="cierre_ver"):
+                plan = planear_cierre(fecha_sel, int(dias))
+                if plan.empty:
+                    st.caption("No hay citas que mover.")
+                else:
+                    st.caption("Propuesta (aún no se guarda nada):")
+                    st.dataframe(_tabla_cierre(plan), use_container_width=True, hide_index=True)
+                    sin_hueco = int((plan["estado"] == "sin_hueco").sum())
+                    if sin_hueco:
+                        st.warning(f"{sin_hueco} sin hueco: no hay horario libre en esos días que respete "
+                                   "la regla de una cita cada 7 días. Seguirán en el día cerrado.")
+            confirm = st.checkbox("Confirmar cierre", key="cierre_confirmar")
+            if st.button("🚫 Cerrar día y mover citas", disabled=not confirm):
+                try:
+                    st.session_state.reporte_cierre = cerrar_dia(fecha_sel, motivo or None, int(dias))
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+
+        rep = st.session_state.get("reporte_cierre")
+        if rep is not None:
+            sin_hueco = rep[rep["estado"] == "sin_hueco"]
+            st.success(f"Citas movidas: {int((rep['estado'] == 'movida').sum())}.")
+            if not sin_hueco.empty:
+                st.warning("Sin hueco (siguen en el día cerrado, hay que llamarles):")
+                st.dataframe(_tabla_cierre(sin_hueco), use_container_width=True, hide_index=True)
+            dry = st.checkbox("Modo simulación (no envía)", value=True, key="cierre_dry")
+            if st.button("📨 Avisar a los clientes movidos"):
+                try:
+                    res = notificar_reprogramadas(rep, dry_run=dry)
+                    st.success(f"Enviados: {res['enviados']} • Fallidos: {res['fallidos']}")
+                    if res["fallidos"]:
+                        st.dataframe(pd.DataFrame(res["detalles"]), use_container_width=True, hide_index=True)
+                except KeyError:
+                    st.error("Faltan credenciales de WhatsApp en Secrets (TEMPLATE_CAMBIO).")
+            if st.button("Listo"):
+                del st.session_state["reporte_cierre"]
+                st.rerun()
+
+@st.fragment
+def grilla_dia(fecha_sel: date):
     st.subheader(f"Citas para {fecha_sel.strftime('%d-%m-%Y')}")
     df = citas_por_dia(fecha_sel)
 
@@ -161,43 +282,83 @@ with colr:
 
         show = todos_slots.merge(df_m, on="hora_txt", how="left")
         show["estado"] = show["id_cita"].apply(lambda x: "✅ libre" if pd.isna(x) else "🟡 ocupado")
-        cols = ["hora_txt", "estado", "id_cita", "paciente_id", "nombre", "telefono", "servicio", "nota"]
+        cols = ["hora_txt", "estado", "id_cita", "paciente_id", "nombre", "telefono", "servicio", "nota", "serie_id"]
         for c in cols:
             if c not in show.columns: show[c] = None
         st.dataframe(show[cols], use_container_width=True)
+    elif dia_cerrado(fecha_sel):
+        st.info("Día cerrado.")
     else:
         st.info("Domingo (no laborable).")
 
+@st.fragment
+def editor_cita(fecha_sel: date):
+    df = citas_por_dia(fecha_sel)
     if df.empty:
         st.info("No hay citas ocupadas en este día.")
-    else:
-        st.divider(); st.caption("Editar / eliminar cita")
-        ids = df["id_cita"].astype(int).tolist()
-        cid = st.selectbox("ID cita", ids)
-        r = df[df.id_cita == cid].iloc[0]
-
-        nombre_e = st.text_input("Nombre", r["nombre"] or "", key="nombre_edit")
-        tel_e    = st.text_input("Teléfono", r["telefono"] or "", key="tel_edit")
-        servicio_e = st.selectbox("Servicio", SERVICIOS, index=SERVICIOS.index(r["servicio"]) if r.get("servicio") in SERVICIOS else 0, key="servicio_edit")
-        nota_e   = st.text_area("Nota", r["nota"] or "", key="nota_edit")
-
-        if st.button("💾 Guardar cambios"):
-            if nombre_e.strip() and tel_e.strip():
+        return
+    st.divider(); st.caption("Editar / eliminar cita")
+    ids = df["id_cita"].astype(int).tolist()
+    cid = st.selectbox("ID cita", ids)
+    r = df[df.id_cita == cid].iloc[0]
+
+    nombre_e = st.text_input("Nombre", r["nombre"] or "", key="nombre_edit")
+    tel_e    = st.text_input("Teléfono", r["telefono"] or "", key="tel_edit")
+    servicio_e = st.selectbox("Servicio", SERVICIOS, index=SERVICIOS.index(r["servicio"]) if r.get("servicio") in SERVICIOS else 0, key="servicio_edit")
+    nota_e   = st.text_area("Nota", r["nota"] or "", key="nota_edit")
+
+    if st.button("💾 Guardar cambios"):
+        if nombre_e.strip() and tel_e.strip():
+            try:
                 actualizar_cita(int(cid), nombre_e, tel_e, servicio_e, nota_e or None)
                 st.success("Actualizado."); st.rerun()
-            else:
-                st.error("Nombre y teléfono son obligatorios.")
+            except ValueError as e:
+                st.error(str(e))
+        else:
+            st.error("Nombre y teléfono son obligatorios.")
 
-        st.divider(); st.caption("Eliminar cita")
-        confirm = st.checkbox("Confirmar eliminación")
-        if st.button("🗑️ Eliminar", disabled=not confirm):
-            n = eliminar_cita(int(cid))
-            st.success("Cita eliminada." if n else "La cita ya no existía.")
+    st.divider(); st.caption("Eliminar cita")
+    confirm = st.checkbox("Confirmar eliminación")
+    if st.button("🗑️ Eliminar", disabled=not confirm):
+        n = eliminar_cita(int(cid))
+        st.success("Cita eliminada." if n else "La cita ya no existía.")
+        st.rerun()
+
+    if pd.notna(r.get("serie_id")):
+        editor_serie(int(r["serie_id"]), fecha_sel, r)
+
+def editor_serie(serie_id: int, fecha_sel: date, r):
+    st.divider(); st.caption(f"Serie #{serie_id}: esta cita y las siguientes")
+    opts = [t.strftime("%H:%M") for t in generar_slots(fecha_sel)]
+    hora_txt = str(r["hora"])[:5]
+    hora_s = st.selectbox("Hora", opts, index=opts.index(hora_txt) if hora_txt in opts else 0, key="serie_hora_edit")
+    servicio_s = st.selectbox("Servicio", SERVICIOS, index=SERVICIOS.index(r["servicio"]) if r.get("servicio") in SERVICIOS else 0, key="serie_servicio_edit")
+    nota_s = st.text_area("Nota", r["nota"] or "", key="serie_nota_edit")
+    if st.button("💾 Aplicar a esta y las siguientes"):
+        try:
+            res = editar_serie_desde(serie_id, fecha_sel, datetime.strptime(hora_s, "%H:%M").time(), servicio_s, nota_s or None)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.session_state.reporte_edicion_serie = res
             st.rerun()
 
-    # --------- RECORDATORIOS WHATSAPP (CITAS DE MAÑANA) ----------
-    from modules.core import enviar_recordatorios_manana
-
+    res = st.session_state.pop("reporte_edicion_serie", None)
+    if res is not None:
+        fallidas = res.loc[~res["movida"], "fecha"].map(lambda f: f.strftime("%d-%m-%Y")).tolist()
+        if fallidas:
+            st.warning("Sin cambios (la nueva hora estaba ocupada): " + ", ".join(fallidas))
+        st.success(f"Serie actualizada: {int(res['movida'].sum())} citas.")
+
+    confirm_s = st.checkbox("Confirmar cancelación de la serie")
+    if st.button("🗑️ Cancelar esta y las siguientes", disabled=not confirm_s):
+        n = cancelar_serie_desde(serie_id, fecha_sel)
+        st.success(f"Citas canceladas: {n}.")
+        st.rerun()
+
+# --------- RECORDATORIOS WHATSAPP (CITAS DE MAÑANA) ----------
+@st.fragment
+def recordatorios():
     st.divider()
     st.subheader("🔔 Recordatorios de WhatsApp (citas de mañana)")
 
@@ -218,8 +379,83 @@ with colr:
         except Exception as e:
             st.error(f"No se pudieron enviar los recordatorios: {e}")
 
+aviso_ultima_cita()
+
+colf, colr = st.columns([1, 2], gap="large")
+
+with colf:
+    fecha_sel = st.date_input("Día", value=date.today(), key="fecha_admin")
+    form_crear(fecha_sel)
+    form_serie(fecha_sel)
+    cierre_dia(fecha_sel)
+
+with colr:
+    grilla_dia(fecha_sel)
+    editor_cita(fecha_sel)
+    recordatorios()
+
+@st.fragment
+def revision_reglas():
+    with st.expander("🧪 Revisión de reglas (todas las citas)"):
+        st.caption("Busca clientes con dos citas el mismo día o a menos de 7 días, citas sin cliente "
+                   "y clientes repetidos con el mismo teléfono. Solo informa: no cambia nada.")
+        if st.button("🔍 Revisar ahora"):
+            with st.spinner("Revisando…"):
+                if revisar_reglas() is None:
+                    st.info("Ya hay una revisión en curso; intenta en un momento.")
+        r = ultima_revision()
+        if not r:
+            st.info("Todavía no hay revisiones.")
+            return
+        st.write(f"Última revisión: {r['terminada_en']:%d/%m/%Y %H:%M} • {r['hallazgos']} hallazgos "
+                 f"• {r['ms']} ms")
+        etiquetas = {"mismo_dia": "Dos citas el mismo día", "ventana_7_dias": "Citas a menos de 7 días",
+                     "sin_paciente": "Citas sin cliente", "paciente_duplicado": "Clientes repetidos"}
+        cols = st.columns(len(etiquetas))
+        for col, (regla, txt) in zip(cols, etiquetas.items()):
+            col.metric(txt, r["por_regla"].get(regla, 0))
+        elegidas = [k for k in etiquetas if r["por_regla"].get(k)]
+        if not elegidas:
+            return
+        reglas = st.multiselect("Ver", elegidas, default=elegidas, format_func=etiquetas.get)
+        if reglas:
+            st.dataframe(hallazgos_revision(r["id"], reglas), use_container_width=True, hide_index=True)
+            st.caption("relacionado_id: la cita anterior del cliente, o el cliente original si está repetido. "
+                       "Se muestran hasta 500.")
+
+if revision_disponible():
+    revision_reglas()
+
+url_ics = feed_agenda()
+if url_ics:
+    with st.expander("📲 Agenda en el calendario del teléfono"):
+        st.caption("Suscríbete desde tu calendario; se actualiza sola. No compartas el enlace.")
+        st.code(url_ics, language=None)
+
+with st.expander("🛡️ Intentos de inicio de sesión (este servidor)"):
+    st.json(limites.estadisticas())
+
+with st.expander("🔌 Conexiones a la BD de este salón (este servidor)"):
+    st.caption("Cupo: cuántas puede usar a la vez. Esperas: veces que hubo que esperar a que se liberara una.")
+    st.json(uso_conexiones())
+
+with st.expander("⏱️ Perfil de las recargas (este servidor)"):
+    st.caption("Mide cada recarga de tu sesión (consultas, pandas, bcrypt, Streamlit) y muestra el "
+               "desglose al final de la página. Hace todo un poco más lento: apágalo al terminar.")
+    st.toggle("Perfilar mis recargas", key=perfil.CLAVE_SESION, disabled=perfil.PERFIL_ENV,
+              help="Con CITAS_PERFIL=1 ya está activo para todas las sesiones.")
+    guardados = {p.id: p for p in perfil.recientes()}
+    if guardados:
+        # opciones por id: Streamlit copia las opciones de cada widget en cada recarga
+        elegido = st.selectbox("Perfiles guardados", list(guardados), key="perfil_elegido",
+                               format_func=lambda i: f"{guardados[i].cuando:%H:%M:%S} • {guardados[i].pagina} • "
+                                                     f"{guardados[i].total_ms:.0f} ms • "
+                                                     f"{len(guardados[i].consultas)} consultas")
+        perfil.descargas(guardados[elegido], "perfil_guardado")
+        st.caption(f"Se guardan los últimos {perfil.PERFILES_MAX} de este servidor. El .prof se abre con "
+                   "snakeviz o pstats; el otro en speedscope.app.")
+
 # Cerrar sesión (sustituye al antiguo st.page_link)
 if st.button("🚪 Cerrar sesión"):
-    st.session_state.role = None
-    st.session_state.paciente = None
+    cerrar_sesion()
     st.rerun()
@@ -0,0 +1,28 @@
+# tests/conftest.py — Las reglas de agenda corren contra MemoriaRepo (sin BD)
+import os
+os.environ["CITAS_BACKEND"] = "memoria"
+
+from datetime import date, timedelta
+import pytest
+from modules import core, limites
+from modules.storage import MemoriaRepo
+
+
+@pytest.fixture(autouse=True)
+def repo_memoria(monkeypatch):
+    """Repositorio vacío y límites de login limpios en cada prueba."""
+    monkeypatch.setattr(limites, "POR_TELEFONO", limites.LimitadorTokens(capacidad=5, recarga_s=60))
+    monkeypatch.setattr(limites, "POR_IP", limites.LimitadorTokens(capacidad=20, recarga_s=6))
+    prev = core.usar_repo(MemoriaRepo())
+    yield core.repo()
+    core.usar_repo(prev)
+
+
+def lunes(semanas: int = 2) -> date:
+    """Un lunes laborable a `semanas` semanas, fuera de los días bloqueados."""
+    d = date.today() + timedelta(weeks=semanas)
+    return d - timedelta(days=d.weekday())
+
+
+def paciente(tel: str = "5512345678", nombre: str = "Ana") -> int:
+    return core.registrar_paciente(nombre, tel, "secreta")
@@ -0,0 +1,36 @@
+from datetime import timedelta
+import pytest
+from modules import core
+from tests.conftest import lunes, paciente
+
+
+def test_registro_y_login():
+    pid = paciente("55 1234 5678")
+    assert core.login_paciente("5512345678", "secreta")["id"] == pid
+    assert core.login_paciente("5512345678", "otra") is None
+    assert core.login_paciente("5599999999", "secreta") is None
+    with pytest.raises(ValueError, match="ya está registrado"):
+        paciente("55-1234-5678", "Otra")
+
+
+def test_una_cita_cada_7_dias():
+    pid = paciente()
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    core.agendar_cita_autenticado(f, h, pid, "Corte")
+    with pytest.raises(ValueError, match="Ya tienes una cita ese día"):
+        core.agendar_cita_autenticado(f, core.generar_slots(f)[1], pid, "Corte")
+    for dias in (-6, 3, 6):
+        with pytest.raises(ValueError, match="7 días"):
+            core.agendar_cita_autenticado(f + timedelta(days=dias), h, pid, "Corte")
+    core.agendar_cita_autenticado(f + timedelta(days=7), h, pid, "Corte")
+
+
+def test_horario_tomado():
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    core.agendar_cita_autenticado(f, h, paciente("5511111111"), "Corte")
+    with pytest.raises(ValueError, match="ya fue tomado"):
+        core.agendar_cita_autenticado(f, h, paciente("5522222222"), "Corte")
+    with pytest.raises(ValueError, match="ya fue tomado"):
+        core.crear_cita_manual(f, h, "Bea", "5533333333", "Corte")
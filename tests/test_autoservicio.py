@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+import pytest
+from modules import core
+from tests.conftest import lunes, paciente
+
+
+@pytest.fixture
+def huecos(monkeypatch) -> list:
+    """Horarios liberados que se ofrecerían a la lista de espera (sin hilos)."""
+    encolados = []
+    monkeypatch.setattr(core, "encolar_hueco", lambda f, h: encolados.append((f, h)))
+    return encolados
+
+
+def _cita(pid: int, f: date, i: int = 0) -> int:
+    core.agendar_cita_autenticado(f, core.generar_slots(f)[i], pid, "Corte")
+    return int(core.citas_por_dia(f)["id_cita"].iloc[-1])
+
+
+def test_cliente_reprograma_y_libera_el_horario(huecos):
+    pid = paciente()
+    f = lunes()
+    h1, h2 = core.generar_slots(f)[:2]
+    cid = _cita(pid, f)
+    core.reprogramar_cita(cid, pid, f, h2)
+    assert set(core.slots_ocupados(f)) == {h2}
+    assert huecos == [(f, h1)]
+    # la regla de 7 días no cuenta la cita que se mueve
+    core.reprogramar_cita(cid, pid, f + timedelta(days=2), h2)
+    with pytest.raises(ValueError, match="no está permitida"):
+        core.reprogramar_cita(cid, pid, date.today(), h2)
+
+
+def test_reprogramar_respeta_las_otras_citas(huecos):
+    pid = paciente()
+    f = lunes()
+    cid = _cita(pid, f)
+    _cita(pid, f + timedelta(days=7))
+    with pytest.raises(ValueError, match="7 días"):
+        core.reprogramar_cita(cid, pid, f + timedelta(days=3), core.generar_slots(f)[0])
+    otro = paciente("5522222222")
+    _cita(otro, f, 1)
+    with pytest.raises(ValueError, match="ya fue tomado"):
+        core.reprogramar_cita(cid, pid, f, core.generar_slots(f)[1])
+    assert huecos == []
+
+
+def test_cliente_no_toca_citas_ajenas(huecos):
+    f = lunes()
+    cid = _cita(paciente("5511111111"), f)
+    otro = paciente("5522222222")
+    assert core.cancelar_cita_paciente(cid, otro) is False
+    with pytest.raises(ValueError, match="ya no se puede cambiar"):
+        core.reprogramar_cita(cid, otro, f, core.generar_slots(f)[1])
+    assert huecos == []
+
+
+def test_cliente_cancela(huecos):
+    pid = paciente()
+    f = lunes()
+    cid = _cita(pid, f)
+    assert core.cancelar_cita_paciente(cid, pid) is True
+    assert core.citas_por_dia(f).empty
+    assert huecos == [(f, core.generar_slots(f)[0])]
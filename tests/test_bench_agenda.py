@@ -0,0 +1,18 @@
+from datetime import date, timedelta
+from modules import bench_agenda, core
+
+
+def test_bench_agenda_corre_en_memoria():
+    res = bench_agenda.correr(pacientes=50, intentos=300, dias=30)
+    assert res["agendadas"] > 0 and res["agendadas"] + res["rechazadas"] == 300
+    # todo lo que contó como agendado quedó en el repositorio del benchmark
+    hoy = date.today()
+    assert sum(len(core.citas_por_dia(hoy + timedelta(days=i))) for i in range(32)) == res["agendadas"]
+    assert res["ops_por_seg"] > 0 and res["proxima_cita_ops_por_seg"] > 0
+
+
+def test_bench_agenda_cli(capsys):
+    bench_agenda.main(["--pacientes", "20", "--intentos", "50", "--dias", "14"])
+    salida = capsys.readouterr().out
+    for k in ("agendadas", "rechazadas", "segundos", "ops_por_seg", "proxima_cita_ops_por_seg"):
+        assert k in salida
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from modules import core
+from tests.conftest import lunes
+
+
+def test_cerrar_dia_mueve_y_bloquea():
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    core.crear_cita_manual(f, h, "Ana", "5512345678", "Corte")
+    rep = core.cerrar_dia(f, "Fuga de agua")
+    assert list(rep["estado"]) == ["movida"]
+    assert core.dia_cerrado(f) and core.generar_slots(f) == []
+    assert core.citas_por_dia(f).empty
+    core.reabrir_dia(f)
+    assert core.generar_slots(f)
+
+
+def test_planear_cierre_respeta_la_regla_de_7_dias():
+    f = lunes()
+    slots = core.generar_slots(f)
+    for i, h in enumerate(slots[:3]):
+        core.crear_cita_manual(f, h, f"P{i}", f"55000000{i:02d}", "Corte")
+    # P0 tiene otra cita a 7 días: martes o miércoles la dejarían a menos de 7
+    core.crear_cita_manual(f + timedelta(days=7), slots[0], "P0", "5500000000", "Corte")
+    plan = core.planear_cierre(f, dias_max=2)
+    assert list(plan["estado"]) == ["sin_hueco", "propuesta", "propuesta"]
+    assert list(plan["fecha_nueva"][1:]) == [f + timedelta(days=1)] * 2
+    assert list(plan["hora_nueva"][1:]) == slots[1:3]
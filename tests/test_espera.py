@@ -0,0 +1,74 @@
+from datetime import timedelta
+import pytest
+from modules import core
+from tests.conftest import lunes, paciente
+
+
+@pytest.fixture(autouse=True)
+def sin_whatsapp(monkeypatch):
+    enviadas = []
+    monkeypatch.setattr(core, "_enviar_oferta", lambda o, f, h: enviadas.append((o["paciente_id"], f, h)))
+    return enviadas
+
+
+def test_hueco_se_ofrece_al_primero_en_la_lista(sin_whatsapp):
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    primera, segunda = paciente("5511111111", "Ana"), paciente("5522222222", "Bea")
+    core.unirse_lista_espera(primera, f, f + timedelta(days=3), "Corte")
+    core.unirse_lista_espera(segunda, f, f + timedelta(days=3), "Corte")
+    o = core._ofrecer_hueco(f, h)
+    assert o["paciente_id"] == primera and sin_whatsapp == [(primera, f, h)]
+    assert len(core.ofertas_paciente(primera)) == 1
+    assert core.ofertas_paciente(segunda).empty
+
+
+def test_aceptar_oferta_agenda_la_cita():
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    pid = paciente()
+    core.unirse_lista_espera(pid, f, f, "Manicure")
+    o = core._ofrecer_hueco(f, h)
+    assert core.aceptar_oferta(o["id"], pid) == (f, h)
+    assert core.ya_tiene_cita_en_dia(pid, f)
+    with pytest.raises(ValueError, match="ya no está disponible"):
+        core.aceptar_oferta(o["id"], pid)
+
+
+def test_no_se_ofrece_a_quien_romperia_la_regla_de_7_dias(sin_whatsapp):
+    f = lunes()
+    slots = core.generar_slots(f)
+    pid = paciente()
+    core.agendar_cita_autenticado(f + timedelta(days=3), slots[0], pid, "Corte")
+    core.unirse_lista_espera(pid, f, f, "Corte")
+    assert core._ofrecer_hueco(f, slots[1]) is None
+    assert sin_whatsapp == []
+
+
+def test_oferta_vencida_pasa_al_siguiente(sin_whatsapp):
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    primera, segunda = paciente("5511111111", "Ana"), paciente("5522222222", "Bea")
+    core.unirse_lista_espera(primera, f, f, "Corte")
+    core.unirse_lista_espera(segunda, f, f, "Corte")
+    o = core._ofrecer_hueco(f, h)
+    assert core.vencer_ofertas() == 0
+    oferta = core.repo()._ofertas[o["id"]]
+    oferta["expira_en"] -= timedelta(minutes=core.OFERTA_MIN + 1)
+    assert core.vencer_ofertas() == 1
+    assert core.ofertas_paciente(primera).empty
+    assert [p for p, _, _ in sin_whatsapp] == [primera, segunda]
+    assert len(core.ofertas_paciente(segunda)) == 1
+
+
+def test_solo_el_destinatario_puede_rechazar_la_oferta(sin_whatsapp):
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    primera, segunda = paciente("5511111111", "Ana"), paciente("5522222222", "Bea")
+    core.unirse_lista_espera(primera, f, f, "Corte")
+    core.unirse_lista_espera(segunda, f, f, "Corte")
+    o = core._ofrecer_hueco(f, h)
+    core.rechazar_oferta(o["id"], segunda)
+    assert len(core.ofertas_paciente(primera)) == 1
+    core.rechazar_oferta(o["id"], primera)
+    assert core.ofertas_paciente(primera).empty
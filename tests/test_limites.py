@@ -0,0 +1,105 @@
+import pytest
+from modules import core, limites
+from tests.conftest import paciente
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj manual para limites._time.monotonic."""
+    t = [1000.0]
+    monkeypatch.setattr(limites._time, "monotonic", lambda: t[0])
+    return t
+
+
+def test_cubeta_se_agota_y_se_recarga(reloj):
+    lim = limites.LimitadorTokens(capacidad=3, recarga_s=10)
+    assert [lim.consumir("a") for _ in range(4)] == [True, True, True, False]
+    assert lim.consumir("b")   # otra clave, otra cubeta
+    reloj[0] += 9
+    assert not lim.consumir("a")
+    reloj[0] += 1
+    assert lim.consumir("a") and not lim.consumir("a")
+    reloj[0] += 1000
+    assert [lim.consumir("a") for _ in range(4)] == [True, True, True, False]   # no pasa de la capacidad
+
+
+def test_hay_token_no_consume():
+    lim = limites.LimitadorTokens(capacidad=1, recarga_s=60)
+    assert lim.hay_token("a") and lim.hay_token("a")
+    assert lim.consumir("a") and not lim.hay_token("a")
+
+
+def test_reiniciar_devuelve_la_capacidad():
+    lim = limites.LimitadorTokens(capacidad=2, recarga_s=60)
+    lim.consumir("a"); lim.consumir("a")
+    lim.reiniciar("a")
+    assert lim.consumir("a")
+
+
+def test_memoria_acotada_expulsa_la_menos_reciente():
+    lim = limites.LimitadorTokens(capacidad=1, recarga_s=60, max_claves=2)
+    lim.consumir("a"); lim.consumir("b")
+    lim.hay_token("a")   # "a" pasa a ser la más reciente
+    lim.consumir("c")
+    assert len(lim) == 2 and lim.expulsadas == 1
+    assert not lim.consumir("a")   # sigue agotada
+    assert lim.consumir("b")       # se olvidó: cubeta nueva
+
+
+def test_permitir_login_por_telefono_y_por_ip():
+    for _ in range(5):
+        limites.permitir_login("t1", "10.0.0.1")
+    with pytest.raises(limites.LoginBloqueado, match="este teléfono"):
+        limites.permitir_login("t1", "10.0.0.1")
+    # 20 intentos por IP entre varios teléfonos; el bloqueado no gastó token de IP
+    for i in range(15):
+        limites.permitir_login(f"otro{i}", "10.0.0.1")
+    with pytest.raises(limites.LoginBloqueado, match="esta conexión"):
+        limites.permitir_login("t2", "10.0.0.1")
+    limites.permitir_login("t2", "10.0.0.2")
+    limites.permitir_login("t2")
+
+
+def test_login_exitoso_reinicia_solo_el_telefono():
+    for _ in range(5):
+        limites.permitir_login("t1", "10.0.0.1")
+    limites.login_exitoso("t1")
+    limites.permitir_login("t1", "10.0.0.1")
+    # la IP conserva lo gastado: quedan 20 - 6
+    assert [limites.POR_IP.consumir("10.0.0.1") for _ in range(15)].count(True) == 14
+
+
+def test_login_bloquea_antes_de_bcrypt(monkeypatch):
+    paciente("5512345678")
+    for _ in range(5):
+        assert core.login_paciente("5512345678", "mala") is None
+    monkeypatch.setattr(core, "check_password", lambda *a: pytest.fail("corrió bcrypt"))
+    with pytest.raises(limites.LoginBloqueado):
+        core.login_paciente("5512345678", "secreta")
+
+
+def test_login_exitoso_reinicia_el_limite():
+    paciente("5512345678")
+    for _ in range(4):
+        core.login_paciente("5512345678", "mala")
+    assert core.login_paciente("5512345678", "secreta")
+    for _ in range(4):
+        core.login_paciente("5512345678", "mala")
+    assert core.login_paciente("5512345678", "secreta")
+
+
+def test_admin_limitado_por_usuario(monkeypatch):
+    monkeypatch.setattr(core, "ADMIN_USER", "carmen")
+    monkeypatch.setattr(core, "ADMIN_PASSWORD", "buena")
+    for _ in range(5):
+        assert not core.is_admin_ok("carmen", "mala", ip="10.0.0.1")
+    with pytest.raises(limites.LoginBloqueado, match="esta cuenta"):
+        core.is_admin_ok("carmen", "buena", ip="10.0.0.2")
+    # un login correcto antes del bloqueo reinicia la cuenta
+    limites.POR_TELEFONO.reiniciar(f"{core.salon_actual().slug}/admin/carmen")
+    for _ in range(4):
+        core.is_admin_ok("carmen", "mala")
+    assert core.is_admin_ok("carmen", "buena")
+    for _ in range(4):
+        core.is_admin_ok("carmen", "mala")
+    assert core.is_admin_ok("carmen", "buena")
@@ -0,0 +1,95 @@
+# tests/test_postgres.py — Lo que solo se ve contra PostgreSQL de verdad (carreras, restricciones)
+#
+#   CITAS_TEST_URL=postgresql://localhost/citas python -m pytest tests/test_postgres.py
+#
+# Sin CITAS_TEST_URL se saltan. Todo pasa en un esquema propio que se borra al terminar.
+import os, threading
+from datetime import date, timedelta
+import psycopg
+import pytest
+from psycopg import errors as pg_errors
+from psycopg_pool import ConnectionPool
+from modules import core, salones
+from modules.consultas import SQL
+from tests.conftest import lunes
+
+URL = os.getenv("CITAS_TEST_URL")
+pytestmark = pytest.mark.skipif(not URL, reason="sin CITAS_TEST_URL")
+
+SALON = salones.Salon("prueba-carreras", "Pruebas")
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    with psycopg.connect(URL, autocommit=True) as c:
+        c.execute(f"DROP SCHEMA IF EXISTS {SALON.esquema} CASCADE")
+        c.execute(f"CREATE SCHEMA {SALON.esquema}")
+        salones.fijar(c, SALON)
+        salones.preparar(c)
+    pool = ConnectionPool(URL, kwargs={"autocommit": True}, min_size=1, max_size=4, open=True)
+    monkeypatch.setattr(core, "_pool", lambda: pool)
+    core.usar_repo(core.PostgresRepo())   # conftest repone el anterior
+    try:
+        with salones.usando(SALON):
+            yield
+    finally:
+        pool.close()
+        with psycopg.connect(URL, autocommit=True) as c:
+            c.execute(f"DROP SCHEMA {SALON.esquema} CASCADE")
+
+
+def _cita(pid: int, f: date) -> int:
+    core.agendar_cita_autenticado(f, core.generar_slots(f)[0], pid, "Corte")
+    return int(core.citas_por_dia(f)["id_cita"].iloc[-1])
+
+
+def test_dos_cambios_del_mismo_paciente_no_rompen_la_regla_de_7_dias(pg, monkeypatch):
+    monkeypatch.setattr(core, "encolar_hueco", lambda f, h: None)
+    f = lunes(3)
+    pid = core.registrar_paciente("Ana", "5512345678", "secreta")
+    primera, segunda = _cita(pid, f), _cita(pid, f + timedelta(weeks=2))
+    destino = f + timedelta(weeks=1)
+
+    # Otra transacción mueve la primera cita a `destino` y todavía no hace commit.
+    # Sin el candado, la segunda no la vería y también quedaría a un día de distancia.
+    with psycopg.connect(URL) as otra:
+        salones.fijar(otra, SALON)
+        otra.execute(SQL["candado_paciente"], (pid,))
+        fila = otra.execute(SQL["reprogramar_cita_paciente"], {
+            "cita": primera, "paciente": pid, "hoy": date.today(),
+            "fecha": destino, "hora": core.generar_slots(destino)[0]}).fetchone()
+        assert fila[0] == "ok"
+        res = {}
+        cambio = salones.ligar(lambda: res.update(err=_intentar(
+            core.reprogramar_cita, segunda, pid, destino + timedelta(days=1),
+            core.generar_slots(destino + timedelta(days=1))[0])))
+        hilo = threading.Thread(target=cambio)
+        hilo.start()
+        hilo.join(1)
+        assert hilo.is_alive()   # espera el candado del paciente
+        otra.commit()
+    hilo.join(10)
+    assert "7 días" in str(res["err"])
+    assert core.citas_por_dia(f + timedelta(weeks=2))["id_cita"].tolist() == [segunda]
+
+
+def test_solo_la_restriccion_del_horario_es_horario_tomado(pg):
+    f = lunes(3)
+    h = core.generar_slots(f)[0]
+    core.crear_cita_manual(f, h, "Ana", "5512345678", "Corte")
+    with pytest.raises(ValueError, match="ya fue tomado"):
+        core.crear_cita_manual(f, h, "Bea", "5587654321", "Corte")
+    # registro viejo sin telefono_e164: el alta por E.164 choca con la UNIQUE del teléfono tal cual
+    with psycopg.connect(URL, autocommit=True) as c:
+        salones.fijar(c, SALON)
+        c.execute("INSERT INTO pacientes (nombre, telefono) VALUES ('Vieja', '5511112222')")
+    with pytest.raises(pg_errors.UniqueViolation):
+        core.crear_cita_manual(f, core.generar_slots(f)[1], "Vieja", "5511112222", "Corte")
+
+
+def _intentar(fn, *args):
+    try:
+        fn(*args)
+    except ValueError as e:
+        return e
+    return None
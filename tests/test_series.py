@@ -0,0 +1,34 @@
+from datetime import timedelta
+import pytest
+from modules import core
+from tests.conftest import lunes
+
+
+def test_serie_reporta_conflictos_por_fecha():
+    f = lunes()
+    h = core.generar_slots(f)[0]
+    core.crear_cita_manual(f + timedelta(weeks=2), h, "Otra", "5599999999", "Corte")
+    core.crear_cita_manual(f + timedelta(weeks=4, days=2), h, "Ana", "5512345678", "Corte")
+    rep = core.crear_serie(f, h, "Ana", "5512345678", "Corte", cada_semanas=2, veces=4)
+    assert list(rep["estado"]) == ["ok", "horario_ocupado", "regla_7_dias", "ok"]
+    assert len(core.citas_por_dia(f)) == 1
+
+
+def test_serie_fuera_de_horario():
+    f = lunes()
+    rep = core.crear_serie(f, core.generar_slots(f)[-1], "Ana", "5512345678", "Corte",
+                           cada_semanas=1, veces=6)
+    assert set(rep["estado"]) == {"ok"}
+    # el sábado cierra a las 14:00
+    rep = core.crear_serie(f + timedelta(days=5), core.generar_slots(f)[-1], "Bea", "5522222222", "Corte",
+                           veces=2)
+    assert set(rep["estado"]) == {"fuera_de_horario"}
+
+
+def test_serie_no_recorta_en_silencio():
+    f = lunes()
+    assert len(core.fechas_serie(f, 1, hasta=f + timedelta(weeks=core.SERIE_MAX - 1))) == core.SERIE_MAX
+    with pytest.raises(ValueError, match="elige como última fecha"):
+        core.fechas_serie(f, 1, hasta=f + timedelta(weeks=core.SERIE_MAX))
+    with pytest.raises(ValueError, match="Como máximo"):
+        core.fechas_serie(f, 1, veces=core.SERIE_MAX + 1)
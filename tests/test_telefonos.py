@@ -0,0 +1,43 @@
+import pytest
+from modules import core, limites
+from tests.conftest import lunes, paciente
+
+
+def test_registro_rechaza_el_mismo_telefono_en_otro_formato():
+    paciente("55 1234 5678")
+    with pytest.raises(ValueError, match="ya está registrado"):
+        core.registrar_paciente("Otra", "+52 55 1234 5678", "x")
+
+
+def test_telefono_no_valido():
+    with pytest.raises(ValueError, match="Teléfono no válido"):
+        paciente("12345")
+
+
+def test_login_con_cualquier_formato_del_telefono():
+    pid = paciente("5512345678")
+    assert core.login_paciente("+525512345678", "secreta")["id"] == pid
+    assert core.login_paciente("55-1234-5678", "secreta")["id"] == pid
+    assert core.login_paciente("5512345678", "otra") is None
+
+
+def test_login_formatos_comparten_limite():
+    paciente("5512345678")
+    for tel in ["5512345678", "+525512345678", "55 1234 5678", "(55) 1234-5678", "5512345678"]:
+        assert core.login_paciente(tel, "mala") is None
+    with pytest.raises(limites.LoginBloqueado):
+        core.login_paciente("+52 55 1234 5678", "secreta")
+
+
+def test_cita_manual_reusa_al_paciente_por_e164():
+    f = lunes()
+    pid = paciente("5512345678")
+    core.crear_cita_manual(f, core.generar_slots(f)[0], "Ana", "+52 55 1234 5678", "Corte")
+    assert list(core.citas_por_dia(f)["paciente_id"]) == [pid]
+
+
+def test_login_de_registro_viejo_sin_e164():
+    # lo que deja la migración cuando el teléfono guardado no se pudo interpretar
+    pid = core.repo()._nuevo_paciente("Vieja", "12345", core.hash_password("secreta"))
+    assert core.login_paciente("123-45", "secreta")["id"] == pid
+    assert core.login_paciente("12345", "otra") is None